@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+
+# Replays a request trace against each eviction policy and reports hit ratios.
+# The default trace is a Zipf-distributed hot set with sizes spread over 1000x,
+# interrupted by scans that touch many cold keys once, like a nightly batch job.
+# A trace file has one "key size" pair per line.
+
+import argparse
+import random
+
+import numpy as np
+
+from dfs.eviction import eviction_policies
+
+
+def synthetic_trace(keys, requests, scan_every, scan_keys, seed):
+    rng = np.random.default_rng(seed)
+    sizes = {f"key_{i}": int(s) for i, s in enumerate(rng.lognormal(mean=10, sigma=1.5, size=keys).clip(1000, 1000000))}
+    ranks = rng.zipf(1.2, size=requests)
+    trace = []
+    scans = 0
+    for i, rank in enumerate(ranks):
+        if scan_every > 0 and i > 0 and i % scan_every == 0:
+            for j in range(scan_keys):
+                trace.append((f"scan_{scans}_{j}", 10000))
+            scans += 1
+        key = f"key_{(rank - 1) % keys}"
+        trace.append((key, sizes[key]))
+    return trace
+
+
+def read_trace(path):
+    with open(path) as f:
+        return [(key, int(size)) for key, size in (line.split() for line in f if line.strip())]
+
+
+def replay(policy_class, trace, max_memory):
+    # mirrors how FileCache drives a policy: every request is recorded, and a miss that's
+    # admitted unloads victims until the file fits before it becomes resident
+    policy = policy_class(max_memory)
+    resident = {}
+    used = 0
+    hits = hit_bytes = total_bytes = 0
+    for key, size in trace:
+        policy.access(key)
+        total_bytes += size
+        if key in resident:
+            hits += 1
+            hit_bytes += size
+            continue
+        if size > max_memory or (used + size > max_memory and not policy.admit(key, size)):
+            continue
+        while used + size > max_memory:
+            victim = policy.victim()
+            policy.remove(victim)
+            used -= resident.pop(victim)
+        policy.insert(key, size)
+        resident[key] = size
+        used += size
+    return hits / len(trace), hit_bytes / total_bytes
+
+
+parser = argparse.ArgumentParser(description='Compare eviction policy hit ratios by replaying a trace')
+parser.add_argument('--trace', type=str, help='trace file of "key size" lines (default: a synthetic trace)', default=None)
+parser.add_argument('--memory', type=int, help='cache memory in bytes', default=50*2**20)
+parser.add_argument('--keys', type=int, help='number of keys in the synthetic trace', default=10000)
+parser.add_argument('--requests', type=int, help='number of requests in the synthetic trace', default=200000)
+parser.add_argument('--scan-every', type=int, help='requests between scans in the synthetic trace (0 for none)', default=50000)
+parser.add_argument('--scan-keys', type=int, help='cold keys touched by each scan', default=20000)
+parser.add_argument('--seed', type=int, help='random seed', default=0)
+
+args = parser.parse_args()
+
+random.seed(args.seed)
+trace = read_trace(args.trace) if args.trace else synthetic_trace(args.keys, args.requests, args.scan_every, args.scan_keys, args.seed)
+print(f"{len(trace)} requests, {len(set(k for k, _ in trace))} keys, {args.memory} bytes of memory")
+for name, policy_class in eviction_policies.items():
+    hit_ratio, byte_hit_ratio = replay(policy_class, trace, args.memory)
+    print(f"{name:>8}: hit ratio {hit_ratio:.3f}, byte hit ratio {byte_hit_ratio:.3f}")
@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+
+# Measures FileCache hit latency as the number of resident keys grows.
+# With O(1) LRU bookkeeping the per-hit cost should stay flat.
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from dfs.file_cache import FileCache
+
+
+def populate(root_path, key_count, size):
+    data = os.urandom(size)
+    names = []
+    for i in range(key_count):
+        name = f"key_{i}"
+        with open(os.path.join(root_path, name), "wb") as f:
+            f.write(data)
+        names.append(name)
+    return names
+
+
+def bench_hits(key_count, hits, size):
+    with tempfile.TemporaryDirectory() as root_path:
+        names = populate(root_path, key_count, size)
+        cache = FileCache(max_memory=key_count*size, root_path=root_path)
+        for name in names:
+            cache.get_file(name)
+        sample = random.choices(names, k=hits)
+        start_t = time.perf_counter_ns()
+        for name in sample:
+            cache.get_file(name)
+        stop_t = time.perf_counter_ns()
+        cache.executor.shutdown()
+        return (stop_t - start_t) / hits
+
+
+parser = argparse.ArgumentParser(description='Benchmark FileCache hit latency vs. resident key count')
+parser.add_argument('--keys', type=int, nargs='+', help='resident key counts to test', default=[100, 1000, 10000, 50000])
+parser.add_argument('--hits', type=int, help='number of cache hits to time per key count', default=20000)
+parser.add_argument('--size', type=int, help='size of each file in bytes', default=64)
+
+args = parser.parse_args()
+
+for key_count in args.keys:
+    print(f"{key_count:>8} keys: {bench_hits(key_count, args.hits, args.size)/1000:.2f} us/hit")
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+
+# Compares boolean-mask range slicing with binary-search slicing on a sorted DatetimeIndex,
+# as done by PandasDataFrameCache.get_dataframe for range_type="timestamp".
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from dfs.df_cache import PandasDataFrameCache
+
+
+def mask_slice(df, range_start, range_end):
+    return df[(df.index >= range_start)&(df.index <= range_end)]
+
+
+def bench(func, windows, *args):
+    start_t = time.perf_counter_ns()
+    for range_start, range_end in windows:
+        func(*args, range_start, range_end)
+    stop_t = time.perf_counter_ns()
+    return (stop_t - start_t) / len(windows)
+
+
+parser = argparse.ArgumentParser(description='Benchmark timestamp range slicing')
+parser.add_argument('--rows', type=int, help='number of rows in the DataFrame', default=10_000_000)
+parser.add_argument('--window', type=int, help='number of rows in each queried window', default=1000)
+parser.add_argument('--queries', type=int, help='number of queries to time', default=50)
+
+args = parser.parse_args()
+
+index = pd.date_range("2000-01-01", periods=args.rows, freq="s")
+df = pd.DataFrame({'A': np.arange(args.rows), 'B': np.random.rand(args.rows)}, index=index)
+cache = PandasDataFrameCache()
+starts = np.random.randint(0, args.rows - args.window, size=args.queries)
+windows = [(index[i], index[i + args.window - 1]) for i in starts]
+# pandas caches the sortedness check on the index, as it would be for a frame held in the cache
+df.index.is_monotonic_increasing
+
+mask_ns = bench(mask_slice, windows, df)
+search_ns = bench(lambda *a: cache._slice(*a, "timestamp"), windows, df)
+print(f"rows: {args.rows} window: {args.window}")
+print(f"boolean mask:  {mask_ns/1000:.1f} us/query")
+print(f"searchsorted:  {search_ns/1000:.1f} us/query ({mask_ns/search_ns:.0f}x)")
@@ -0,0 +1,280 @@
+import asyncio
+import logging
+import multiprocessing as mp
+import struct
+
+import simdjson as json
+
+from .codecs import available_wire_codecs, default_wire_codec, get_wire_codec
+from .helpers import tinfo
+
+# messages larger than this are decoded on the default executor instead of the event loop
+DECODE_OFFLOAD_SIZE = 2**20
+
+
+async def async_send_msg(writer, msg):
+    buffers = [memoryview(b).cast('B') for b in (msg if isinstance(msg, list) else [msg])]
+    writer.writelines([struct.pack('>I', sum(b.nbytes for b in buffers)), *buffers])
+    await writer.drain()
+
+
+async def async_recv_msg(reader):
+    try:
+        msglen = struct.unpack('>I', await reader.readexactly(4))[0]
+        return await reader.readexactly(msglen)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+async def async_send_cmd(writer, name, **kwargs):
+    await async_send_msg(writer, json.dumps({'name': name, **kwargs}).encode())
+
+
+async def async_recv_json(reader):
+    data = await async_recv_msg(reader)
+    if data is None:
+        raise ConnectionError("connection closed")
+    return json.loads(data.decode())
+
+
+async def async_recv_status(reader):
+    status = await async_recv_json(reader)
+    if status['success']:
+        return True
+    raise(RuntimeError(status['err']))
+
+
+async def async_recv_df(reader, codec=None):
+    data = await async_recv_msg(reader)
+    if data is None or len(data) == 0:
+        raise ValueError("no data")
+    return await async_decode_df(data, codec)
+
+
+async def async_decode_df(data, codec=None):
+    codec = get_wire_codec(codec)
+    if len(data) < DECODE_OFFLOAD_SIZE:
+        return codec.decode(data)
+    return await asyncio.get_running_loop().run_in_executor(None, codec.decode, data)
+
+
+async def async_send_df(writer, df, codec=None):
+    await async_send_msg(writer, get_wire_codec(codec).encode(df))
+
+
+class AsyncPoolConnection:
+    def __init__(self, reader, writer, codec):
+        self.reader = reader
+        self.writer = writer
+        self.codec = codec
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncDataFrameClient:
+    def __init__(self, pool, conn):
+        self.pool = pool
+        self.conn = conn
+        self.reader = conn.reader
+        self.writer = conn.writer
+        self.codec = conn.codec
+
+    async def unload(self, *args):
+        await async_send_cmd(self.writer, 'unload', key_path=args)
+        await async_recv_status(self.reader)
+
+    async def load(self, *args):
+        await async_send_cmd(self.writer, 'load', key_path=args)
+        return await async_recv_json(self.reader)
+
+    async def get_stats(self, level=None):
+        await async_send_cmd(self.writer, 'stats', level=level)
+        return await async_recv_json(self.reader)
+
+    async def filter(self, *args, range_start=None, range_end=None, range_type="timestamp", columns=None, codec=None):
+        codec = codec or self.codec
+        await async_send_cmd(self.writer, 'df:filter', key_path=args, range_start=range_start, range_end=range_end, range_type=range_type, columns=columns, codec=codec)
+        return await async_recv_df(self.reader, codec)
+
+    async def mfilter(self, key_paths, range_start=None, range_end=None, range_type="timestamp", columns=None, codec=None, key_column=None):
+        """
+        Filter many keys with the same range and columns in one command, like DataFrameClient.mfilter.
+        """
+        codec = codec or self.codec
+        await async_send_cmd(self.writer, 'df:mfilter', key_paths=[list(k) for k in key_paths], range_start=range_start, range_end=range_end, range_type=range_type, columns=columns, codec=codec, key_column=key_column)
+        if key_column is not None:
+            return await async_recv_df(self.reader, codec)
+        return [await async_recv_df(self.reader, codec) for _ in key_paths]
+
+    async def filter_iter(self, *args, range_start=None, range_end=None, range_type="timestamp", columns=None, codec=None, batch_rows=None):
+        """
+        An async iterator over the result of a filter in DataFrames of at most batch_rows rows,
+        like DataFrameClient.filter_iter.  The connection can't be used for anything else until
+        the iterator is exhausted or closed with aclose().
+        """
+        codec = codec or self.codec
+        await async_send_cmd(self.writer, 'df:filter_stream', key_path=args, range_start=range_start, range_end=range_end, range_type=range_type, columns=columns, codec=codec, batch_rows=batch_rows)
+        ended = False
+        try:
+            while True:
+                data = await async_recv_msg(self.reader)
+                if data is None:
+                    raise ConnectionError("connection closed while streaming")
+                if len(data) == 0:
+                    ended = True
+                    return
+                yield await async_decode_df(data, codec)
+        finally:
+            # read the rest of an abandoned stream so the connection can be reused
+            while not ended:
+                data = await async_recv_msg(self.reader)
+                ended = data is None or len(data) == 0
+
+    async def query(self, query, *args, range_start=None, range_end=None, range_type="timestamp", columns=None, codec=None):
+        """
+        Evaluate a query against a filtered key on the server, like DataFrameClient.query.
+        """
+        codec = codec or self.codec
+        await async_send_cmd(self.writer, 'df:query', key_path=args, query=query, range_start=range_start, range_end=range_end, range_type=range_type, columns=columns, codec=codec)
+        await async_recv_status(self.reader)
+        return await async_recv_df(self.reader, codec)
+
+    async def create_index(self, column, *args, kind=None):
+        """
+        Declare a secondary index on a column of a key, like DataFrameClient.create_index.
+        """
+        await async_send_cmd(self.writer, 'df:create_index', key_path=args, column=column, kind=kind)
+        await async_recv_status(self.reader)
+
+    async def lookup(self, column, *args, values=None, start=None, end=None, columns=None, codec=None):
+        """
+        Retrieve the rows of a key by a column's values, like DataFrameClient.lookup.
+        """
+        codec = codec or self.codec
+        await async_send_cmd(self.writer, 'df:lookup', key_path=args, column=column, values=values, start=start, end=end, columns=columns, codec=codec)
+        await async_recv_status(self.reader)
+        return await async_recv_df(self.reader, codec)
+
+    async def update(self, df, *args, codec=None, fsync=False):
+        codec = codec or self.codec
+        await async_send_cmd(self.writer, 'df:update', key_path=args, codec=codec, fsync=fsync)
+        await async_send_df(self.writer, df, codec)
+        await async_recv_status(self.reader)
+
+    async def migrate(self, *args):
+        await async_send_cmd(self.writer, 'df:migrate', key_path=args)
+        return (await async_recv_json(self.reader))['migrated']
+
+
+class PooledConnection:
+    """
+    An async context manager that checks a client out of an AsyncDataFrameConnectionPool.
+    """
+    def __init__(self, pool, client_class):
+        self.pool = pool
+        self.client_class = client_class
+        self.conn = None
+
+    async def __aenter__(self):
+        self.conn = await self.pool.acquire()
+        return self.client_class(self.pool, self.conn)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        # a connection that failed mid-command may have unread data, so it isn't reused
+        self.pool.release(self.conn, discard=exc_type is not None)
+
+
+class AsyncDataFrameConnectionPool:
+    """
+    An asyncio connection pool speaking the same protocol as DataFrameConnectionPool.
+
+        async with AsyncDataFrameConnectionPool(host, port) as pool:
+            async with pool.get_connection() as c:
+                df = await c.filter("prices", "abc")
+    """
+    def __init__(self, host, port, max_connections=None, max_retries=None, client_class=None, codecs=None):
+        max_connections = max(1, max_connections or int(mp.cpu_count()*0.8))
+        max_retries = max_retries or 3
+        logging.info(f"Creating async connection pool with {max_connections} connections")
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.default_client_class = client_class or AsyncDataFrameClient
+        self.codecs = codecs or available_wire_codecs()
+        self.connections = []
+        self.semaphore = asyncio.Semaphore(max_connections)
+        self.negotiate = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        while len(self.connections) > 0:
+            conn = self.connections.pop()
+            try:
+                await async_send_cmd(conn.writer, 'close')
+                await async_recv_msg(conn.reader)
+            except Exception:
+                pass
+            finally:
+                conn.close()
+
+    def get_connection(self, client_class=None):
+        return PooledConnection(self, client_class or self.default_client_class)
+
+    async def acquire(self):
+        await self.semaphore.acquire()
+        try:
+            while len(self.connections) > 0:
+                conn = self.connections.pop()
+                if not conn.writer.is_closing() and not conn.reader.at_eof():
+                    return conn
+                tinfo(f"Releasing closed connection")
+                conn.close()
+            return await self._connect()
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    def release(self, conn, discard=False):
+        if discard:
+            conn.close()
+        else:
+            self.connections.append(conn)
+        self.semaphore.release()
+
+    async def _open(self):
+        attempts = 1
+        while True:
+            try:
+                return await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                if attempts >= self.max_retries:
+                    raise ConnectionError(f"Connection failed after {attempts} attempts")
+                tinfo(f"Connection Failed, Retrying...{attempts}")
+                await asyncio.sleep(2**attempts)
+                attempts += 1
+
+    async def _connect(self):
+        reader, writer = await self._open()
+        codec = None
+        if self.negotiate:
+            try:
+                await async_send_cmd(writer, 'hello', codecs=self.codecs)
+                data = await async_recv_msg(reader)
+            except ConnectionError:
+                data = None
+            if data is None:
+                # servers that predate codec negotiation drop the connection on 'hello'
+                tinfo(f"Codec negotiation failed, using {default_wire_codec}")
+                writer.close()
+                self.negotiate = False
+                reader, writer = await self._open()
+            else:
+                codec = json.loads(data.decode())['codec']
+        return AsyncPoolConnection(reader, writer, codec or default_wire_codec)
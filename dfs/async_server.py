@@ -0,0 +1,176 @@
+import asyncio
+import functools
+import logging
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import simdjson as json
+
+from .codecs import available_wire_codecs, default_wire_codec
+from .df_server import BufferedConnection, ClientCloseException, DataFrameCommandProcessor, FileCommandProcessor, choose_codec, process_request
+from .file_cache import CacheBusyError
+
+
+class AsyncServer:
+    """
+    An asyncio front end for the command processors.  Connections are served by the event loop, so
+    idle connections don't hold a thread.  The loop reads each command and its payload, the command
+    is processed on a bounded executor, and the loop writes the reply.
+
+    Args:
+        cache (FileCache): The cache to serve.
+        address (tuple): The (host, port) to listen on.
+        processor (SystemCommandProcessor): The command processor.
+        max_workers (int): The maximum number of commands processed concurrently.
+    """
+    def __init__(self, cache, address, processor, max_workers=None):
+        self.cache = cache
+        self.address = address
+        self.processor = processor
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.server_address = None
+        self.started = threading.Event()
+        self.loop = None
+        self.server = None
+        self.stop_event = None
+        self.connections = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.executor.shutdown(wait=False)
+
+    def serve_forever(self):
+        asyncio.run(self._serve_forever())
+
+    def shutdown(self):
+        self.started.wait()
+        self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    async def _serve_forever(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.server = await asyncio.start_server(self.handle, *self.address)
+        self.server_address = self.server.sockets[0].getsockname()[:2]
+        self.started.set()
+        try:
+            await self.stop_event.wait()
+        finally:
+            self.server.close()
+            # closing the streams ends each connection's read loop
+            for writer in self.connections.values():
+                writer.close()
+            await asyncio.gather(*self.connections.keys(), return_exceptions=True)
+
+    @staticmethod
+    async def read_frame(reader):
+        """
+        Read one length-prefixed frame.
+        """
+        msglen = struct.unpack('>I', await reader.readexactly(4))[0]
+        return await reader.readexactly(msglen)
+
+    @staticmethod
+    async def write(writer, buffers):
+        """
+        Write the buffered output of a processed command.
+        """
+        if len(buffers) > 0:
+            writer.writelines(buffers)
+            await writer.drain()
+
+    def flush(self, writer, buffers):
+        """
+        Write output flushed by a command still being processed, waiting until the client has
+        taken it so a streamed reply is never held in memory whole.
+        """
+        asyncio.run_coroutine_threadsafe(self.write(writer, buffers), self.loop).result()
+
+    async def reply(self, writer, command, frames):
+        """
+        Process a pipelined command on the executor and write its reply.
+        """
+        buffers, closed = await self.loop.run_in_executor(self.executor, process_request, self, command, frames)
+        # a reply is written with one call, so replies completing out of order don't interleave
+        writer.writelines(buffers)
+        if closed:
+            writer.close()
+            return
+        try:
+            await writer.drain()
+        except ConnectionError:
+            logging.info(f"Connection dropped before reply: {command}")
+
+    async def handle(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        logging.info(f'Connection created by {addr}')
+        self.connections[asyncio.current_task()] = writer
+        codec = default_wire_codec
+        pending = set()
+        try:
+            while True:
+                try:
+                    data = await self.read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionResetError):
+                    logging.info(f'Connection dropped by {addr}')
+                    break
+                command = json.loads(data.decode())
+                if command['name'] == 'hello':
+                    codec = choose_codec(command.get('codecs'))
+                    reply = json.dumps({'codec': codec, 'codecs': available_wire_codecs(), 'pipelining': True}).encode()
+                    writer.writelines([struct.pack('>I', len(reply)), reply])
+                    await writer.drain()
+                    continue
+                command.setdefault('codec', codec)
+                try:
+                    payload = [await self.read_frame(reader) for _ in range(self.processor.payload_frames(command))]
+                except (asyncio.IncompleteReadError, ConnectionResetError):
+                    logging.info(f'Connection dropped by {addr}')
+                    break
+                if 'request_id' in command:
+                    if len(payload) > 0:
+                        # writes are applied before later requests are read, so a connection reads its own writes
+                        await self.reply(writer, command, payload)
+                    else:
+                        task = asyncio.create_task(self.reply(writer, command, payload))
+                        pending.add(task)
+                        task.add_done_callback(pending.discard)
+                    continue
+                # commands without a request_id are answered in order
+                await asyncio.gather(*pending, return_exceptions=True)
+                conn = BufferedConnection(payload, flush=functools.partial(self.flush, writer))
+                try:
+                    handled = await self.loop.run_in_executor(self.executor, self.processor.process, self, conn, command)
+                    if not handled:
+                        logging.warning(f"command not handled: {command}")
+                except ClientCloseException as e:
+                    logging.info(f'Connection closed by {addr}')
+                    await self.write(writer, conn.outgoing)
+                    break
+                except MemoryError as e:
+                    logging.warning(f"memory error: {command}")
+                except CacheBusyError as e:
+                    logging.warning(f"cache busy: {command} {e}")
+                    break
+                except Exception as e:
+                    logging.exception(f"exception: {command} {e}")
+                    break
+                await self.write(writer, conn.outgoing)
+        finally:
+            # replies to pipelined requests are sent before the connection is closed
+            await asyncio.gather(*pending, return_exceptions=True)
+            self.connections.pop(asyncio.current_task(), None)
+            writer.close()
+            logging.info(f'Connection finished by {addr}')
+
+
+class AsyncDataFrameServer(AsyncServer):
+    def __init__(self, cache, address, max_workers=None):
+        super().__init__(cache, address, DataFrameCommandProcessor(), max_workers=max_workers)
+
+
+class AsyncFileServer(AsyncServer):
+    def __init__(self, cache, address, max_workers=None):
+        super().__init__(cache, address, FileCommandProcessor(), max_workers=max_workers)
@@ -0,0 +1,278 @@
+import bisect
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .df_client import DataFrameConnectionPool
+from .helpers import concat_with_keys
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    A consistent hash ring mapping keys to nodes.  Each node is placed at vnodes points on the ring,
+    and a key belongs to the node at the first point after the key's hash, so keys are spread evenly
+    and adding or removing a node only moves the keys of the points it gains or loses, about
+    1/len(nodes) of them.
+
+    Args:
+        nodes (list): The nodes, as strings, e.g. "host:port".
+        vnodes (int): The number of points each node is placed at (default: 160).
+    """
+    def __init__(self, nodes=None, vnodes=None):
+        self.vnodes = vnodes or 160
+        self.nodes = []
+        # the sorted points and the node at each, replaced together so lookups don't need a lock
+        self.ring = ([], [])
+        self.lock = threading.Lock()
+        for node in nodes or []:
+            self.add_node(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add_node(self, node):
+        """
+        Add a node to the ring.  Adding a node that's already in the ring does nothing.
+
+        Args:
+            node (str): The node.
+        """
+        with self.lock:
+            if node not in self.nodes:
+                self._build(self.nodes + [node])
+
+    def remove_node(self, node):
+        """
+        Remove a node from the ring.  Removing a node that isn't in the ring does nothing.
+
+        Args:
+            node (str): The node.
+        """
+        with self.lock:
+            if node in self.nodes:
+                self._build([n for n in self.nodes if n != node])
+
+    def _build(self, nodes):
+        assert self.lock.locked()
+        points = sorted((ring_hash(f"{node}#{i}"), node) for node in nodes for i in range(self.vnodes))
+        self.ring = ([p[0] for p in points], [p[1] for p in points])
+        self.nodes = nodes
+
+    def node_for(self, key):
+        """
+        Returns the node a key belongs to.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            str: The node.
+        """
+        points, owners = self.ring
+        if len(points) == 0:
+            raise ValueError("the ring has no nodes")
+        return owners[bisect.bisect(points, ring_hash(key)) % len(points)]
+
+
+class ClusterConnectionPool:
+    """
+    A connection pool for a cluster of DataFrame servers, each caching a share of the keys.  Keys are
+    routed to servers with a HashRing, so adding or removing a server moves as few keys as possible.
+    Each server has its own DataFrameConnectionPool, and requests for many keys are split by server
+    and sent to the servers in parallel.
+
+    Servers don't share or replicate keys, so a key written through one ring must be read through the
+    same ring.  Keys moved by adding or removing a server are read from the server they move to,
+    which must see the same files, e.g. on shared storage, or be written again.
+
+    Args:
+        nodes (list): The servers, as (host, port) tuples.
+        vnodes (int): The number of points each server is placed at on the ring (default: 160).
+        max_workers (int): The number of threads fanning requests out to servers (default: 2 per server, at least 4).
+        kwargs: The arguments of each server's DataFrameConnectionPool, e.g. max_connections.
+    """
+    def __init__(self, nodes, vnodes=None, max_workers=None, **kwargs):
+        self.pool_kwargs = kwargs
+        self.ring = HashRing(vnodes=vnodes)
+        self.pools = {}
+        self.lock = threading.Lock()
+        for host, port in nodes:
+            self.add_node(host, port)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or max(4, 2 * len(self.pools)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._shutdown()
+
+    def _shutdown(self):
+        with self.lock:
+            pools = list(self.pools.values())
+            self.pools.clear()
+        for pool in pools:
+            pool._shutdown()
+        self.executor.shutdown()
+
+    def add_node(self, host, port):
+        """
+        Add a server to the cluster, which takes over the keys of the ring points it's placed at.
+
+        Args:
+            host (str): The server's host.
+            port (int): The server's port.
+        """
+        node = f"{host}:{port}"
+        with self.lock:
+            if node not in self.pools:
+                self.pools[node] = DataFrameConnectionPool(host, port, **self.pool_kwargs)
+        self.ring.add_node(node)
+
+    def remove_node(self, host, port):
+        """
+        Remove a server from the cluster.  Its keys are routed to the other servers, and its idle
+        connections are closed.
+
+        Args:
+            host (str): The server's host.
+            port (int): The server's port.
+        """
+        node = f"{host}:{port}"
+        self.ring.remove_node(node)
+        with self.lock:
+            pool = self.pools.pop(node, None)
+        if pool is not None:
+            pool._shutdown()
+
+    @property
+    def nodes(self):
+        return list(self.ring.nodes)
+
+    def node_for(self, *args):
+        """
+        Returns the server a key path is routed to, as "host:port".
+        """
+        return self.ring.node_for('/'.join(args))
+
+    def pool_for(self, *args):
+        """
+        Returns the DataFrameConnectionPool of the server a key path is routed to.
+        """
+        while True:
+            node = self.node_for(*args)
+            with self.lock:
+                pool = self.pools.get(node)
+            # a server removed after the key was routed is no longer in the ring
+            if pool is not None:
+                return pool
+
+    def get_connection(self, *args, client_class=None):
+        """
+        Returns a client connected to the server a key path is routed to, e.g.
+
+            with pool.get_connection("prices", "abc") as c:
+                df = c.filter("prices", "abc")
+
+        Args:
+            args: The key path.
+            client_class (type): The client class (default: the pools' client class).
+        """
+        return self.pool_for(*args).get_connection(client_class)
+
+    def filter(self, *args, **kwargs):
+        with self.get_connection(*args) as c:
+            return c.filter(*args, **kwargs)
+
+    def query(self, query, *args, **kwargs):
+        with self.get_connection(*args) as c:
+            return c.query(query, *args, **kwargs)
+
+    def create_index(self, column, *args, **kwargs):
+        with self.get_connection(*args) as c:
+            return c.create_index(column, *args, **kwargs)
+
+    def lookup(self, column, *args, **kwargs):
+        with self.get_connection(*args) as c:
+            return c.lookup(column, *args, **kwargs)
+
+    def update(self, df, *args, **kwargs):
+        with self.get_connection(*args) as c:
+            return c.update(df, *args, **kwargs)
+
+    def migrate(self, *args):
+        with self.get_connection(*args) as c:
+            return c.migrate(*args)
+
+    def _fan_out(self, key_paths, fn):
+        """
+        Split key paths by server and call fn(client, key_paths) for each server in parallel.
+
+        Returns:
+            list: The results fn returned for each key path, in the order of key_paths.
+        """
+        key_paths = [tuple(k) for k in key_paths]
+        by_node = {}
+        for i, key_path in enumerate(key_paths):
+            by_node.setdefault(self.node_for(*key_path), []).append(i)
+
+        def run(positions):
+            with self.get_connection(*key_paths[positions[0]]) as c:
+                return fn(c, [key_paths[i] for i in positions])
+
+        futures = {node: self.executor.submit(run, positions) for node, positions in by_node.items()}
+        results = [None] * len(key_paths)
+        errors = []
+        for node, future in futures.items():
+            try:
+                for i, result in zip(by_node[node], future.result()):
+                    results[i] = result
+            except Exception as e:
+                logging.warning(f"request to {node} failed: {e!r}")
+                errors.append((node, e))
+        # every server's reply is waited on before raising
+        if len(errors) > 0:
+            node, e = errors[0]
+            raise RuntimeError(f"{len(errors)} of {len(futures)} servers failed: {node}: {e}") from e
+        return results
+
+    def mfilter(self, key_paths, range_start=None, range_end=None, range_type="timestamp", columns=None, codec=None, key_column=None):
+        """
+        Filter many keys with the same range and columns, like DataFrameClient.mfilter.  Each server
+        is sent one df:mfilter command with its keys, and the servers are sent them in parallel.
+
+        Returns:
+            Union[list, DataFrame]: The DataFrames, in the order of key_paths, or the concatenated DataFrame.
+        """
+        dfs = self._fan_out(key_paths, lambda c, k: c.mfilter(k, range_start, range_end, range_type, columns=columns, codec=codec))
+        if key_column is not None:
+            return concat_with_keys(dfs, ['/'.join(k) for k in key_paths], key_column)
+        return dfs
+
+    def filter_many(self, key_paths, range_start=None, range_end=None, range_type="timestamp", columns=None, codec=None, window=None):
+        """
+        Filter many keys with the same range and columns, like DataFrameClient.filter_many, pipelining
+        each server's requests over one of its connections, with the servers in parallel.
+
+        Returns:
+            list: The DataFrames, in the order of key_paths.
+        """
+        return self._fan_out(key_paths, lambda c, k: c.filter_many(k, range_start, range_end, range_type, columns=columns, codec=codec, window=window))
+
+    def get_stats(self, level=None):
+        """
+        Returns the stats of every server, by "host:port".
+        """
+        with self.lock:
+            pools = dict(self.pools)
+
+        def stats(pool):
+            with pool.get_connection() as c:
+                return c.get_stats(level=level)
+
+        futures = {node: self.executor.submit(stats, pool) for node, pool in pools.items()}
+        return {node: future.result() for node, future in futures.items()}
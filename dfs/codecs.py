@@ -0,0 +1,478 @@
+import gzip
+import pickle
+import struct
+
+
+class DataFrameCodec:
+    """
+    Serializes DataFrames to bytes and back.  Every codec can be used on the wire; codecs that
+    can also store DataFrames in cache files are StorageCodecs.
+    """
+    name = None
+
+    def serialize(self, df):
+        """
+        Serialize a DataFrame.
+
+        Args:
+            df (DataFrame): The DataFrame to serialize.
+
+        Returns:
+            bytes: The serialized DataFrame.
+        """
+        raise NotImplementedError()
+
+    def deserialize(self, data, columns=None):
+        """
+        Deserialize a DataFrame.
+
+        Args:
+            data (bytes): The serialized DataFrame.
+            columns (list): Only return these columns (default: all columns).
+
+        Returns:
+            DataFrame: The deserialized DataFrame.
+        """
+        raise NotImplementedError()
+
+    def encode(self, df):
+        """
+        Encode a DataFrame for sending over the wire.
+
+        Args:
+            df (DataFrame): The DataFrame to encode.
+
+        Returns:
+            list: The buffers that make up the message, in order.
+        """
+        return [self.serialize(df)]
+
+    def decode(self, data):
+        """
+        Decode a DataFrame received over the wire.
+
+        Args:
+            data (bytes): The received message.
+
+        Returns:
+            DataFrame: The decoded DataFrame.
+        """
+        return self.deserialize(data)
+
+    def is_available(self):
+        """
+        Returns True if the optional dependencies this codec needs are installed.
+        """
+        return True
+
+
+class StorageCodec(DataFrameCodec):
+    """
+    A codec for cache files.  Each storage codec writes a format whose leading bytes (magic)
+    identify it, so the codec of an existing file can always be sniffed when reading.
+    """
+    magic = None
+    columnar = False
+
+    def read_file(self, file_path, columns=None):
+        """
+        Read a DataFrame from a file.  Columnar codecs only read the requested columns from disk.
+
+        Args:
+            file_path (str): The path of the file.
+            columns (list): Only return these columns (default: all columns).
+
+        Returns:
+            DataFrame: The deserialized DataFrame.
+        """
+        with open(file_path, 'rb') as f:
+            return self.deserialize(f.read(), columns=columns)
+
+    def can_decode(self, data):
+        """
+        Returns True if the data starts with this codec's magic bytes.
+        """
+        return bytes(data[:len(self.magic)]) == self.magic
+
+    def wrote_file(self, file_path):
+        """
+        Returns True if the file is in this codec's format with this codec's compression.  The
+        compression level isn't recorded in the file, so files differing only in level match.
+
+        Args:
+            file_path (str): The path of the file.
+        """
+        with open(file_path, 'rb') as f:
+            return self.can_decode(f.read(8))
+
+
+class PickleCodec(StorageCodec):
+    """
+    Pickled DataFrames with optional gzip, lz4 or zstd compression.
+
+    Args:
+        compression (str): One of None, 'gzip', 'lz4' or 'zstd'.
+        level (int): The compression level, or None for the compressor's default.
+    """
+    magics = {
+        None: b'\x80',
+        'gzip': b'\x1f\x8b',
+        'lz4': b'\x04\x22\x4d\x18',
+        'zstd': b'\x28\xb5\x2f\xfd',
+    }
+
+    def __init__(self, compression=None, level=None):
+        if compression not in self.magics:
+            raise ValueError(f"unknown pickle compression: {compression}")
+        self.compression = compression
+        self.level = level
+        self.name = "pickle" if compression is None else f"pickle.{compression}"
+        self.magic = self.magics[compression]
+
+    def is_available(self):
+        try:
+            if self.compression == 'lz4':
+                import lz4.frame
+            elif self.compression == 'zstd':
+                import zstandard
+        except ImportError:
+            return False
+        return True
+
+    def compress(self, data):
+        if self.compression == 'gzip':
+            return gzip.compress(data, compresslevel=9 if self.level is None else self.level)
+        elif self.compression == 'lz4':
+            import lz4.frame
+            return lz4.frame.compress(data, compression_level=self.level or 0)
+        elif self.compression == 'zstd':
+            import zstandard
+            return zstandard.ZstdCompressor(level=self.level or 3).compress(data)
+        return data
+
+    def decompress(self, data):
+        if self.compression == 'gzip':
+            return gzip.decompress(data)
+        elif self.compression == 'lz4':
+            import lz4.frame
+            return lz4.frame.decompress(data)
+        elif self.compression == 'zstd':
+            import zstandard
+            return zstandard.ZstdDecompressor().decompress(data)
+        return data
+
+    def serialize(self, df):
+        return self.compress(pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def deserialize(self, data, columns=None):
+        # pickle.loads reads bytes-like data in place, unlike BytesIO which copies a bytearray
+        df = pickle.loads(self.decompress(data))
+        return df if columns is None else project_columns(df, columns)
+
+
+class Pickle5Codec(DataFrameCodec):
+    """
+    DataFrames pickled with protocol 5, with the array buffers sent out-of-band.  On the wire
+    the buffers follow the pickle uncopied, and on decode the arrays are views of the received
+    message.  Only used on the wire.
+    """
+    name = "pickle5"
+
+    def encode(self, df):
+        buffers = []
+        data = pickle.dumps(df, protocol=5, buffer_callback=buffers.append)
+        buffers = [b.raw() for b in buffers]
+        header = struct.pack(f'>I{len(buffers)+1}Q', len(buffers), len(data), *[b.nbytes for b in buffers])
+        return [header, data, *buffers]
+
+    def decode(self, data):
+        view = memoryview(data)
+        count = struct.unpack_from('>I', view)[0]
+        lengths = struct.unpack_from(f'>{count+1}Q', view, 4)
+        offset = 4 + 8*(count+1)
+        parts = []
+        for length in lengths:
+            parts.append(view[offset:offset+length])
+            offset += length
+        return pickle.loads(parts[0], buffers=parts[1:])
+
+
+class ArrowIPCCodec(StorageCodec):
+    """
+    DataFrames stored in the Arrow IPC file format, with optional lz4 or zstd buffer compression.
+    Requires pyarrow.
+
+    Args:
+        compression (str): One of None, 'lz4' or 'zstd'.
+    """
+    magic = b'ARROW1'
+    columnar = True
+
+    def __init__(self, compression=None):
+        if compression not in (None, 'lz4', 'zstd'):
+            raise ValueError(f"unknown arrow compression: {compression}")
+        self.compression = compression
+        self.name = "arrow" if compression is None else f"arrow.{compression}"
+
+    def is_available(self):
+        try:
+            import pyarrow
+        except ImportError:
+            return False
+        return True
+
+    # the IPC reader doesn't expose the buffer compression, so it's recorded in the schema metadata
+    compression_key = b'dfs.compression'
+
+    def serialize(self, df):
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        table = table.replace_schema_metadata({**table.schema.metadata, self.compression_key: (self.compression or '').encode()})
+        sink = pa.BufferOutputStream()
+        options = pa.ipc.IpcWriteOptions(compression=self.compression)
+        with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    def wrote_file(self, file_path):
+        import pyarrow as pa
+        if not super().wrote_file(file_path):
+            return False
+        with pa.memory_map(file_path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+        # files written before the compression was recorded are treated as not matching
+        compression = metadata.get(self.compression_key)
+        return compression is not None and compression.decode() == (self.compression or '')
+
+    def deserialize(self, data, columns=None):
+        import pyarrow as pa
+        return self._read(pa.py_buffer(data), columns)
+
+    def read_file(self, file_path, columns=None):
+        import pyarrow as pa
+        with pa.memory_map(file_path) as source:
+            return self._read(source, columns)
+
+    def _read(self, source, columns):
+        import pyarrow as pa
+        options = None
+        if columns is not None:
+            schema = pa.ipc.open_file(source).schema
+            names = field_names(schema, columns) + [c for c in schema.pandas_metadata['index_columns'] if isinstance(c, str)]
+            options = pa.ipc.IpcReadOptions(included_fields=[schema.get_field_index(n) for n in names])
+        df = pa.ipc.open_file(source, options=options).read_all().to_pandas()
+        return df if columns is None else project_columns(df, columns)
+
+
+class ArrowStreamCodec(DataFrameCodec):
+    """
+    DataFrames sent as an Arrow IPC stream, with optional lz4 or zstd buffer compression.
+    Only used on the wire.  Requires pyarrow.
+
+    Args:
+        compression (str): One of None, 'lz4' or 'zstd'.
+    """
+    def __init__(self, compression=None):
+        if compression not in (None, 'lz4', 'zstd'):
+            raise ValueError(f"unknown arrow compression: {compression}")
+        self.compression = compression
+        self.name = "arrow" if compression is None else f"arrow.{compression}"
+
+    def is_available(self):
+        try:
+            import pyarrow
+        except ImportError:
+            return False
+        return True
+
+    def serialize(self, df):
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        sink = pa.BufferOutputStream()
+        options = pa.ipc.IpcWriteOptions(compression=self.compression)
+        with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+        return sink.getvalue()
+
+    def deserialize(self, data, columns=None):
+        import pyarrow as pa
+        df = pa.ipc.open_stream(pa.py_buffer(data)).read_all().to_pandas()
+        return df if columns is None else project_columns(df, columns)
+
+
+class ParquetCodec(StorageCodec):
+    """
+    DataFrames stored as Parquet, with optional snappy, lz4 or zstd compression.
+    Requires pyarrow.
+
+    Args:
+        compression (str): One of None, 'snappy', 'lz4' or 'zstd'.
+    """
+    magic = b'PAR1'
+    columnar = True
+
+    def __init__(self, compression=None):
+        if compression not in (None, 'snappy', 'lz4', 'zstd'):
+            raise ValueError(f"unknown parquet compression: {compression}")
+        self.compression = compression
+        self.name = "parquet" if compression is None else f"parquet.{compression}"
+
+    def is_available(self):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        return True
+
+    def serialize(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        sink = pa.BufferOutputStream()
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=True), sink, compression=self.compression or 'none')
+        return sink.getvalue().to_pybytes()
+
+    def deserialize(self, data, columns=None):
+        import pyarrow as pa
+        return self._read(pa.BufferReader(pa.py_buffer(data)), columns)
+
+    def read_file(self, file_path, columns=None):
+        return self._read(file_path, columns)
+
+    def wrote_file(self, file_path):
+        import pyarrow.parquet as pq
+        if not super().wrote_file(file_path):
+            return False
+        metadata = pq.ParquetFile(file_path).metadata
+        if metadata.num_row_groups == 0 or metadata.num_columns == 0:
+            return True
+        compression = metadata.row_group(0).column(0).compression.lower()
+        return {'uncompressed': None, 'lz4_raw': 'lz4'}.get(compression, compression) == self.compression
+
+    def _read(self, source, columns):
+        import pyarrow.parquet as pq
+        if columns is not None:
+            df = pq.read_pandas(source, columns=field_names(pq.read_schema(source), columns)).to_pandas()
+            return project_columns(df, columns)
+        return pq.read_pandas(source).to_pandas()
+
+
+def field_names(schema, columns):
+    """
+    Returns the names of the Arrow fields that store the requested DataFrame columns.  Arrow field
+    names are strings, so columns with other labels (e.g. ints) are found through the pandas
+    metadata.  Columns that don't exist are skipped.
+
+    Args:
+        schema (pyarrow.Schema): The schema of a table converted from pandas.
+        columns (list): The DataFrame column labels.
+
+    Returns:
+        list: The field names.
+    """
+    metadata = schema.pandas_metadata
+    if metadata is None:
+        names = set(schema.names)
+        return [str(c) for c in columns if str(c) in names]
+    fields = {c['name']: c['field_name'] for c in metadata['columns'] if c['name'] is not None}
+    return [fields[str(c)] for c in columns if str(c) in fields]
+
+
+def project_columns(df, columns):
+    """
+    Returns the requested columns of a DataFrame, in the requested order.  Columns that
+    don't exist in the DataFrame are returned as empty (NaN) columns.
+
+    Args:
+        df (DataFrame): The DataFrame to project.
+        columns (list): The columns to return.
+
+    Returns:
+        DataFrame: The projected DataFrame.
+    """
+    return df.reindex(columns=list(columns))
+
+
+codecs = {c.name: c for c in [
+    PickleCodec(),
+    PickleCodec('gzip'),
+    PickleCodec('lz4'),
+    PickleCodec('zstd'),
+    ArrowIPCCodec(),
+    ArrowIPCCodec('lz4'),
+    ArrowIPCCodec('zstd'),
+    ParquetCodec(),
+    ParquetCodec('snappy'),
+    ParquetCodec('lz4'),
+    ParquetCodec('zstd'),
+]}
+
+
+# codecs for sending DataFrames over the wire, in the client's default order of preference
+wire_codecs = {c.name: c for c in [
+    Pickle5Codec(),
+    PickleCodec(),
+    PickleCodec('lz4'),
+    PickleCodec('zstd', level=1),
+    PickleCodec('gzip', level=1),
+    ArrowStreamCodec(),
+    ArrowStreamCodec('lz4'),
+    ArrowStreamCodec('zstd'),
+]}
+
+# the codec used by clients and servers that don't negotiate one
+default_wire_codec = 'pickle.gzip'
+
+
+def get_codec(name):
+    """
+    Returns the storage codec registered under the specified name.
+
+    Args:
+        name (str): The codec name, e.g. 'pickle.gzip' or 'arrow.zstd'.
+
+    Returns:
+        StorageCodec: The codec.
+    """
+    codec = codecs.get(name)
+    if codec is None:
+        raise ValueError(f"unknown codec: {name} (available: {list(codecs.keys())})")
+    return codec
+
+
+def sniff_codec(data):
+    """
+    Returns a storage codec that can decode the specified data, based on its magic bytes.
+
+    Args:
+        data (bytes): The serialized DataFrame.
+
+    Returns:
+        StorageCodec: The codec.
+    """
+    for codec in codecs.values():
+        if codec.can_decode(data):
+            return codec
+    raise ValueError(f"unknown DataFrame format: {bytes(data[:8])}")
+
+
+def get_wire_codec(name):
+    """
+    Returns the wire codec registered under the specified name.
+
+    Args:
+        name (str): The codec name, e.g. 'pickle5' or 'pickle.lz4'.  None returns the default codec.
+
+    Returns:
+        DataFrameCodec: The codec.
+    """
+    codec = wire_codecs.get(name or default_wire_codec)
+    if codec is None:
+        raise ValueError(f"unknown wire codec: {name} (available: {list(wire_codecs.keys())})")
+    return codec
+
+
+def available_wire_codecs():
+    """
+    Returns the names of the wire codecs whose dependencies are installed, in order of preference.
+    """
+    return [name for name, codec in wire_codecs.items() if codec.is_available()]
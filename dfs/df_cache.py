@@ -1,9 +1,41 @@
+import functools
+import logging
+import os
 import threading
 import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
-from .file_cache import FileCache
-from .helpers import deserialize_df, df_memory_usage, serialize_df
+from .codecs import get_codec, project_columns, sniff_codec
+from .file_cache import CacheBusyError, FileCache
+from .indexes import get_index_kind
+from .result_cache import ResultCache
+from .segments import SEGMENT_MAGIC, encode_segment, is_segmented, iter_segments, merge_frames, scan_segments
+from .sizers import get_sizer
+
+
+def decode_dataframe(contents, sizer):
+    """
+    Decode the contents of a cache file, which may have appended segments, into a DataFrame.
+    A module function, so it can be run in a process pool.
+
+    Args:
+        contents (bytes): The contents of a cache file.
+        sizer (DataFrameSizer): Measures the DataFrame's memory usage.
+
+    Returns:
+        tuple: A DataFrame and its memory usage.
+    """
+    if len(contents) == 0:
+        df = pd.DataFrame()
+    elif is_segmented(contents):
+        frames = [sniff_codec(segment).deserialize(segment) for segment in iter_segments(contents) if len(segment) > 0]
+        df = merge_frames(frames) if len(frames) > 0 else pd.DataFrame()
+    else:
+        df = sniff_codec(contents).deserialize(contents)
+    return df, sizer.size(df)
 
 
 class PandasDataFrameCache(FileCache):
@@ -13,10 +45,64 @@ class PandasDataFrameCache(FileCache):
     Args:
         max_memory (int): The maximum amount of memory that the cache should use.
         root_path (str): The root directory for where the cache files should be stored.
+        executor (Executor): The executor used to load and write files.
+        codec (str or StorageCodec): The codec used when writing DataFrames (default: 'pickle.gzip').
+            Files are always read with the codec they were written in.
+        budget (MemoryBudget): A memory budget shared with other caches.
+        max_segments (int): The number of segments a file may grow to before it's compacted (default: 16).
+        sizer (str or DataFrameSizer): How DataFrames' memory usage is measured (default: 'sampled').
+        compressed_memory (int): The memory for the compressed tier (default: 0, no compressed tier).
+        eviction_policy (str or type): The EvictionPolicy choosing which DataFrames to unload (default: 'lru').
+        cpu_executor (Executor): The executor DataFrames are decoded on, which may be a ProcessPoolExecutor
+            (default: decoded on the executor reading the file).
+        max_pending_loads (int): The maximum number of DataFrames loading at once (default: unlimited).
+        admission_timeout (float): How long a request waits to start loading a DataFrame before
+            CacheBusyError is raised, in seconds (default: forever).
+        result_memory (int): The memory for cached encoded replies (default: 0, no replies are cached).
+
+    Updates append the new rows to the file as a segment instead of rewriting it, and segments are
+    merged when the file is loaded.  Once a file has more than max_segments segments, it's rewritten
+    as a single frame in the background.
+
+    The compressed tier keeps the file contents of recently loaded DataFrames, under its own memory
+    budget, so a DataFrame evicted from memory can be decoded again without reading it from disk.
+
+    The result cache keeps servers' encoded replies to repeated requests, also under its own memory
+    budget.  A file's replies are dropped when it's written or unloaded.
+
+    Secondary indexes declared with create_index map a column's values to row positions, so lookup
+    finds rows by a column other than the index without scanning it.  A file's indexes are built the
+    first time they're used after it's loaded, rebuilt when it's updated, and their memory is counted
+    with the DataFrame's.
     """
-    def __init__(self, max_memory=None, root_path=None):
-        super().__init__(max_memory=max_memory, root_path=root_path)
+    def __init__(self, max_memory=None, root_path=None, executor=None, codec=None, budget=None, max_segments=None, sizer=None, compressed_memory=None, eviction_policy=None,
+                 cpu_executor=None, max_pending_loads=None, admission_timeout=None, result_memory=None):
+        super().__init__(max_memory=max_memory, root_path=root_path, executor=executor, budget=budget, eviction_policy=eviction_policy,
+                         cpu_executor=cpu_executor, max_pending_loads=max_pending_loads, admission_timeout=admission_timeout)
         self.append_locks = weakref.WeakValueDictionary()
+        # updates waiting to be group committed, by file name
+        self.update_queues = {}
+        self.update_queues_lock = threading.Lock()
+        codec = codec or 'pickle.gzip'
+        self.codec = get_codec(codec) if isinstance(codec, str) else codec
+        self.max_segments = max_segments or 16
+        sizer = sizer or 'sampled'
+        self.sizer = get_sizer(sizer) if isinstance(sizer, str) else sizer
+        self.compressed_max_memory = compressed_memory or 0
+        self.compressed_memory_usage = 0
+        self.compressed = OrderedDict()
+        # bumped when a file is written, so contents read before the write aren't added to the tier
+        self.compressed_generations = {}
+        self.compressed_lock = threading.Lock()
+        self.compressed_hits = 0
+        self.compressed_misses = 0
+        self.results = ResultCache(result_memory)
+        # the declared index kinds of each file's columns, and the indexes built for its loaded DataFrame
+        self.index_specs = {}
+        self.indexes = {}
+        self.index_lock = threading.Lock()
+        # compactions wait on loads and writes, so they run apart from the executor doing those
+        self.compaction_executor = ThreadPoolExecutor(max_workers=1)
 
     def process_contents(self, contents):
         """
@@ -28,60 +114,459 @@ class PandasDataFrameCache(FileCache):
         Returns:
             tuple: A DataFrame and its memory usage.
         """
-        df = pd.DataFrame() if len(contents) == 0 else deserialize_df(contents)
-        return df, df_memory_usage(df)
+        return decode_dataframe(contents, self.sizer)
+
+    def contents_processor(self):
+        return functools.partial(decode_dataframe, sizer=self.sizer)
+
+    def read_contents(self, file_name):
+        """
+        Read the contents of a cache file from the compressed tier, or from disk if they aren't
+        there, in which case they're added to the tier.
+
+        Args:
+            file_name (str): The name of the cache file.
+
+        Returns:
+            bytes: The contents of the file.
+        """
+        if self.compressed_max_memory == 0:
+            return super().read_contents(file_name)
+        with self.compressed_lock:
+            contents = self.compressed.get(file_name)
+            if contents is not None:
+                self.compressed.move_to_end(file_name)
+                self.compressed_hits += 1
+                return contents
+            self.compressed_misses += 1
+            generation = self.compressed_generations.get(file_name, 0)
+        contents = super().read_contents(file_name)
+        with self.compressed_lock:
+            if self.compressed_generations.get(file_name, 0) == generation and len(contents) <= self.compressed_max_memory:
+                self._discard_compressed(file_name)
+                while self.compressed_memory_usage + len(contents) > self.compressed_max_memory:
+                    self.compressed_memory_usage -= len(self.compressed.popitem(last=False)[1])
+                self.compressed[file_name] = contents
+                self.compressed_memory_usage += len(contents)
+        return contents
+
+    def _discard_compressed(self, file_name):
+        assert self.compressed_lock.locked()
+        contents = self.compressed.pop(file_name, None)
+        if contents is not None:
+            self.compressed_memory_usage -= len(contents)
+
+    def _invalidate_compressed(self, file_name):
+        with self.compressed_lock:
+            self.compressed_generations[file_name] = self.compressed_generations.get(file_name, 0) + 1
+            self._discard_compressed(file_name)
+
+    def file_written(self, file_name):
+        self._invalidate_compressed(file_name)
+        self.results.invalidate(file_name)
+        self._drop_indexes(file_name)
+
+    def unload_file(self, file_name):
+        """
+        Unload a DataFrame from memory and from the compressed tier.
+
+        Args:
+            file_name (str): The name of the file to unload.
+        """
+        super().unload_file(file_name)
+        self._invalidate_compressed(file_name)
+        self.results.invalidate(file_name)
+        self._drop_indexes(file_name)
 
-    def get_dataframe(self, file_name, range_start=None, range_end=None, range_type="timestamp"):
+    def tier_stats(self):
+        stats = super().tier_stats()
+        stats['compressed'] = {
+            'hits': self.compressed_hits,
+            'misses': self.compressed_misses,
+            'used': self.compressed_memory_usage,
+            'max': self.compressed_max_memory,
+        }
+        stats['results'] = self.results.stats()
+        return stats
+
+    def get_result(self, file_name, params):
+        """
+        Look up a cached reply to a request for a file.  See ResultCache.get.
+        """
+        return self.results.get(file_name, params)
+
+    def put_result(self, file_name, params, version, data):
+        """
+        Cache the reply to a request for a file.  See ResultCache.put.
+        """
+        self.results.put(file_name, params, version, data)
+
+    def create_index(self, file_name, column, kind=None):
+        """
+        Declare a secondary index on a column of a DataFrame, used by lookup.  Declarations are kept
+        in memory only, so they're made again when the cache is restarted.
+
+        Args:
+            file_name (str): The name of the file that contains the DataFrame.
+            column (str): The column to index.
+            kind (str): The index kind: 'sorted' for point and range lookups, or 'hash' for point
+                lookups of categorical values (default: 'sorted').
+        """
+        kind = kind or 'sorted'
+        get_index_kind(kind)
+        with self.index_lock:
+            self.index_specs.setdefault(file_name, {})[column] = kind
+
+    def lookup(self, file_name, column, values=None, start=None, end=None, columns=None):
+        """
+        Retrieve the rows of a DataFrame whose value in a column is one of values, or is between start
+        and end, inclusive.  Columns with a declared index are searched with it, others are scanned.
+
+        Args:
+            file_name (str): The name of the file that contains the DataFrame.
+            column (str): The column to look up.
+            values: A value or a list of values to look up (default: look up the range from start to end).
+            start: The lowest value of the range, or None for no lower bound.
+            end: The highest value of the range, or None for no upper bound.
+            columns (list): The columns to retrieve (default: all columns).
+
+        Returns:
+            DataFrame: The rows found, in the DataFrame's order.
+        """
+        if values is not None and not isinstance(values, (list, tuple)):
+            values = [values]
+        try:
+            df = self.get_file(file_name)
+        except FileNotFoundError:
+            return pd.DataFrame()
+        if column not in df.columns:
+            raise ValueError(f"unknown column: {column}")
+        index = self._frame_indexes(file_name, df).get(column)
+        if index is None:
+            series = df[column]
+            mask = np.ones(len(df), dtype=bool)
+            if values is not None:
+                mask &= series.isin(values).to_numpy()
+            else:
+                if start is not None:
+                    mask &= (series >= start).to_numpy()
+                if end is not None:
+                    mask &= (series <= end).to_numpy()
+            df = df[mask]
+        else:
+            positions = index.lookup(values) if values is not None else index.range(start, end)
+            df = df.iloc[np.sort(positions)]
+        return df if columns is None else project_columns(df, columns)
+
+    def _frame_indexes(self, file_name, df):
+        """
+        Returns the declared indexes of a file's DataFrame by column, building them if they were
+        built for another DataFrame or not at all.
+        """
+        with self.index_lock:
+            specs = dict(self.index_specs.get(file_name, {}))
+            built = self.indexes.get(file_name)
+        indexes = dict(built[1]) if built is not None and built[0]() is df else {}
+        missing = {c: kind for c, kind in specs.items() if c in df.columns and (c not in indexes or indexes[c].kind != kind)}
+        if len(missing) == 0:
+            return indexes
+        new_indexes = {column: get_index_kind(kind)(df[column]) for column, kind in missing.items()}
+        indexes.update(new_indexes)
+        if self._account_index(file_name, df, sum(index.nbytes for index in new_indexes.values())):
+            with self.index_lock:
+                # kept until the DataFrame is garbage collected, if it's evicted without unload_file
+                ref = built[0] if built is not None and built[0]() is df else weakref.ref(df, lambda r: self._drop_indexes(file_name, r))
+                self.indexes[file_name] = (ref, indexes)
+        return indexes
+
+    def _account_index(self, file_name, df, memory_usage):
+        """
+        Add the memory usage of a DataFrame's indexes to its cache entry.
+
+        Returns:
+            bool: True if the DataFrame is cached and the memory was claimed, so the indexes can be kept.
+        """
+        with self.file_futures_lock:
+            info = self.file_futures.get(file_name)
+            if info is None or info[0] or not info[-1].done() or info[-1].exception() is not None or info[-1].result() is not df:
+                return False
+            if memory_usage == 0:
+                return True
+            if memory_usage > self.max_memory or not self.recover_memory(memory_usage):
+                return False
+            if self.file_futures.get(file_name) is not info:
+                # the DataFrame was evicted to make room for its own indexes
+                self._release_memory(memory_usage)
+                return False
+            self.file_futures[file_name] = (False, info[1] + memory_usage, info[-1])
+            self.eviction_policy.insert(file_name, info[1] + memory_usage)
+            return True
+
+    def _drop_indexes(self, file_name, ref=None):
+        with self.index_lock:
+            built = self.indexes.get(file_name)
+            if built is not None and (ref is None or built[0] is ref):
+                del self.indexes[file_name]
+
+    def codec_for(self, file_name):
+        """
+        A hook for choosing the codec used to write the specified file.
+
+        Args:
+            file_name (str): The name of the file being written.
+
+        Returns:
+            StorageCodec: The codec to write the file with.
+        """
+        return self.codec
+
+    def get_dataframe(self, file_name, range_start=None, range_end=None, range_type="timestamp", columns=None):
         """
         Retrieve a DataFrame from the cache.
 
+        If columns are requested and the file isn't loaded, files written with a columnar codec
+        are read directly from disk with only the requested columns, while the whole file is
+        loaded into the cache in the background for later requests.
+
         Args:
             file_name (str): The name of the file that contains the DataFrame.
             range_start (int or datetime): The start of the range of rows to retrieve.
             range_end (int or datetime): The end of the range of rows to retrieve.
             range_type (str): The type of the range (either 'timestamp' or 'index')
+            columns (list): The columns to retrieve (default: all columns).
 
         Returns:
             DataFrame: The requested DataFrame.
         """
+        df = None
+        if columns is not None:
+            df = self._read_columns(file_name, columns)
+        if df is None:
+            try:
+                df = self.get_file(file_name)
+            except FileNotFoundError:
+                df = pd.DataFrame()
+        df = self._slice(df, range_start, range_end, range_type)
+        return df if columns is None else project_columns(df, columns)
+
+    def get_dataframes(self, file_names, range_start=None, range_end=None, range_type="timestamp", columns=None):
+        """
+        Retrieve many DataFrames with the same range and columns.  The files that aren't loaded are
+        all loaded at once on the executor before any is waited on, so a batch costs about as much
+        as its slowest load rather than the sum of them.
+
+        Args:
+            file_names (list): The names of the files that contain the DataFrames.
+            range_start, range_end, range_type, columns: As for get_dataframe.
+
+        Returns:
+            list: The requested DataFrames, in the order of file_names.
+        """
+        futures = [self._start_load(file_name) for file_name in file_names]
+        return [self._loaded_dataframe(file_name, future, range_start, range_end, range_type, columns) for file_name, future in zip(file_names, futures)]
+
+    def _start_load(self, file_name):
+        """
+        Start loading a file for get_dataframes.
+
+        Returns:
+            Future: The load, or None if the file is retrieved with get_dataframe instead, e.g. it doesn't exist.
+        """
         try:
-            df = self.get_file(file_name)
-        except FileNotFoundError:
-            df = pd.DataFrame()
+            return self.load_file(file_name)
+        except (FileNotFoundError, CacheBusyError):
+            # get_dataframe returns an empty DataFrame for missing files, and waits for busy caches if it's configured to
+            return None
+
+    def _loaded_dataframe(self, file_name, future, range_start, range_end, range_type, columns):
+        if future is None:
+            return self.get_dataframe(file_name, range_start, range_end, range_type, columns=columns)
+        df = self._slice(future.result(), range_start, range_end, range_type)
+        return df if columns is None else project_columns(df, columns)
+
+    def _slice(self, df, range_start, range_end, range_type):
+        if range_start is None and range_end is None:
+            return df
+        if range_type != "timestamp":
+            return df[range_start:range_end]
+        if df.index.is_monotonic_increasing:
+            # update keeps the index sorted, so binary search the bounds and return a view
+            start = 0 if range_start is None else df.index.searchsorted(range_start, side='left')
+            end = len(df) if range_end is None else df.index.searchsorted(range_end, side='right')
+            return df.iloc[start:end]
         if range_start is None:
-            if range_end is None:
-                return df
-            else:
-                return df[(df.index <= range_end)] if range_type == "timestamp" else df[:range_end]
-        else:
-            if range_end is None:
-                return df[(df.index >= range_start)] if range_type == "timestamp" else df[range_start:]
-            else:
-                return df[(df.index >= range_start)&(df.index <= range_end)] if range_type == "timestamp" else df[range_start:range_end]
+            return df[(df.index <= range_end)]
+        elif range_end is None:
+            return df[(df.index >= range_start)]
+        return df[(df.index >= range_start)&(df.index <= range_end)]
+
+    def _read_columns(self, file_name, columns):
+        """
+        Read only the requested columns of a file that isn't loaded and was written with a columnar codec,
+        and start loading the whole file.  Files are replaced atomically when written, so the file read
+        here is always complete.
+
+        Returns:
+            DataFrame: The projected DataFrame, or None if the file is loaded or not columnar.
+        """
+        with self.file_futures_lock:
+            if file_name in self.file_futures:
+                return None
+        file_path = os.path.join(self.root_path, file_name)
+        try:
+            with open(file_path, 'rb') as f:
+                header = f.read(8)
+        except FileNotFoundError:
+            return None
+        codec = sniff_codec(header) if len(header) > 0 and not is_segmented(header) else None
+        if codec is None or not codec.columnar:
+            return None
+        try:
+            self.load_file(file_name)
+        except (FileNotFoundError, MemoryError, CacheBusyError):
+            # files too large to cache are always read from disk, and busy caches load them later
+            pass
+        return codec.read_file(file_path, columns=columns)
 
-    def update(self, file_name, new_df):
+    def update(self, file_name, new_df, use_fsync=False):
         """
         Update a DataFrame to the cache file.
 
+        Updates to a key are group committed: updates that arrive while another update of the key is
+        being written are queued, and the next writer merges and writes all of them at once.  Each
+        caller returns once the write with its update has landed.
+
         Args:
             file_name (str): The name of the file that should be updated.
             new_df (DataFrame): The DataFrame with the update.
+            use_fsync (bool): Use fsync when writing the update to disk.
 
         Returns:
             DataFrame: The new DataFrame.
         """
+        future = Future()
+        with self.update_queues_lock:
+            self.update_queues.setdefault(file_name, []).append((new_df, use_fsync, future))
+        while not future.done():
+            with self._append_lock(file_name):
+                # the previous writer may have committed this update with its own
+                if future.done():
+                    break
+                with self.update_queues_lock:
+                    batch = self.update_queues.pop(file_name)
+                try:
+                    df = self._commit(file_name, [b[0] for b in batch], any(b[1] for b in batch))
+                except BaseException as e:
+                    for b in batch:
+                        b[2].set_exception(e)
+                else:
+                    for b in batch:
+                        b[2].set_result(df)
+        return future.result()
+
+    def _commit(self, file_name, new_dfs, use_fsync):
+        """
+        Write updates to a cache file as one segment.  The caller holds the key's append lock.
+
+        Args:
+            file_name (str): The name of the file that should be updated.
+            new_dfs (list): The DataFrames with the updates, in the order they arrived.
+            use_fsync (bool): Use fsync when writing to disk.
+
+        Returns:
+            DataFrame: The new DataFrame.
+        """
+        codec = self.codec_for(file_name)
+        file_path = os.path.join(self.root_path, file_name)
+        new_df = merge_frames(new_dfs)
+        while True:
+            try:
+                df = self.get_file(file_name)
+            except FileNotFoundError:
+                df = None
+            count = 0
+            append = False
+            if df is None or os.path.getsize(file_path) == 0:
+                df = new_df
+                data = codec.serialize(df)
+            else:
+                # only the new rows are serialized and written; the merged frame is kept in memory
+                df = merge_frames([df, new_df])
+                segment = encode_segment(codec.serialize(new_df))
+                count, end = scan_segments(file_path)
+                if count == 0:
+                    # a single frame file becomes the first segment of a segmented file
+                    with open(file_path, 'rb') as f:
+                        data = SEGMENT_MAGIC + encode_segment(f.read()) + segment
+                    count = 1
+                else:
+                    # drop a partially written segment left by a crash before appending after it
+                    if os.path.getsize(file_path) > end:
+                        os.truncate(file_path, end)
+                    data = segment
+                    append = True
+                count += 1
+            # a write by another caller of update_file wins, and the update is merged into its result
+            if self.update_file(file_name, data, use_fsync=use_fsync, append=append, processed=(df, self.sizer.size(df))):
+                break
+        if count > self.max_segments:
+            self.compaction_executor.submit(self.compact, file_name)
+        if file_name in self.index_specs:
+            # the indexes of the previous DataFrame were dropped when the file was written
+            self._frame_indexes(file_name, df)
+        return df
+
+    def compact(self, file_name):
+        """
+        Rewrite a segmented cache file as a single frame file.
+
+        Args:
+            file_name (str): The name of the file to compact.
+
+        Returns:
+            bool: True if the file was rewritten.
+        """
+        file_path = os.path.join(self.root_path, file_name)
+        with self._append_lock(file_name):
+            try:
+                if scan_segments(file_path)[0] == 0:
+                    return False
+                df = self.get_file(file_name)
+            except FileNotFoundError:
+                return False
+            except MemoryError as e:
+                logging.warning(f"unable to compact {file_name}: {e}")
+                return False
+            update_applied = self.update_file(file_name, self.codec_for(file_name).serialize(df), processed=(df, self.sizer.size(df)))
+        return update_applied or self.compact(file_name)
+
+    def migrate(self, file_name):
+        """
+        Rewrite a cache file with the codec returned by codec_for, if it was written with a different
+        format or compression.  Segmented files are always rewritten, as a single frame.
+
+        Args:
+            file_name (str): The name of the file to migrate.
+
+        Returns:
+            bool: True if the file was rewritten, False if it already matched or doesn't exist.
+        """
+        codec = self.codec_for(file_name)
+        file_path = os.path.join(self.root_path, file_name)
+        with self._append_lock(file_name):
+            try:
+                if os.path.getsize(file_path) == 0 or codec.wrote_file(file_path):
+                    return False
+            except FileNotFoundError:
+                return False
+            df = self.get_file(file_name)
+            update_applied = self.update_file(file_name, codec.serialize(df), processed=(df, self.sizer.size(df)))
+        return update_applied or self.migrate(file_name)
+
+    def _append_lock(self, file_name):
         with self.file_futures_lock:
             flock = self.append_locks.get(file_name)
             if flock is None:
                 flock = threading.Lock()
                 self.append_locks[file_name] = flock
-        with flock:
-            try:
-                df = self.get_file(file_name)
-                df = pd.concat([df, new_df])
-            except FileNotFoundError:
-                df = new_df
-            df = df.sort_index()
-            df = df[~df.index.duplicated(keep='first')]
-            update_applied = self.update_file(file_name, serialize_df(df))
-            return df if update_applied else self.update(file_name, new_df)
+        return flock
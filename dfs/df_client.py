@@ -2,6 +2,7 @@ import logging
 import multiprocessing as mp
 import socket
 import threading
+from contextlib import closing
 from queue import Queue
 
 from .helpers import *
@@ -37,6 +38,8 @@ class DataFrameClient(CommandClient):
     def __init__(self, pool, conn):
         self.pool = pool
         self.conn = conn
+        self.codec = pool.conn_codecs.get(conn, default_wire_codec)
+        self.pipelining = conn in pool.pipelined_conns
 
     def __enter__(self):
         return self
@@ -44,15 +47,149 @@ class DataFrameClient(CommandClient):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.pool.release_connection(self.conn)
 
-    def filter(self, *args, range_start=None, range_end=None, range_type="timestamp"):
-        send_cmd(self.conn, 'df:filter', key_path=args, range_start=range_start, range_end=range_end, range_type=range_type)
-        return recv_df(self.conn)
+    def filter(self, *args, range_start=None, range_end=None, range_type="timestamp", columns=None, codec=None):
+        codec = codec or self.codec
+        send_cmd(self.conn, 'df:filter', key_path=args, range_start=range_start, range_end=range_end, range_type=range_type, columns=columns, codec=codec)
+        return recv_df(self.conn, codec)
+
+    def filter_iter(self, *args, range_start=None, range_end=None, range_type="timestamp", columns=None, codec=None, batch_rows=None):
+        """
+        Filter a key like filter, but receive the result as a sequence of DataFrames of at most
+        batch_rows rows each, so a large result can be processed as it arrives without holding all
+        of it.  The connection can't be used for anything else until the iterator is exhausted or closed.
+
+        Args:
+            batch_rows (int): The maximum number of rows in each DataFrame (default: 65536).
+
+        Returns:
+            iterator: The DataFrames, in index order.  An empty result yields one empty DataFrame.
+        """
+        codec = codec or self.codec
+        send_cmd(self.conn, 'df:filter_stream', key_path=args, range_start=range_start, range_end=range_end, range_type=range_type, columns=columns, codec=codec, batch_rows=batch_rows)
+        with closing(recv_stream(self.conn)) as stream:
+            for data in stream:
+                yield get_wire_codec(codec).decode(data)
+
+    def mfilter(self, key_paths, range_start=None, range_end=None, range_type="timestamp", columns=None, codec=None, key_column=None):
+        """
+        Filter many keys with the same range and columns in one command.  The server loads the keys
+        that aren't loaded in parallel, and replies with all of the DataFrames at once.
+
+        Args:
+            key_paths (list): The key paths, e.g. [("prices", "abc"), ("prices", "def")].
+            key_column (str): If given, the DataFrames are concatenated into one, with a column of this
+                name holding each row's key path joined with '/', e.g. "prices/abc".
+
+        Returns:
+            Union[list, DataFrame]: The DataFrames, in the order of key_paths, or the concatenated DataFrame.
+        """
+        codec = codec or self.codec
+        send_cmd(self.conn, 'df:mfilter', key_paths=[list(k) for k in key_paths], range_start=range_start, range_end=range_end, range_type=range_type, columns=columns, codec=codec, key_column=key_column)
+        if key_column is not None:
+            return recv_df(self.conn, codec)
+        return [recv_df(self.conn, codec) for _ in key_paths]
+
+    def filter_many(self, key_paths, range_start=None, range_end=None, range_type="timestamp", columns=None, codec=None, window=None):
+        """
+        Filter many keys with the same range and columns over this connection.  Up to window requests
+        are sent ahead of their replies, which the server may complete in any order, so the keys cost
+        about one round trip per window instead of one each.  Servers that don't support pipelining
+        are sent one request at a time.
+
+        Args:
+            key_paths (list): The key paths, e.g. [("prices", "abc"), ("prices", "def")].
+            window (int): The maximum number of requests in flight (default: 64).
+
+        Returns:
+            list: The DataFrames, in the order of key_paths.
+        """
+        codec = codec or self.codec
+        key_paths = [list(k) for k in key_paths]
+        if not self.pipelining:
+            return [self.filter(*k, range_start=range_start, range_end=range_end, range_type=range_type, columns=columns, codec=codec) for k in key_paths]
+        window = window or 64
+        results = [None] * len(key_paths)
+        errors = []
+        sent = 0
+        for received in range(len(key_paths)):
+            # bounding the requests in flight keeps both ends from blocking on full socket buffers
+            while sent < len(key_paths) and sent - received < window:
+                send_cmd(self.conn, 'df:filter', request_id=sent, key_path=key_paths[sent], range_start=range_start, range_end=range_end, range_type=range_type, columns=columns, codec=codec)
+                sent += 1
+            reply = recv_json(self.conn)
+            if 'err' in reply:
+                errors.append(f"{key_paths[reply['request_id']]}: {reply['err']}")
+            else:
+                results[reply['request_id']] = recv_df(self.conn, codec)
+        # every reply is read before raising, so the connection can be reused
+        if len(errors) > 0:
+            raise RuntimeError(f"{len(errors)} of {len(key_paths)} requests failed: {errors[0]}")
+        return results
+
+    def query(self, query, *args, range_start=None, range_end=None, range_type="timestamp", columns=None, codec=None):
+        """
+        Filter a key like filter, then evaluate a query against the result on the server, so only the
+        query's result is sent, e.g. a resampled or aggregated frame instead of every row.
+
+        Args:
+            query (dict): The query spec, e.g. {'where': [['sym', '==', 'abc']], 'resample': {'rule': '5min', 'agg': 'ohlc'}}.
+                See dfs.query.apply_query.  Values must be JSON serializable, so timestamps are given as strings.
+
+        Returns:
+            DataFrame: The result of the query.
+
+        Raises:
+            RuntimeError: If the server rejects the query.
+        """
+        codec = codec or self.codec
+        send_cmd(self.conn, 'df:query', key_path=args, query=query, range_start=range_start, range_end=range_end, range_type=range_type, columns=columns, codec=codec)
+        recv_status(self.conn)
+        return recv_df(self.conn, codec)
+
+    def create_index(self, column, *args, kind=None):
+        """
+        Declare a secondary index on a column of a key, so lookup finds its rows without a scan.
+        Declarations are kept in the server's memory, so they're made again when it's restarted.
+
+        Args:
+            column (str): The column to index.
+            kind (str): 'sorted' for point and range lookups, or 'hash' for point lookups of
+                categorical values (default: 'sorted').
+        """
+        send_cmd(self.conn, 'df:create_index', key_path=args, column=column, kind=kind)
+        recv_status(self.conn)
 
-    def update(self, df, *args):
-        send_cmd(self.conn, 'df:update', key_path=args)
-        send_df(self.conn, df)
+    def lookup(self, column, *args, values=None, start=None, end=None, columns=None, codec=None):
+        """
+        Retrieve the rows of a key whose value in a column is one of values, or is between start and
+        end, inclusive, using the column's index if one was declared with create_index.
+
+        Args:
+            column (str): The column to look up.
+            values: A value or a list of values.  Values must be JSON serializable, so timestamps are given as strings.
+            start, end: The bounds of a range lookup, used if values isn't given.
+            columns (list): The columns to retrieve (default: all columns).
+
+        Returns:
+            DataFrame: The rows found.
+
+        Raises:
+            RuntimeError: If the server rejects the lookup, e.g. the column doesn't exist.
+        """
+        codec = codec or self.codec
+        send_cmd(self.conn, 'df:lookup', key_path=args, column=column, values=values, start=start, end=end, columns=columns, codec=codec)
         recv_status(self.conn)
+        return recv_df(self.conn, codec)
 
+    def update(self, df, *args, codec=None, fsync=False):
+        codec = codec or self.codec
+        send_cmd(self.conn, 'df:update', key_path=args, codec=codec, fsync=fsync)
+        send_df(self.conn, df, codec)
+        recv_status(self.conn)
+
+    def migrate(self, *args):
+        send_cmd(self.conn, 'df:migrate', key_path=args)
+        return recv_json(self.conn)['migrated']
 
 
 class FileClient(CommandClient):
@@ -68,10 +205,34 @@ class FileClient(CommandClient):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.pool.release_connection(self.conn)
 
-    def get(self, *args):
-        send_cmd(self.conn, 'get', key_path=args)
+    def get(self, *args, offset=None, length=None):
+        """
+        Get a file, or the range of it starting at offset and at most length bytes long.
+        Ranges can be read from files too large for the server's cache.
+        """
+        if offset is None and length is None:
+            send_cmd(self.conn, 'get', key_path=args)
+        else:
+            send_cmd(self.conn, 'get', key_path=args, offset=offset, length=length)
         return recv_msg(self.conn)
 
+    def get_stream(self, *args, offset=None, length=None, chunk_size=None):
+        """
+        Stream a file, or a range of it, in chunks, so files larger than the server's cache or
+        the client's memory can be read.  The connection can't be used for anything else until
+        the iterator is exhausted or closed.
+
+        Args:
+            offset (int): The offset of the range.
+            length (int): The length of the range (default: to the end of the file).
+            chunk_size (int): The maximum size of each chunk (default: 4MB).
+
+        Returns:
+            iterator: The chunks, as bytearrays.
+        """
+        send_cmd(self.conn, 'get:stream', key_path=args, offset=offset, length=length, chunk_size=chunk_size)
+        yield from recv_stream(self.conn)
+
     def set(self, contents, *args):
         send_cmd(self.conn, 'set', key_path=args)
         send_msg(self.conn, contents)
@@ -101,7 +262,7 @@ class DataFrameConnectionFactory:
 
 
 class DataFrameConnectionPool:
-    def __init__(self, host, port, max_connections=None, max_retries=None, client_class=None):
+    def __init__(self, host, port, max_connections=None, max_retries=None, client_class=None, codecs=None):
         max_connections = max_connections or int(mp.cpu_count()*0.8)
         max_retries = max_retries or 3
         client_class = client_class or DataFrameClient
@@ -112,6 +273,12 @@ class DataFrameConnectionPool:
         self.semaphore = threading.Semaphore(max_connections)
         self.max_retries = max_retries
         self.default_client_class = client_class
+        # DataFrame wire codecs in order of preference, negotiated with the server per connection
+        self.codecs = codecs or available_wire_codecs()
+        self.conn_codecs = {}
+        # connections to servers that accept pipelined requests
+        self.pipelined_conns = set()
+        self.negotiate = True
 
     def __enter__(self):
         return self
@@ -133,7 +300,46 @@ class DataFrameConnectionPool:
                 pass
             finally:
                 if conn is not None:
-                    self.factory.close(conn)
+                    self._close(conn)
+
+    def _close(self, conn):
+        self.conn_codecs.pop(conn, None)
+        self.pipelined_conns.discard(conn)
+        self.factory.close(conn)
+
+    def _connect(self):
+        tinfo(f"Creating socket")
+        conn = self.factory.create_socket()
+        attempts = 1
+        while attempts <= self.max_retries:
+            try:
+                self.factory.connect(conn)
+                break
+            except socket.error:
+                tinfo(f"Connection Failed, Retrying...{attempts}")
+                time.sleep(2**attempts)
+                attempts += 1
+        if self.factory.is_connected(conn):
+            tinfo(f"Connection created after {attempts} attempts")
+        else:
+            tinfo(f"Connection failed after {attempts} attempts")
+            self.semaphore.release()
+            raise ConnectionError(f"Connection failed after {attempts} attempts")
+        return conn
+
+    def _negotiate(self, conn):
+        """
+        Negotiate the connection's default DataFrame wire codec with the server.
+
+        Returns:
+            dict: The server's reply, or None if the server dropped the connection.
+        """
+        try:
+            send_cmd(conn, 'hello', codecs=self.codecs)
+            data = recv_msg(conn)
+        except ConnectionError:
+            data = None
+        return None if data is None else json.loads(data.decode())
 
     def get_connection(self, client_class=None):
         self.semaphore.acquire()
@@ -143,29 +349,24 @@ class DataFrameConnectionPool:
             conn = self.connections.get()
             if not self.factory.is_connected(conn):
                 tinfo(f"Releasing closed connection")
+                self._close(conn)
                 conn = None
         if conn is None:
-            tinfo(f"Creating socket")
-            conn = self.factory.create_socket()
-            attempts = 1
-            while attempts <= self.max_retries:
-                try:
-                    self.factory.connect(conn)
-                    break
-                except socket.error:
-                    tinfo(f"Connection Failed, Retrying...{attempts}")
-                    time.sleep(2**attempts)
-                    attempts += 1
-            if self.factory.is_connected(conn):
-                tinfo(f"Connection created after {attempts} attempts")
-            else:
-                tinfo(f"Connection failed after {attempts} attempts")
-                self.semaphore.release()
-                raise ConnectionError(f"Connection failed after {attempts} attempts")
+            conn = self._connect()
+            reply = self._negotiate(conn) if self.negotiate else None
+            if reply is None and self.negotiate:
+                # servers that predate codec negotiation drop the connection on 'hello'
+                tinfo(f"Codec negotiation failed, using {default_wire_codec}")
+                self.factory.close(conn)
+                self.negotiate = False
+                conn = self._connect()
+            reply = reply or {}
+            self.conn_codecs[conn] = reply.get('codec') or default_wire_codec
+            if reply.get('pipelining'):
+                self.pipelined_conns.add(conn)
         return (client_class or self.default_client_class)(self, conn)
 
     def release_connection(self, conn):
         self.connections.put(conn)
         self.semaphore.release()
 
-
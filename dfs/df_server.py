@@ -1,10 +1,17 @@
 import logging
+import mmap
 import os
+import socket
 import socketserver
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import simdjson as json
 
+from .file_cache import CacheBusyError, TMP_SUFFIX
 from .helpers import *
+from .query import QueryError, apply_query
 
 
 def to_key_path(file_path):
@@ -15,12 +22,34 @@ class ClientCloseException(Exception):
     pass
 
 
+def choose_codec(codecs):
+    """
+    Choose a connection's default DataFrame wire codec: the first of the client's
+    preferred codecs that the server supports.
+
+    Args:
+        codecs (list): The client's codecs, in order of preference.
+
+    Returns:
+        str: The codec name.
+    """
+    available = available_wire_codecs()
+    codecs = [c for c in codecs or [] if c in available]
+    return codecs[0] if len(codecs) > 0 else default_wire_codec
+
+
 class SystemCommandProcessor:
 
     @staticmethod
     def _to_file_path(*args):
         return os.path.join(*args)
 
+    def payload_frames(self, command):
+        """
+        Returns the number of frames the client sends after the command, e.g. the data for 'set'.
+        """
+        return 0
+
     def process(self, server, conn, command):
         handled = True
         name = command['name']
@@ -42,10 +71,18 @@ class SystemCommandProcessor:
             handled = False
         return handled
 
+    @staticmethod
+    def check_streamable(conn, command):
+        """
+        Streamed replies are sent as they're produced, which a pipelined reply can't be.
+        """
+        if isinstance(conn, BufferedConnection) and conn.flush is None:
+            raise ValueError(f"{command['name']} can't be pipelined")
+
     def get_all_key_paths(self, root_path):
         key_paths = []
         for path, _, files in os.walk(root_path):
-            key_paths.extend([to_key_path(os.path.join(path[len(root_path)+1:], f)) for f in files])
+            key_paths.extend([to_key_path(os.path.join(path[len(root_path)+1:], f)) for f in files if not f.endswith(TMP_SUFFIX)])
         return key_paths
 
     def get_stats(self, server, level=None):
@@ -60,6 +97,7 @@ class SystemCommandProcessor:
                     'root_path': server.cache.root_path,
                     'max_memory': str(server.cache.max_memory),
                 },
+                'tiers': {tier: {k: str(v) for k, v in tier_stats.items()} for tier, tier_stats in server.cache.tier_stats().items()},
             }
         if level >= 1:
             stats['loaded_keys'] = [[to_key_path(k),str(v[1])] for k,v in server.cache.file_futures.items()]
@@ -74,6 +112,9 @@ class FileCommandProcessor(SystemCommandProcessor):
     def _to_file_path(*args):
         return os.path.join(*args)
 
+    def payload_frames(self, command):
+        return 1 if command['name'] == 'set' else super().payload_frames(command)
+
     def process(self, server, conn, command):
         handled = True
         name = command['name']
@@ -81,10 +122,25 @@ class FileCommandProcessor(SystemCommandProcessor):
             data = recv_msg(conn)
             server.cache.update_file(self._to_file_path(*command['key_path']), data)
             send_success(conn)
+        elif name == 'get' and (command.get('offset') is not None or command.get('length') is not None):
+            file_path = self._to_file_path(*command['key_path'])
+            send_msg(conn, server.cache.read_range(file_path, command.get('offset') or 0, command.get('length')))
+        elif name == 'get:stream':
+            self.check_streamable(conn, command)
+            file_path = self._to_file_path(*command['key_path'])
+            # the chunks are sent as they're read and an empty frame ends the stream
+            for chunk in server.cache.iter_range(file_path, command.get('offset') or 0, command.get('length'), command.get('chunk_size')):
+                send_msg(conn, chunk)
+            send_msg(conn, bytes([]))
         elif name == 'get':
             file_path = self._to_file_path(*command['key_path'])
             data = server.cache.get_file(file_path)
-            send_msg(conn, data)
+            if isinstance(data, mmap.mmap) and isinstance(conn, socket.socket):
+                # the mapped file's pages are resident, so the kernel can send them itself.  If the file
+                # was replaced since it was mapped, the newer contents are sent.
+                send_file(conn, os.path.join(server.cache.root_path, file_path))
+            else:
+                send_msg(conn, data)
         else:
             handled = super().process(server, conn, command)
         return handled
@@ -96,58 +152,250 @@ class DataFrameCommandProcessor(SystemCommandProcessor):
     def _to_file_path(*args):
         return os.path.join(*args)
 
+    def payload_frames(self, command):
+        return 1 if command['name'] == 'df:update' else super().payload_frames(command)
+
     def process(self, server, conn, command):
         handled = True
         name = command['name']
         if name == 'df:update':
-            df = recv_df(conn)
-            server.cache.update(self._to_file_path(*command['key_path']), df)
+            df = recv_df(conn, command.get('codec'))
+            server.cache.update(self._to_file_path(*command['key_path']), df, use_fsync=command.get('fsync', False))
             send_success(conn)
         elif name == 'df:filter':
             file_path = self._to_file_path(*command['key_path'])
-            df = server.cache.get_dataframe(file_path, command.get('range_start'), command.get('range_end'), command.get('range_type'))
-            if df is None:
-                send_msg(conn, bytes([]))
+            columns = command.get('columns')
+            params = (command.get('range_start'), command.get('range_end'), command.get('range_type'), None if columns is None else tuple(columns), command.get('codec'))
+            data, version = server.cache.get_result(file_path, params)
+            if data is not None:
+                # a repeated request is answered without slicing or encoding anything
+                send_msg(conn, data)
+            else:
+                df = server.cache.get_dataframe(file_path, command.get('range_start'), command.get('range_end'), command.get('range_type'), columns=columns)
+                if version is None:
+                    send_df(conn, df, command.get('codec'))
+                else:
+                    # the reply is joined into one buffer, so a cached reply doesn't hold on to the DataFrame's memory
+                    data = b''.join(get_wire_codec(command.get('codec')).encode(df))
+                    server.cache.put_result(file_path, params, version, data)
+                    send_msg(conn, data)
+        elif name == 'df:filter_stream':
+            self.check_streamable(conn, command)
+            file_path = self._to_file_path(*command['key_path'])
+            df = server.cache.get_dataframe(file_path, command.get('range_start'), command.get('range_end'), command.get('range_type'), columns=command.get('columns'))
+            if df is not None:
+                batch_rows = command.get('batch_rows') or 2**16
+                # an empty range is still sent as one batch so the client gets its columns
+                for start in range(0, max(len(df), 1), batch_rows):
+                    send_df(conn, df.iloc[start:start+batch_rows], command.get('codec'))
+            send_msg(conn, bytes([]))
+        elif name == 'df:mfilter':
+            key_paths = command['key_paths']
+            dfs = server.cache.get_dataframes([self._to_file_path(*k) for k in key_paths], command.get('range_start'), command.get('range_end'), command.get('range_type'), columns=command.get('columns'))
+            key_column = command.get('key_column')
+            if key_column is None:
+                # one frame per key, in the order of the key paths
+                for df in dfs:
+                    send_df(conn, df, command.get('codec'))
             else:
-                send_df(conn, df)
+                send_df(conn, concat_with_keys(dfs, ['/'.join(k) for k in key_paths], key_column), command.get('codec'))
+        elif name == 'df:query':
+            file_path = self._to_file_path(*command['key_path'])
+            df = server.cache.get_dataframe(file_path, command.get('range_start'), command.get('range_end'), command.get('range_type'), columns=command.get('columns'))
+            try:
+                df = apply_query(df, command.get('query') or {})
+            except QueryError as e:
+                # a bad query is reported to the client, which can keep using the connection
+                send_status(conn, e)
+            else:
+                send_success(conn)
+                send_df(conn, df, command.get('codec'))
+        elif name == 'df:create_index':
+            try:
+                server.cache.create_index(self._to_file_path(*command['key_path']), command['column'], kind=command.get('kind'))
+            except ValueError as e:
+                send_status(conn, e)
+            else:
+                send_success(conn)
+        elif name == 'df:lookup':
+            file_path = self._to_file_path(*command['key_path'])
+            try:
+                df = server.cache.lookup(file_path, command['column'], values=command.get('values'), start=command.get('start'), end=command.get('end'), columns=command.get('columns'))
+            except (ValueError, TypeError) as e:
+                # e.g. an unknown column, or a range lookup of a hash index
+                send_status(conn, e)
+            else:
+                send_success(conn)
+                send_df(conn, df, command.get('codec'))
+        elif name == 'df:migrate':
+            migrated = server.cache.migrate(self._to_file_path(*command['key_path']))
+            send_json(conn, migrated=migrated)
         else:
             handled = super().process(server, conn, command)
         return handled
 
 
+class BufferedConnection:
+    """
+    A socket-like connection that serves frames already read from the client and buffers
+    everything a processor sends, so the reply can be written later in one piece.  Given a
+    flush function, the buffered output is instead passed to it whenever it grows past
+    max_buffered bytes, so long replies are streamed rather than held in memory.
+
+    Args:
+        frames (list): The payload frames of the command, as received without their headers.
+        flush (callable): Writes a list of buffers to the client.
+        max_buffered (int): The number of bytes buffered before they're flushed (default: 4MB).
+    """
+    def __init__(self, frames=(), flush=None, max_buffered=None):
+        self.incoming = [memoryview(b) for f in frames for b in (struct.pack('>I', len(f)), f) if len(b) > 0]
+        self.outgoing = []
+        self.flush = flush
+        self.max_buffered = max_buffered or 2**22
+        self.buffered = 0
+
+    def recv_into(self, buffer, nbytes=0):
+        if len(self.incoming) == 0:
+            return 0
+        data = self.incoming[0]
+        n = min(nbytes or len(buffer), len(data))
+        buffer[:n] = data[:n]
+        if n == len(data):
+            self.incoming.pop(0)
+        else:
+            self.incoming[0] = data[n:]
+        return n
+
+    def sendall(self, data):
+        self.sendmsg([data])
+
+    def sendmsg(self, buffers):
+        self.outgoing.extend(buffers)
+        sent = sum(memoryview(b).nbytes for b in buffers)
+        self.buffered += sent
+        if self.flush is not None and self.buffered >= self.max_buffered:
+            self.flush(self.outgoing)
+            self.outgoing = []
+            self.buffered = 0
+        return sent
+
+
+def process_request(server, command, frames=()):
+    """
+    Process a pipelined command, i.e. one with a request_id.  The reply is a header frame with
+    the request_id followed by the command's usual reply frames.  If the command fails, the
+    header has an 'err' and no frames follow, so the connection stays usable.
+
+    Args:
+        server: The server, with its cache and processor.
+        command (dict): The command.
+        frames (list): The command's payload frames.
+
+    Returns:
+        tuple: The buffers of the reply, and True if the client asked to close the connection.
+    """
+    conn = BufferedConnection(frames)
+    header = {'request_id': command['request_id']}
+    closed = False
+    try:
+        if not server.processor.process(server, conn, command):
+            raise ValueError(f"command not handled: {command['name']}")
+    except ClientCloseException:
+        closed = True
+    except Exception as e:
+        logging.warning(f"request failed: {command} {e}")
+        header['err'] = str(e)
+        conn.outgoing = []
+    data = json.dumps(header).encode()
+    return [struct.pack('>I', len(data)), data, *conn.outgoing], closed
+
+
 class CommandHandler(socketserver.BaseRequestHandler):
 
     def setup(self) -> None:
         addr = self.client_address[0]
         logging.info(f'Connection created by {addr}')
+        self.codec = default_wire_codec
+        # pipelined requests complete on the server's executor, in any order
+        self.pending = set()
+        self.write_lock = threading.Lock()
+
+    def negotiate(self, conn, command):
+        """
+        Choose the connection's default DataFrame wire codec.  Commands may still name their own codec.
+        """
+        self.codec = choose_codec(command.get('codecs'))
+        send_json(conn, codec=self.codec, codecs=available_wire_codecs(), pipelining=True)
+
+    def reply(self, conn, command, frames):
+        buffers, closed = process_request(self.server, command, frames)
+        with self.write_lock:
+            send_buffers(conn, buffers)
+        if closed:
+            # ends the read loop once the reply is sent
+            conn.shutdown(socket.SHUT_RD)
 
     def handle(self):
         with self.request as conn:
-            while True:
+            try:
+                self.serve(conn)
+            finally:
+                # replies to pipelined requests are sent before the connection is closed
+                wait(list(self.pending))
+
+    def serve(self, conn):
+        while True:
+            try:
+                data = recv_msg(conn)
+            except ConnectionResetError as e:
+                data = None
+            if data is None:
+                addr = self.client_address[0]
+                logging.info(f'Connection dropped by {addr}')
+                break
+            command = json.loads(data.decode())
+            if command['name'] == 'hello':
+                self.negotiate(conn, command)
+                continue
+            command.setdefault('codec', self.codec)
+            if 'request_id' in command:
                 try:
-                    data = recv_msg(conn)
+                    frames = [recv_msg(conn) for _ in range(self.server.processor.payload_frames(command))]
                 except ConnectionResetError as e:
-                    data = None
-                if data is None:
+                    frames = [None]
+                if None in frames:
                     addr = self.client_address[0]
                     logging.info(f'Connection dropped by {addr}')
                     break
-                command = json.loads(data.decode())
-                try:
-                    handled = self.server.processor.process(self.server, conn, command)
-                    if not handled:
-                        logging.warm(f"command not handled: {command}")
-                except ClientCloseException as e:
-                    addr = self.client_address[0]
-                    logging.info(f'Connection closed by {addr}')
-                    break
-                except MemoryError as e:
-                    logging.warn(f"memory error: {command}")
-                except Exception as e:
-                    logging.error(f"exception: {command} {e}")
-                    import traceback
-                    traceback.print_exc(e)
-                    break
+                if len(frames) > 0:
+                    # writes are applied before later requests are read, so a connection reads its own writes
+                    self.reply(conn, command, frames)
+                else:
+                    future = self.server.executor.submit(self.reply, conn, command, frames)
+                    self.pending.add(future)
+                    future.add_done_callback(self.pending.discard)
+                continue
+            # commands without a request_id are answered in order
+            wait(list(self.pending))
+            try:
+                handled = self.server.processor.process(self.server, conn, command)
+                if not handled:
+                    logging.warning(f"command not handled: {command}")
+            except ClientCloseException as e:
+                addr = self.client_address[0]
+                logging.info(f'Connection closed by {addr}')
+                break
+            except MemoryError as e:
+                logging.warn(f"memory error: {command}")
+            except CacheBusyError as e:
+                # closing the connection fails the request fast, and the client's pool retries elsewhere or later
+                logging.warning(f"cache busy: {command} {e}")
+                break
+            except Exception as e:
+                logging.error(f"exception: {command} {e}")
+                import traceback
+                traceback.print_exc(e)
+                break
 
     def finish(self):
         addr = self.client_address[0]
@@ -162,7 +410,11 @@ class DataFrameServer(socketserver.ThreadingTCPServer):
         super().__init__(address, CommandHandler, *args, **kwargs)
         self.cache = cache
         self.processor = DataFrameCommandProcessor()
+        self.executor = ThreadPoolExecutor()
 
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
 
 
 class FileServer(socketserver.ThreadingTCPServer):
@@ -173,3 +425,8 @@ class FileServer(socketserver.ThreadingTCPServer):
         super().__init__(address, CommandHandler, *args, **kwargs)
         self.cache = cache
         self.processor = FileCommandProcessor()
+        self.executor = ThreadPoolExecutor()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,278 @@
+import random
+from collections import OrderedDict
+
+
+class EvictionPolicy:
+    """
+    Chooses which resident files a FileCache unloads when it needs memory.  A policy is told about
+    every request and every file that becomes resident or is unloaded, and is asked for victims.
+    The cache calls it while holding its lock, so policies don't need their own.
+
+    Args:
+        max_memory (int): The memory of the cache, for policies that partition it.
+    """
+    name = None
+
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+
+    def access(self, key):
+        """
+        Record a request for a file, whether or not it's resident.
+
+        Args:
+            key (str): The name of the file.
+        """
+        raise NotImplementedError()
+
+    def insert(self, key, size):
+        """
+        Record that a file is resident, or that its memory usage changed.
+
+        Args:
+            key (str): The name of the file.
+            size (int): Its memory usage.
+        """
+        raise NotImplementedError()
+
+    def remove(self, key):
+        """
+        Record that a file was unloaded.
+
+        Args:
+            key (str): The name of the file.
+        """
+        raise NotImplementedError()
+
+    def victim(self):
+        """
+        Returns the resident file to unload next, or None if there are none.
+        """
+        raise NotImplementedError()
+
+    def admit(self, key, size):
+        """
+        Decide whether a file that isn't resident should be cached when files must be unloaded
+        to make room for it.  A file that isn't admitted is loaded for the request without being cached.
+
+        Args:
+            key (str): The name of the file.
+            size (int): Its estimated memory usage.
+
+        Returns:
+            bool: True to make room for the file.
+        """
+        return True
+
+
+class LRUPolicy(EvictionPolicy):
+    """
+    Unloads the least recently used file.
+    """
+    name = 'lru'
+
+    def __init__(self, max_memory):
+        super().__init__(max_memory)
+        self.entries = OrderedDict()
+
+    def access(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+
+    def insert(self, key, size):
+        self.entries[key] = size
+        self.entries.move_to_end(key)
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+
+    def victim(self):
+        return next(iter(self.entries), None)
+
+
+class FrequencySketch:
+    """
+    Approximate request counts of keys in a fixed amount of memory (a count-min sketch).  Counts are
+    capped at 15 and halved once enough requests are recorded, so old popularity fades.
+
+    Args:
+        width (int): The number of counters in each row.
+    """
+    depth = 4
+    max_count = 15
+
+    def __init__(self, width):
+        self.width = max(16, width)
+        self.rows = [[0] * self.width for _ in range(self.depth)]
+        self.seeds = [random.getrandbits(64) for _ in range(self.depth)]
+        self.additions = 0
+        self.sample_size = 10 * self.width
+
+    def _indexes(self, key):
+        return [hash((seed, key)) % self.width for seed in self.seeds]
+
+    def frequency(self, key):
+        return min(row[i] for row, i in zip(self.rows, self._indexes(key)))
+
+    def increment(self, key):
+        indexes = self._indexes(key)
+        count = min(row[i] for row, i in zip(self.rows, indexes))
+        if count < self.max_count:
+            # only the smallest counters are incremented, which reduces overestimates
+            for row, i in zip(self.rows, indexes):
+                if row[i] == count:
+                    row[i] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.rows = [[c // 2 for c in row] for row in self.rows]
+            self.additions //= 2
+
+
+class TinyLFUPolicy(EvictionPolicy):
+    """
+    A size-aware W-TinyLFU policy, which resists scans and favors frequently requested files.
+
+    New files enter a small LRU window.  When the window is full, its oldest file competes with
+    the files the main area would have to unload to fit it: it's admitted only if it's been
+    requested more often than all of them together, and is unloaded otherwise.  Files too large
+    for the window compete the same way before they're loaded.  A file touched once by a scan
+    therefore can't push out frequently used files, however large it is.  The main area is a segmented
+    LRU, where files requested again while on probation are protected.  Request counts are
+    approximated by a FrequencySketch, which also counts requests for files that aren't resident.
+
+    Args:
+        max_memory (int): The memory of the cache.
+        window (float): The fraction of memory for the window (default: 0.01).
+        protected (float): The fraction of the main area for protected files (default: 0.8).
+        sketch_width (int): The number of counters in each row of the sketch (default: 4096).
+    """
+    name = 'tinylfu'
+
+    def __init__(self, max_memory, window=None, protected=None, sketch_width=None):
+        super().__init__(max_memory)
+        self.window_max = int(max_memory * (window or 0.01))
+        self.protected_max = int((max_memory - self.window_max) * (protected or 0.8))
+        self.sketch = FrequencySketch(sketch_width or 4096)
+        self.sizes = {}
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.window_size = 0
+        self.protected_size = 0
+        self.total_size = 0
+
+    def _segment(self, key):
+        for segment in (self.window, self.probation, self.protected):
+            if key in segment:
+                return segment
+        return None
+
+    def access(self, key):
+        self.sketch.increment(key)
+        segment = self._segment(key)
+        if segment is self.probation:
+            del self.probation[key]
+            self.protected[key] = None
+            self.protected_size += self.sizes[key]
+            # demote the oldest protected files to keep the protected segment within its share
+            while self.protected_size > self.protected_max and len(self.protected) > 1:
+                demoted = next(iter(self.protected))
+                del self.protected[demoted]
+                self.protected_size -= self.sizes[demoted]
+                self.probation[demoted] = None
+        elif segment is not None:
+            segment.move_to_end(key)
+
+    def insert(self, key, size):
+        segment = self._segment(key)
+        if segment is None:
+            self.window[key] = None
+            self.window_size += size
+            self.total_size += size
+        else:
+            segment.move_to_end(key)
+            if segment is self.window:
+                self.window_size += size - self.sizes[key]
+            elif segment is self.protected:
+                self.protected_size += size - self.sizes[key]
+            self.total_size += size - self.sizes[key]
+        self.sizes[key] = size
+        # while the main area has room, files leaving the window enter it without competing
+        while self.window_size > self.window_max and len(self.window) > 1:
+            oldest = next(iter(self.window))
+            if self.total_size - self.window_size + self.sizes[oldest] > self.max_memory - self.window_max:
+                break
+            self._admit(oldest)
+
+    def remove(self, key):
+        segment = self._segment(key)
+        if segment is None:
+            return
+        del segment[key]
+        if segment is self.window:
+            self.window_size -= self.sizes[key]
+        elif segment is self.protected:
+            self.protected_size -= self.sizes[key]
+        self.total_size -= self.sizes.pop(key)
+
+    def _admit(self, key):
+        """
+        Move a file from the window to the main area's probation segment.
+        """
+        del self.window[key]
+        self.window_size -= self.sizes[key]
+        self.probation[key] = None
+
+    def _main_victims(self, size):
+        """
+        Returns the main area's files that would be unloaded, in order, to free size bytes.
+        """
+        victims = []
+        freed = 0
+        for segment in (self.probation, self.protected):
+            for key in segment:
+                if freed >= size:
+                    return victims
+                victims.append(key)
+                freed += self.sizes[key]
+        return victims
+
+    def admit(self, key, size):
+        if size <= self.window_max:
+            return True
+        victims = self._main_victims(size)
+        return len(victims) == 0 or self.sketch.frequency(key) > sum(self.sketch.frequency(k) for k in victims)
+
+    def victim(self):
+        # a full window makes room by evicting or admitting its oldest file
+        if len(self.window) > 0 and self.window_size >= self.window_max:
+            candidate = next(iter(self.window))
+            victims = self._main_victims(self.sizes[candidate])
+            if len(victims) == 0 or self.sketch.frequency(candidate) <= sum(self.sketch.frequency(k) for k in victims):
+                return candidate
+            # the candidate is admitted to the main area, and the files it displaces are unloaded
+            self._admit(candidate)
+            return victims[0]
+        for segment in (self.probation, self.protected, self.window):
+            if len(segment) > 0:
+                return next(iter(segment))
+        return None
+
+
+eviction_policies = {policy.name: policy for policy in [LRUPolicy, TinyLFUPolicy]}
+
+
+def get_eviction_policy(name):
+    """
+    Returns the eviction policy class registered under the specified name.
+
+    Args:
+        name (str): The policy name, e.g. 'lru' or 'tinylfu'.
+
+    Returns:
+        type: The EvictionPolicy subclass.
+    """
+    policy = eviction_policies.get(name)
+    if policy is None:
+        raise ValueError(f"unknown eviction policy: {name} (available: {list(eviction_policies.keys())})")
+    return policy
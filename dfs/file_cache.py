@@ -1,22 +1,128 @@
-import heapq
+import mmap
 import os
 import time
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from .eviction import get_eviction_policy
 from .helpers import tinfo
-from threading import Lock
+from threading import Condition, Lock
 import logging
 
+# files are written to a temporary file beside the target and renamed over it
+TMP_SUFFIX = '.dfs-tmp'
+
+
+class CacheBusyError(Exception):
+    """
+    Raised when a cache has too many loads pending to start another within its admission timeout.
+    """
+    pass
+
+
+class MemoryBudget:
+    def __init__(self, max_memory):
+        """
+        A memory budget that can be shared by several caches.  Claims are checked and recorded
+        atomically, so the caches sharing a budget can't together use more than max_memory.
+
+        Args:
+        - max_memory (int): the maximum amount of memory to use (in bytes)
+
+        Returns:
+        None
+        """
+        self.max_memory = max_memory
+        self.used = 0
+        self.lock = Lock()
+        self.caches = []
+
+    def claim(self, amount):
+        """
+        Claim memory from the budget.
+
+        Args:
+        - amount (int): the amount of memory to claim
+
+        Returns:
+        bool: True if the memory was claimed, False if the budget can't cover it
+        """
+        with self.lock:
+            if self.used + amount > self.max_memory:
+                return False
+            self.used += amount
+            return True
+
+    def release(self, amount):
+        """
+        Return claimed memory to the budget.
+
+        Args:
+        - amount (int): the amount of memory to release
+
+        Returns:
+        None
+        """
+        with self.lock:
+            self.used -= amount
+
+    def recover(self, claim, requester):
+        """
+        Unload files of the other caches sharing this budget, as chosen by their eviction policies, until the claim fits.
+        Caches whose lock is currently held are skipped, so a cache never waits on another cache's lock.
+
+        Args:
+        - claim (int): amount of memory to claim
+        - requester (FileCache): the cache making the claim, which has already unloaded what it can
+
+        Returns:
+        bool: True if any file was unloaded
+        """
+        locked = [c for c in self.caches if c is not requester and c.file_futures_lock.acquire(blocking=False)]
+        unloaded = False
+        try:
+            while self.used + claim > self.max_memory:
+                victims = [(c, c.eviction_policy.victim()) for c in locked]
+                victims = [(c, v) for c, v in victims if v is not None]
+                if len(victims) == 0:
+                    break
+                # of the victims each cache's policy chose, the least recently used is unloaded
+                cache, victim = min(victims, key=lambda cv: cv[0].file_access_times[cv[1]])
+                cache._unload_file(victim)
+                unloaded = True
+        finally:
+            for c in locked:
+                c.file_futures_lock.release()
+        return unloaded
+
 
 class FileCache:
-    def __init__(self, max_memory=None, root_path=None):
+    def __init__(self, max_memory=None, root_path=None, executor=None, budget=None, use_mmap=False, eviction_policy=None,
+                 cpu_executor=None, max_pending_loads=None, admission_timeout=None):
         """
         Initializes the FileCache with a maximum memory limit and the root directory for file storage.
         If max_memory is not specified, it defaults to 2**20 bytes.
         If root_path is not specified, it defaults to the current working directory.
+        If executor is not specified, the cache creates its own ThreadPoolExecutor.
+        If cpu_executor is specified, file contents are processed on it rather than on the executor reading
+        them, so decoding doesn't hold up I/O.  It may be a ProcessPoolExecutor if contents_processor is picklable.
+        If max_pending_loads is specified, a request that misses waits for one of that many pending loads to
+        finish, for up to admission_timeout seconds (forever if None, fail immediately if 0), and then raises
+        CacheBusyError.  Requests for files that are loaded or loading never wait.
+        If budget is not specified, the cache has a budget of max_memory to itself.
+        If use_mmap is set, files are memory mapped instead of read, so their contents are shared
+        with the OS page cache rather than copied onto the heap.
+        If eviction_policy is not specified, the least recently used files are unloaded first.
 
         Args:
         - max_memory (int): the maximum amount of memory to use (in bytes)
         - root_path (str): the directory where files will be stored
+        - executor (Executor): the executor used to load and write files
+        - budget (MemoryBudget): a memory budget shared with other caches
+        - use_mmap (bool): hold read-only memory maps of files instead of their contents
+        - eviction_policy (Union[str, type]): the name or class of the EvictionPolicy choosing which files to unload
+        - cpu_executor (Executor): the executor used to process file contents
+        - max_pending_loads (int): the maximum number of files loading at once
+        - admission_timeout (float): how long a request waits to start loading a file, in seconds
 
         Returns:
         None
@@ -25,9 +131,26 @@ class FileCache:
         self.root_path = root_path or os.getcwd()
         self.current_memory_usage = 0
         self.file_futures = {}
-        self.file_access_times = []
+        self.file_access_times = OrderedDict()
+        self.file_access_counts = {}
+        eviction_policy = eviction_policy or 'lru'
+        eviction_policy = get_eviction_policy(eviction_policy) if isinstance(eviction_policy, str) else eviction_policy
+        self.eviction_policy = eviction_policy(self.max_memory)
         self.file_futures_lock = Lock()
-        self.executor = ThreadPoolExecutor()
+        self.executor = executor or ThreadPoolExecutor()
+        self.cpu_executor = cpu_executor
+        self.max_pending_loads = max_pending_loads
+        self.admission_timeout = admission_timeout
+        self.pending_loads = 0
+        self.load_slots = Condition(self.file_futures_lock)
+        self.rejected_loads = 0
+        self.budget = budget or MemoryBudget(self.max_memory)
+        self.budget.caches.append(self)
+        self.use_mmap = use_mmap
+        # the observed ratio of memory usage to file size, used to reserve memory for files before they load
+        self.size_ratio = 1.0
+        self.hits = 0
+        self.misses = 0
 
     def process_contents(self, contents):
         """
@@ -42,22 +165,194 @@ class FileCache:
         """
         return contents, len(contents)
 
-    def _load_file(self, file_name):
+    def contents_processor(self):
+        """
+        A hook returning the function that process_contents delegates to, which is run on the cpu_executor.
+        It must be picklable, i.e. not a bound method of the cache, if the cpu_executor is a ProcessPoolExecutor.
+
+        Returns:
+        - callable: a function taking the contents of a file and returning the same as process_contents
+        """
+        return self.process_contents
+
+    def _process(self, contents):
+        """
+        Process file contents on the cpu_executor, if there is one.
+
+        Args:
+        - contents (Union[str, bytes]): the contents of the file
+
+        Returns:
+        - tuple: a tuple of the processed contents and the memory usage of the contents
+        """
+        if self.cpu_executor is None:
+            return self.process_contents(contents)
+        return self.cpu_executor.submit(self.contents_processor(), contents).result()
+
+    def _read_file(self, file_path):
+        """
+        Read the raw contents of a file, or map them in mmap mode.
+
+        Args:
+        - file_path (str): the path of the file to read
+
+        Returns:
+        - Union[bytes, mmap.mmap]: the file contents
+        """
+        with open(file_path, 'rb') as file:
+            if self.use_mmap and os.fstat(file.fileno()).st_size > 0:
+                # the map outlives the file object, and files are replaced rather than rewritten in place,
+                # so a map keeps seeing the contents it was created with
+                return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            return file.read()
+
+    def read_contents(self, file_name):
+        """
+        A hook for reading the raw contents of a file that's being loaded.
+
+        Args:
+        - file_name (str): the name of the file to read
+
+        Returns:
+        - Union[bytes, mmap.mmap]: the file contents
+        """
+        return self._read_file(os.path.join(self.root_path, file_name))
+
+    def file_written(self, file_name):
+        """
+        A hook called once a file has been written, before the write lands in the cache.
+
+        Args:
+        - file_name (str): the name of the file that was written
+
+        Returns:
+        None
+        """
+        pass
+
+    def estimate_memory(self, file_size):
+        """
+        Estimate the memory usage of a file's processed contents from its size on disk, so memory
+        can be reserved for the file while it loads.
+
+        Args:
+        - file_size (int): the size of the file
+
+        Returns:
+        - int: the estimated memory usage, at most max_memory
+        """
+        return min(self.max_memory, int(file_size * self.size_ratio))
+
+    def observe_memory(self, file_size, memory_usage):
+        """
+        Record the memory usage of a file's processed contents, to improve later estimates.
+
+        Args:
+        - file_size (int): the size of the file
+        - memory_usage (int): the memory usage of its processed contents
+
+        Returns:
+        None
+        """
+        if file_size > 0:
+            # a moving average, so the estimate follows the files currently being loaded
+            self.size_ratio += (memory_usage / file_size - self.size_ratio) * 0.2
+
+    def _complete(self, future, fn, file_name, *args):
+        """
+        Run a load or write of a file and complete its future.  A load or write that fails is
+        removed from the cache, so it's retried the next time the file is requested.
+
+        Args:
+        - future (Future): the future of the load or write
+        - fn (callable): the load or write, which is passed the future as well as its arguments
+        - file_name (str): the name of the file
+        - args: the other arguments of the load or write
+
+        Returns:
+        None
+        """
+        try:
+            future.set_result(fn(file_name, *args, future=future))
+        except BaseException as e:
+            with self.file_futures_lock:
+                info = self.file_futures.get(file_name)
+                if info is not None and info[-1] is future:
+                    self._unload_file(file_name)
+            future.set_exception(e)
+
+    def _load_file(self, file_name, future):
         """
         Loads the specified file into memory and updates the memory usage and file future.
 
         Args:
         - file_name (str): the name of the file to be loaded
+        - future (Future): the future of the load
 
         Returns:
         - object: The processed contents of the file
         """
-        with open(os.path.join(self.root_path, file_name), 'rb') as file:
-            contents, memory_usage = self.process_contents(file.read())
-        self.update_file_futures_and_memory(file_name, memory_usage=memory_usage)
+        try:
+            raw_contents = self.read_contents(file_name)
+            contents, memory_usage = self._process(raw_contents)
+        finally:
+            self._load_finished()
+        self.observe_memory(len(raw_contents), memory_usage)
+        self.update_file_futures_and_memory(file_name, memory_usage, future)
         return contents
 
-    def _write_file(self, file_name, new_file_contents, use_fsync):
+    def _read_uncached(self, file_name):
+        """
+        Read and process a file without caching it.
+
+        Args:
+        - file_name (str): the name of the file to read
+
+        Returns:
+        - object: The processed contents of the file
+        """
+        try:
+            return self._process(self.read_contents(file_name))[0]
+        finally:
+            self._load_finished()
+
+    def _wait_for_load_slot(self, file_name):
+        """
+        Wait until fewer than max_pending_loads loads are pending, so a file can be loaded.
+
+        Args:
+        - file_name (str): the name of the file to load
+
+        Returns:
+        - tuple: the file's entry if another request started loading it meanwhile, otherwise None
+
+        Raises:
+        - CacheBusyError: if no load finished within admission_timeout
+        """
+        assert self.file_futures_lock.locked()
+        if self.max_pending_loads is None:
+            return None
+        deadline = None if self.admission_timeout is None else time.monotonic() + self.admission_timeout
+        while self.pending_loads >= self.max_pending_loads:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                self.rejected_loads += 1
+                raise CacheBusyError(f"too many pending loads: {file_name} {self.pending_loads}")
+            self.load_slots.wait(remaining)
+            info = self.file_futures.get(file_name)
+            if info is not None:
+                return info
+        return None
+
+    def _load_finished(self):
+        """
+        Free the load slot of a load that read and processed its file, successfully or not.
+        """
+        with self.file_futures_lock:
+            self.pending_loads -= 1
+            self.load_slots.notify()
+
+    def _write_file(self, file_name, new_file_contents, use_fsync, append=False, processed=None, future=None):
         """
         Write a file to the filesystem, with option to use fsync to ensure that all data is written to the filesystem.
 
@@ -65,6 +360,9 @@ class FileCache:
         - file_name (str): the name of the file to be written
         - new_file_contents (Union[str, bytes]): the new contents of the file
         - use_fsync (bool): whether to use fsync to ensure data is written to the filesystem
+        - append (bool): append new_file_contents to the file instead of replacing it
+        - processed (tuple): the processed contents of the whole file and their memory usage, if already known
+        - future (Future): the future of the write
 
         Returns:
         - object: The processed contents of the file
@@ -72,17 +370,34 @@ class FileCache:
         write_fname = os.path.join(self.root_path, file_name)
         write_path = os.path.dirname(write_fname)
         os.makedirs(write_path, exist_ok=True)
-        with open(os.path.join(self.root_path, file_name), 'wb') as f:
-            f.write(new_file_contents)
-            if use_fsync:
-                os.fsync(f.fileno())
-        contents, memory_usage = self.process_contents(new_file_contents)
-        self.update_file_futures_and_memory(file_name, memory_usage=memory_usage)
+        if append:
+            with open(write_fname, 'ab') as f:
+                f.write(new_file_contents)
+                if use_fsync:
+                    os.fsync(f.fileno())
+        else:
+            # readers that open the file directly (e.g. memory mapped) see either the old or the new
+            # contents, never a partially written file
+            tmp_fname = write_fname + TMP_SUFFIX
+            with open(tmp_fname, 'wb') as f:
+                f.write(new_file_contents)
+                if use_fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp_fname, write_fname)
+        self.file_written(file_name)
+        if processed is None:
+            if append or self.use_mmap:
+                new_file_contents = self._read_file(write_fname)
+            processed = self._process(new_file_contents)
+        contents, memory_usage = processed
+        if not append:
+            self.observe_memory(len(new_file_contents), memory_usage)
+        self.update_file_futures_and_memory(file_name, memory_usage, future)
         return contents
 
     def update_file_access_time(self, file_name):
         """
-        Updates the access time of the specified file and reorders the file access time heap.
+        Updates the access time of the specified file and moves it to the most recently used end of the LRU.
 
         Args:
         - file_name (str): the name of the file to update the access time for
@@ -92,35 +407,45 @@ class FileCache:
         """
         assert self.file_futures_lock.locked()
         assert self.file_futures.get(file_name) is not None
-        self.file_access_times = [(t, fn) for t, fn in self.file_access_times if fn != file_name]
-        heapq.heappush(self.file_access_times, (time.time_ns(), file_name))
+        self.file_access_times[file_name] = time.time_ns()
+        self.file_access_times.move_to_end(file_name)
+        self.file_access_counts[file_name] = self.file_access_counts.get(file_name, 0) + 1
 
-    def update_file_futures_and_memory(self, file_name, memory_usage):
+    def update_file_futures_and_memory(self, file_name, memory_usage, future):
         """
-        Updates the memory usage and file future for the specified file.
+        Updates the memory usage and file future for the specified file once it's loaded or written.
+        The memory reserved for the file when the load or write started is reconciled with its actual
+        memory usage.
 
         Args:
         - file_name (str): the name of the file to update
         - memory_usage (int): the memory usage of the file
+        - future (Future): the future of the load or write
 
         Returns:
         None
         """
         with self.file_futures_lock:
-            can_cache = self.recover_memory(memory_usage)
-            if not can_cache:
-                logging.warning(f"unable to recover memory for requsted file: {file_name} {memory_usage} {self.max_memory} {self.current_memory_usage}")
             info = self.file_futures.get(file_name)
-            # the file can't be unloaded until it's got a file access time
-            assert info is not None
+            if info is None or info[-1] is not future:
+                # unloaded or replaced while loading, which released the reservation
+                return
+            reserved = info[1]
+            if memory_usage <= reserved:
+                self._release_memory(reserved - memory_usage)
+                can_cache = True
+            else:
+                # the file isn't in the LRU yet, so recovering memory can't unload it
+                can_cache = memory_usage <= self.max_memory and self.recover_memory(memory_usage - reserved)
             if can_cache:
+                self.file_futures[file_name] = (False, memory_usage, future)
                 self.update_file_access_time(file_name)
-                self.current_memory_usage += memory_usage
-                self.file_futures[file_name] = (False, memory_usage, info[-1])
+                self.eviction_policy.insert(file_name, memory_usage)
             else:
-                del self.file_futures[file_name]
+                logging.warning(f"unable to recover memory for requsted file: {file_name} {memory_usage} {self.max_memory} {self.current_memory_usage}")
+                self._unload_file(file_name)
 
-    def update_file(self, file_name, new_file_contents, use_fsync=False):
+    def update_file(self, file_name, new_file_contents, use_fsync=False, append=False, processed=None):
         """
         Update the content of a file.
 
@@ -132,19 +457,25 @@ class FileCache:
         - file_name (str): the name of the file to be updated
         - new_data (Union[str, bytes]): the new content of the file
         - use_fsync (bool): use fsync when writing to disk
+        - append (bool): append the new content to the file instead of replacing it
+        - processed (tuple): the processed contents of the whole file after the update and their memory
+          usage, so they don't have to be derived from the file again
 
         Returns:
         bool - True if update was applied.
         """
-        claim = len(new_file_contents)
+        claim = len(new_file_contents) if processed is None else processed[1]
         if claim > self.max_memory:
             raise MemoryError(f"requested file update larger than max_memory: {file_name} {claim} {self.max_memory}")
         with self.file_futures_lock:
             info = self.file_futures.get(file_name)
             if info is None or not info[0]:
                 self._unload_file(file_name)
-                future = self.executor.submit(self._write_file, file_name, new_file_contents, use_fsync)
-                self.file_futures[file_name] = (True, claim, future)
+                future = Future()
+                # the write can't land before its entry is added, since that needs the lock
+                self.executor.submit(self._complete, future, self._write_file, file_name, new_file_contents, use_fsync, append, processed)
+                # memory is reserved up front and reconciled with the actual usage when the write lands
+                self.file_futures[file_name] = (True, claim if self.recover_memory(claim) else 0, future)
                 write_applied = True
             else:
                 assert info[0]
@@ -164,10 +495,27 @@ class FileCache:
         None
         """
         assert self.file_futures_lock.locked()
-        info = self.file_futures.get(file_name)
+        info = self.file_futures.pop(file_name, None)
         if info is not None:
-            self.current_memory_usage -= info[1]
-            del self.file_futures[file_name]
+            # files still loading or being written hold the memory reserved for them
+            self._release_memory(info[1])
+        self.file_access_times.pop(file_name, None)
+        self.file_access_counts.pop(file_name, None)
+        self.eviction_policy.remove(file_name)
+
+    def _release_memory(self, amount):
+        """
+        Release claimed memory.
+
+        Args:
+        amount (int): the amount of memory to release
+
+        Returns:
+        None
+        """
+        assert self.file_futures_lock.locked()
+        self.current_memory_usage -= amount
+        self.budget.release(amount)
 
     def unload_file(self, file_name):
         """
@@ -180,13 +528,12 @@ class FileCache:
         None
         """
         with self.file_futures_lock:
-            self.file_access_times = [(t, fn) for t, fn in self.file_access_times if fn != file_name]
-            heapq.heapify(self.file_access_times)
             self._unload_file(file_name)
 
     def recover_memory(self, claim):
         """
-        Recover memory by unloading files from memory until the claim is achieved.
+        Recover memory by unloading files from memory until the claim is achieved, and then claim it.
+        This cache's own files are unloaded first, then those of other caches sharing the budget.
 
         Args:
         claim (int): amount of memory to claim
@@ -196,24 +543,82 @@ class FileCache:
         """
         assert self.file_futures_lock.locked()
         assert claim <= self.max_memory
-        # start_mem = self.current_memory_usage
-        writing = None
-        while (self.current_memory_usage + claim) > self.max_memory and len(self.file_access_times) > 0:
-            data = heapq.heappop(self.file_access_times)
-            oldest_file = data[1]
-            if self.file_futures[oldest_file][0]:
-                if writing is None:
-                    writing = []
-                writing.append(data)
-                continue
-            self._unload_file(oldest_file)
-        if writing is not None:
-            for x in writing:
-                heapq.heappush(self.file_access_times, x)
-        # recovered_mem = self.current_memory_usage - start_mem
-        # if recovered_mem > 0:
-        #     tinfo(f"recovered: {recovered_mem}")
-        return (self.current_memory_usage + claim) <= self.max_memory
+        while not self.budget.claim(claim):
+            # files loading or being written aren't given to the policy until they land, so every victim is evictable
+            victim = self.eviction_policy.victim()
+            if victim is not None:
+                self._unload_file(victim)
+            elif not self.budget.recover(claim, self):
+                return False
+        self.current_memory_usage += claim
+        return True
+
+    def _resident_contents(self, file_name):
+        """
+        Returns the raw contents of a file if they're loaded, otherwise None.
+        """
+        with self.file_futures_lock:
+            info = self.file_futures.get(file_name)
+            # a done future that isn't being written has been through update_file_futures_and_memory
+            if info is None or info[0] or not info[-1].done() or info[-1].exception() is not None:
+                return None
+            contents = info[-1].result()
+            if not isinstance(contents, (bytes, bytearray, mmap.mmap)):
+                return None
+            self.update_file_access_time(file_name)
+            self.eviction_policy.access(file_name)
+            return contents
+
+    def read_range(self, file_name, offset=0, length=None):
+        """
+        Read part of a file.  The range is sliced from the cached contents if the file is loaded, and
+        otherwise read from disk without loading the file, so it works for files larger than max_memory.
+
+        Args:
+        - file_name (str): the name of the file to read
+        - offset (int): the offset of the range
+        - length (int): the length of the range, or None to read to the end of the file
+
+        Returns:
+        bytes: the range, which is shorter than length if it runs past the end of the file
+        """
+        return b''.join(self.iter_range(file_name, offset, length))
+
+    def iter_range(self, file_name, offset=0, length=None, chunk_size=None):
+        """
+        Read part of a file in chunks, e.g. to stream a file larger than max_memory.  Like read_range,
+        chunks are sliced from the cached contents if the file is loaded and otherwise read from disk.
+        All of the chunks come from the same version of the file, even if it's updated meanwhile.
+
+        Args:
+        - file_name (str): the name of the file to read
+        - offset (int): the offset of the range
+        - length (int): the length of the range, or None to read to the end of the file
+        - chunk_size (int): the maximum size of each chunk (default: 4MB)
+
+        Returns:
+        iterator: the non-empty chunks of the range
+        """
+        if offset < 0 or (length is not None and length < 0):
+            raise ValueError(f"invalid range: {file_name} {offset} {length}")
+        chunk_size = chunk_size or 2**22
+        contents = self._resident_contents(file_name)
+        if contents is not None:
+            view = memoryview(contents)
+            end = len(view) if length is None else min(len(view), offset + length)
+            for i in range(offset, end, chunk_size):
+                yield view[i:min(i + chunk_size, end)]
+            return
+        with open(os.path.join(self.root_path, file_name), 'rb') as file:
+            file.seek(offset)
+            remaining = length
+            while remaining is None or remaining > 0:
+                chunk = file.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if len(chunk) == 0:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
 
     def get_file(self, file_name):
         """
@@ -225,6 +630,18 @@ class FileCache:
         Returns:
         bytes: the raw file contents
         """
+        return self.load_file(file_name).result()
+
+    def load_file(self, file_name):
+        """
+        Start loading a file into memory, if it isn't already, without waiting for it to load.
+
+        Args:
+        - file_name (str): the name of the file to load
+
+        Returns:
+        Future: a future for the processed contents of the file
+        """
         full_file_path = os.path.join(self.root_path, file_name)
         if not os.path.exists(full_file_path):
             raise FileNotFoundError(file_name)
@@ -232,14 +649,81 @@ class FileCache:
         if claim > self.max_memory:
             raise MemoryError(f"requested file larger than max_memory: {file_name} {claim} {self.max_memory}")
         with self.file_futures_lock:
+            self.eviction_policy.access(file_name)
             info = self.file_futures.get(file_name)
+            if info is None:
+                # waiting releases the lock, so another request may start loading the file meanwhile
+                info = self._wait_for_load_slot(file_name)
             if info is None:
                 tinfo(f"get_file: {file_name}")
-                future = self.executor.submit(self._load_file, file_name)
-                self.file_futures[file_name] = (False, claim, future)
+                self.misses += 1
+                self.pending_loads += 1
+                reserved = self.estimate_memory(claim)
+                if self.budget.used + reserved > self.budget.max_memory and not self.eviction_policy.admit(file_name, reserved):
+                    # not worth unloading other files for, so it's loaded for this request only
+                    return self.executor.submit(self._read_uncached, file_name)
+                future = Future()
+                self.executor.submit(self._complete, future, self._load_file, file_name)
+                # memory is reserved up front and reconciled with the actual usage when the load lands
+                self.file_futures[file_name] = (False, reserved if self.recover_memory(reserved) else 0, future)
             else:
                 tinfo(f"get_file [cached]: {file_name}")
+                self.hits += 1
                 future = info[-1]
                 if future.done():
                     self.update_file_access_time(file_name)
-        return future.result()
+        return future
+
+    def warm_file(self, file_name):
+        """
+        Start loading a file into free memory, e.g. to warm up a restarted cache.  Unlike load_file,
+        no other files are unloaded to make room, and the load isn't counted as a request.
+
+        Args:
+        - file_name (str): the name of the file to load
+
+        Returns:
+        Future: a future for the processed contents of the file, or None if it's already loaded or doesn't exist
+
+        Raises:
+        MemoryError: if there isn't enough free memory for the file
+        """
+        full_file_path = os.path.join(self.root_path, file_name)
+        if not os.path.exists(full_file_path):
+            return None
+        reserved = self.estimate_memory(os.path.getsize(full_file_path))
+        with self.file_futures_lock:
+            if file_name in self.file_futures:
+                return None
+            if not self.budget.claim(reserved):
+                raise MemoryError(f"no free memory to warm file: {file_name} {reserved}")
+            self.current_memory_usage += reserved
+            # counted against max_pending_loads, but warming up loads one file at a time so it never waits
+            self.pending_loads += 1
+            future = Future()
+            self.executor.submit(self._complete, future, self._load_file, file_name)
+            self.file_futures[file_name] = (False, reserved, future)
+        return future
+
+    def hot_set(self):
+        """
+        Describe the loaded files, most valuable first, so a restarted cache can be warmed up with them.
+
+        Returns:
+        list: a dict for each file with its name, memory usage, last access time (ns) and number of accesses since it was loaded
+        """
+        with self.file_futures_lock:
+            files = [{'name': name, 'memory': self.file_futures[name][1], 'last_access': access_time, 'accesses': self.file_access_counts.get(name, 0)}
+                     for name, access_time in self.file_access_times.items()]
+        # frequently used files first, and of those the most recently used
+        files.sort(key=lambda f: (f['accesses'], f['last_access']), reverse=True)
+        return files
+
+    def tier_stats(self):
+        """
+        Returns the hits and misses of each tier of the cache.
+
+        Returns:
+        dict: the stats of each tier, by tier name
+        """
+        return {'memory': {'hits': self.hits, 'misses': self.misses, 'pending_loads': self.pending_loads, 'rejected_loads': self.rejected_loads}}
@@ -1,5 +1,6 @@
 import gzip
 import logging
+import os
 import struct
 import threading
 import time
@@ -9,9 +10,53 @@ from io import BytesIO
 import pandas as pd
 import simdjson as json
 
+from .codecs import available_wire_codecs, default_wire_codec, get_wire_codec
+
+
+# sendmsg accepts at most IOV_MAX buffers per call
+IOV_MAX = 1024
+
 
 def send_msg(conn, msg):
-    conn.sendall(struct.pack('>I', len(msg)) + msg)
+    """
+    Send a length-prefixed message.  The message may be a single buffer or a list of buffers,
+    which are sent back to back with the header without being copied into one buffer.
+    """
+    buffers = [memoryview(b).cast('B') for b in (msg if isinstance(msg, list) else [msg])]
+    header = struct.pack('>I', sum(b.nbytes for b in buffers))
+    send_buffers(conn, [header, *buffers])
+
+
+def send_buffers(conn, buffers):
+    if not hasattr(conn, 'sendmsg'):
+        for b in buffers:
+            conn.sendall(b)
+        return
+    buffers = [b for b in buffers if len(b) > 0]
+    i = 0
+    while i < len(buffers):
+        sent = conn.sendmsg(buffers[i:i+IOV_MAX])
+        # skip past the buffers that were fully sent and trim a partially sent one
+        while sent > 0:
+            n = len(buffers[i])
+            if sent >= n:
+                sent -= n
+                i += 1
+            else:
+                buffers[i] = buffers[i][sent:]
+                sent = 0
+
+
+def send_file(conn, file_path):
+    """
+    Send a file as a length-prefixed message.  The file is sent with sendfile, straight from the
+    OS page cache, without copying it through Python.
+    """
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        conn.sendall(struct.pack('>I', size))
+        if size > 0:
+            conn.sendfile(f, 0, size)
 
 
 def recv_msg(conn):
@@ -23,30 +68,48 @@ def recv_msg(conn):
     return recvall(conn, msglen)
 
 
+def recv_stream(conn):
+    """
+    Receive a stream of messages ended by an empty message.  If the iterator is closed before the
+    stream ends, the rest of the stream is read and dropped so the connection can be reused.
+    """
+    ended = False
+    try:
+        while True:
+            data = recv_msg(conn)
+            if data is None:
+                raise ConnectionError("connection closed while streaming")
+            if len(data) == 0:
+                ended = True
+                return
+            yield data
+    finally:
+        while not ended:
+            data = recv_msg(conn)
+            ended = data is None or len(data) == 0
+
+
 def recvall(conn, n):
-    data = bytearray()
-    while len(data) < n:
-        packet = conn.recv(n - len(data))
-        if not packet:
+    data = bytearray(n)
+    view = memoryview(data)
+    received = 0
+    while received < n:
+        count = conn.recv_into(view[received:], n - received)
+        if count == 0:
             return None
-        data.extend(packet)
+        received += count
     return data
 
 
-def recv_df(conn):
+def recv_df(conn, codec=None):
     data = recv_msg(conn)
     if data is None or len(data) == 0:
         raise ValueError("no data")
-    bio = BytesIO(data)
-    with gzip.open(bio, 'rb') as f:
-        return pd.read_pickle(f)
+    return get_wire_codec(codec).decode(data)
 
 
-def send_df(conn, df):
-    bio = BytesIO()
-    with gzip.open(bio, 'wb', compresslevel=1) as f:
-        df.to_pickle(f)
-    send_msg(conn, bio.getvalue())
+def send_df(conn, df, codec=None):
+    send_msg(conn, get_wire_codec(codec).encode(df))
 
 
 def send_json(conn, **kwargs):
@@ -95,6 +158,25 @@ def df_memory_usage(df):
     return df.memory_usage(deep=True).sum()
 
 
+def concat_with_keys(dfs, keys, key_column):
+    """
+    Concatenate DataFrames into one, with a column holding the key each row came from.
+
+    Args:
+        dfs (list): The DataFrames.
+        keys (list): The key of each DataFrame.
+        key_column (str): The name of the key column, which comes first.
+
+    Returns:
+        DataFrame: The concatenated DataFrame, with the index of each DataFrame kept.
+    """
+    frames = [(key, df) for key, df in zip(keys, dfs) if len(df) > 0]
+    if len(frames) == 0:
+        columns = [key_column] + [c for df in dfs for c in df.columns if c != key_column]
+        return pd.DataFrame(columns=list(dict.fromkeys(columns)))
+    return pd.concat([df.assign(**{key_column: key})[[key_column] + [c for c in df.columns if c != key_column]] for key, df in frames])
+
+
 def timeit(func):
     @wraps(func)
     def timeit_wrapper(*args, **kwargs):
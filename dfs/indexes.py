@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+
+class SecondaryIndex:
+    """
+    Maps values of a DataFrame column to the positions of the rows holding them, so rows can be
+    looked up by a column other than the index without scanning it.
+
+    Args:
+        series (Series): The column to index.
+    """
+    kind = None
+
+    def __init__(self, series):
+        raise NotImplementedError()
+
+    def lookup(self, values):
+        """
+        Returns the positions of the rows whose value is one of values, in no particular order.
+
+        Args:
+            values (list): The values to look up.
+
+        Returns:
+            ndarray: The row positions.
+        """
+        raise NotImplementedError()
+
+    def range(self, start=None, end=None):
+        """
+        Returns the positions of the rows whose value is between start and end, inclusive.
+
+        Args:
+            start: The lowest value, or None for no lower bound.
+            end: The highest value, or None for no upper bound.
+
+        Returns:
+            ndarray: The row positions.
+        """
+        raise ValueError(f"{self.kind} indexes don't support range lookups")
+
+    @property
+    def nbytes(self):
+        """
+        The approximate memory used by the index.
+        """
+        raise NotImplementedError()
+
+
+class SortedIndex(SecondaryIndex):
+    """
+    The column's values in sorted order, with their row positions.  Lookups and range lookups are
+    binary searches, O(log n) plus the rows found.
+    """
+    kind = 'sorted'
+
+    def __init__(self, series):
+        values = series.to_numpy()
+        self.positions = np.argsort(values, kind='stable')
+        # an Index searches with values such as timestamp strings converted to the column's type
+        self.values = pd.Index(values[self.positions])
+
+    def lookup(self, values):
+        bounds = [(self.values.searchsorted(v, side='left'), self.values.searchsorted(v, side='right')) for v in values]
+        return np.concatenate([self.positions[start:end] for start, end in bounds]) if len(bounds) > 0 else self.positions[:0]
+
+    def range(self, start=None, end=None):
+        first = 0 if start is None else self.values.searchsorted(start, side='left')
+        last = len(self.values) if end is None else self.values.searchsorted(end, side='right')
+        return self.positions[first:max(first, last)]
+
+    @property
+    def nbytes(self):
+        return self.positions.nbytes + self.values.nbytes
+
+
+class HashIndex(SecondaryIndex):
+    """
+    The row positions of each distinct value of the column.  Lookups are O(1) plus the rows found,
+    which suits categorical columns such as symbols, but there are no range lookups.
+    """
+    kind = 'hash'
+
+    def __init__(self, series):
+        codes, uniques = pd.factorize(series)
+        order = np.argsort(codes, kind='stable')
+        # rows with a missing value have code -1 and sort first, so they're skipped
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1), side='left')
+        self.positions = {value: order[bounds[i]:bounds[i+1]] for i, value in enumerate(uniques)}
+        self.order = order
+
+    def lookup(self, values):
+        found = [self.positions[v] for v in values if v in self.positions]
+        return np.concatenate(found) if len(found) > 0 else self.order[:0]
+
+    @property
+    def nbytes(self):
+        # the positions are views of one array; each dict entry costs roughly a key, a view and a slot
+        return self.order.nbytes + 200 * len(self.positions)
+
+
+index_kinds = {index.kind: index for index in [SortedIndex, HashIndex]}
+
+
+def get_index_kind(name):
+    """
+    Returns the secondary index class registered under the specified name.
+
+    Args:
+        name (str): The index kind, e.g. 'sorted' or 'hash'.
+
+    Returns:
+        type: The SecondaryIndex subclass.
+    """
+    index = index_kinds.get(name)
+    if index is None:
+        raise ValueError(f"unknown index kind: {name} (available: {list(index_kinds.keys())})")
+    return index
@@ -0,0 +1,156 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+
+class QueryError(ValueError):
+    """
+    Raised when a query spec is malformed or can't be evaluated against a DataFrame.
+    """
+    pass
+
+
+# predicates are evaluated with these functions only, never with eval or DataFrame.query
+predicates = {
+    '==': lambda s, v: s == v,
+    '!=': lambda s, v: s != v,
+    '<': lambda s, v: s < v,
+    '<=': lambda s, v: s <= v,
+    '>': lambda s, v: s > v,
+    '>=': lambda s, v: s >= v,
+    'in': lambda s, v: s.isin(v),
+    'not in': lambda s, v: ~s.isin(v),
+    'between': lambda s, v: s.between(v[0], v[1]),
+    'isnull': lambda s, v: s.isna(),
+    'notnull': lambda s, v: s.notna(),
+    'contains': lambda s, v: s.astype(str).str.contains(str(v), regex=False),
+}
+
+aggregations = {'sum', 'mean', 'median', 'min', 'max', 'count', 'size', 'first', 'last', 'std', 'var', 'nunique', 'ohlc'}
+numeric_aggregations = {'sum', 'mean', 'median', 'std', 'var', 'ohlc'}
+
+query_keys = ['where', 'groupby', 'agg', 'resample', 'downsample', 'head', 'tail']
+
+
+def _column(df, name):
+    if name in df.columns:
+        return df[name]
+    if name is not None and name == df.index.name:
+        return df.index.to_series(index=df.index)
+    raise QueryError(f"unknown column: {name}")
+
+
+def _check_agg(agg):
+    """
+    Check an aggregation spec: a function name, a list of them, or a dict of either by column.
+    """
+    specs = list(agg.values()) if isinstance(agg, dict) else [agg]
+    for spec in specs:
+        for fn in (spec if isinstance(spec, list) else [spec]):
+            if fn not in aggregations:
+                raise QueryError(f"unknown aggregation: {fn} (available: {sorted(aggregations)})")
+    return agg
+
+
+def _to_frame(result, agg):
+    """
+    Aggregations such as size return a Series or a scalar, but a query always returns a DataFrame.
+    """
+    if isinstance(result, pd.DataFrame):
+        return result
+    name = agg if isinstance(agg, str) else 'value'
+    if isinstance(result, pd.Series):
+        return result.to_frame(name=result.name if result.name is not None else name)
+    return pd.DataFrame({name: [result]})
+
+
+def _where(df, conditions):
+    mask = np.ones(len(df), dtype=bool)
+    for condition in conditions:
+        if not isinstance(condition, (list, tuple)) or len(condition) not in (2, 3):
+            raise QueryError(f"a condition is [column, op] or [column, op, value]: {condition}")
+        name, op, value = condition if len(condition) == 3 else (*condition, None)
+        predicate = predicates.get(op)
+        if predicate is None:
+            raise QueryError(f"unknown operator: {op} (available: {list(predicates.keys())})")
+        mask &= predicate(_column(df, name), value).to_numpy()
+    return df[mask]
+
+
+def _resample(df, resample):
+    if not isinstance(resample, dict) or 'rule' not in resample:
+        raise QueryError(f"resample is {{'rule': ..., 'agg': ...}}: {resample}")
+    if not isinstance(df.index, pd.DatetimeIndex):
+        raise QueryError("resample needs a DataFrame with a DatetimeIndex")
+    agg = _check_agg(resample.get('agg', 'last'))
+    if isinstance(agg, str) and agg in numeric_aggregations:
+        # a function applied to every column skips those it can't aggregate, e.g. a symbol column
+        df = df.select_dtypes('number')
+    return df.resample(resample['rule']).agg(agg)
+
+
+def apply_query(df, query):
+    """
+    Evaluate a declarative query against a DataFrame.  A query is a dict of these optional steps,
+    which are applied in this order:
+
+        where: A list of conditions, all of which a row must meet.  Each is [column, op, value],
+            with op one of ==, !=, <, <=, >, >=, in, not in, between (value is [low, high]),
+            contains, or [column, op] with op isnull or notnull.  The index can be named as a column.
+        groupby: A column or list of columns to group rows by, aggregated with agg.
+        agg: An aggregation: a function name, a list of them, or a dict of either by column.
+            Functions are sum, mean, median, min, max, count, size, first, last, std, var, nunique and ohlc.
+            Without groupby, the whole frame is aggregated.
+        resample: {'rule': a pandas offset alias such as '5min', 'agg': an aggregation (default: 'last')}.
+            Only for frames with a DatetimeIndex.  Not combined with groupby.
+        downsample: The maximum number of rows, kept evenly spaced.
+        head: Keep only the first n rows.
+        tail: Keep only the last n rows.
+
+    Only these steps and functions are available, so a query can't run arbitrary code.
+
+    Args:
+        df (DataFrame): The DataFrame to query.
+        query (dict): The query spec.
+
+    Returns:
+        DataFrame: The result.
+    """
+    if not isinstance(query, dict):
+        raise QueryError(f"a query is a dict: {query}")
+    unknown = [k for k in query.keys() if k not in query_keys]
+    if len(unknown) > 0:
+        raise QueryError(f"unknown query steps: {unknown} (available: {query_keys})")
+    if query.get('groupby') is not None and query.get('resample') is not None:
+        raise QueryError("a query can't have both groupby and resample")
+    if len(df.columns) == 0:
+        # a missing key, which is queried like it's filtered: as an empty DataFrame
+        return df
+    try:
+        if query.get('where'):
+            df = _where(df, query['where'])
+        if query.get('groupby') is not None:
+            agg = _check_agg(query.get('agg', 'sum'))
+            df = _to_frame(df.groupby(query['groupby']).agg(agg), agg)
+        elif query.get('resample') is not None:
+            df = _to_frame(_resample(df, query['resample']), query['resample'].get('agg'))
+        elif query.get('agg') is not None:
+            agg = _check_agg(query['agg'])
+            result = df.agg(agg)
+            # a whole frame aggregated with one function is a row of the columns' results
+            df = result.to_frame().T if isinstance(result, pd.Series) else _to_frame(result, agg)
+        if query.get('downsample') is not None:
+            max_rows = int(query['downsample'])
+            if max_rows <= 0:
+                raise QueryError(f"downsample must be positive: {max_rows}")
+            df = df.iloc[::max(1, math.ceil(len(df) / max_rows))]
+        if query.get('head') is not None:
+            df = df.head(int(query['head']))
+        if query.get('tail') is not None:
+            df = df.tail(int(query['tail']))
+    except QueryError:
+        raise
+    except (KeyError, TypeError, ValueError, AttributeError, pd.errors.DataError) as e:
+        raise QueryError(f"invalid query: {e!r}") from e
+    return df
@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    A bounded LRU cache of encoded replies, so a repeated request is answered without slicing or
+    encoding the DataFrame again.  Replies are cached by file and by the request's parameters, under
+    a memory budget of their own.  Each file has a version, which invalidate bumps when the file
+    changes or is unloaded; a reply computed from an older version is never cached.
+
+    Args:
+        max_memory (int): The maximum memory for replies (default: 0, nothing is cached).
+    """
+    def __init__(self, max_memory=None):
+        self.max_memory = max_memory or 0
+        self.memory_usage = 0
+        self.results = OrderedDict()
+        # the cached parameters of each file's replies, so they can be dropped when it changes
+        self.file_params = {}
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file_name, params):
+        """
+        Look up the reply to a request.
+
+        Args:
+            file_name (str): The name of the file the request reads.
+            params (tuple): The request's other parameters, which must be hashable.
+
+        Returns:
+            tuple: The encoded reply, or None if it isn't cached, and the file's current version,
+                which the reply is put with if it's computed.  The version is None if nothing is cached.
+        """
+        if self.max_memory == 0:
+            return None, None
+        with self.lock:
+            version = self.versions.get(file_name, 0)
+            data = self.results.get((file_name, params))
+            if data is None:
+                self.misses += 1
+                return None, version
+            self.results.move_to_end((file_name, params))
+            self.hits += 1
+            return data, version
+
+    def put(self, file_name, params, version, data):
+        """
+        Cache the reply to a request, unless the file changed since the version was looked up.
+
+        Args:
+            file_name (str): The name of the file the request reads.
+            params (tuple): The request's other parameters.
+            version (int): The file's version returned by get before the reply was computed.
+            data (bytes): The encoded reply.
+        """
+        with self.lock:
+            if version is None or len(data) > self.max_memory or self.versions.get(file_name, 0) != version:
+                return
+            self._discard((file_name, params))
+            while self.memory_usage + len(data) > self.max_memory:
+                self._discard(next(iter(self.results)))
+            self.results[(file_name, params)] = data
+            self.file_params.setdefault(file_name, set()).add(params)
+            self.memory_usage += len(data)
+
+    def invalidate(self, file_name):
+        """
+        Drop a file's cached replies and bump its version.
+
+        Args:
+            file_name (str): The name of the file that changed or was unloaded.
+        """
+        with self.lock:
+            self.versions[file_name] = self.versions.get(file_name, 0) + 1
+            for params in list(self.file_params.get(file_name, ())):
+                self._discard((file_name, params))
+
+    def _discard(self, key):
+        assert self.lock.locked()
+        data = self.results.pop(key, None)
+        if data is None:
+            return
+        self.memory_usage -= len(data)
+        file_name, params = key
+        file_params = self.file_params[file_name]
+        file_params.discard(params)
+        if len(file_params) == 0:
+            del self.file_params[file_name]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'used': self.memory_usage, 'max': self.max_memory}
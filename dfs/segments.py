@@ -0,0 +1,97 @@
+import os
+import struct
+
+import pandas as pd
+
+# a segmented file is this magic followed by length-prefixed segments, each a serialized DataFrame
+SEGMENT_MAGIC = b'DFSSEG\x00\x01'
+SEGMENT_HEADER = struct.Struct('>Q')
+
+
+def is_segmented(data):
+    """
+    Returns True if the data starts with the segmented file magic.
+    """
+    return bytes(data[:len(SEGMENT_MAGIC)]) == SEGMENT_MAGIC
+
+
+def encode_segment(data):
+    """
+    Returns a segment, ready to be appended to a segmented file.
+
+    Args:
+        data (bytes): The serialized DataFrame.
+
+    Returns:
+        bytes: The length-prefixed segment.
+    """
+    return SEGMENT_HEADER.pack(len(data)) + data
+
+
+def iter_segments(data):
+    """
+    Iterate over the segments of a segmented file.  A segment at the end that is only partially
+    written (e.g. being appended, or cut short by a crash) is skipped.
+
+    Args:
+        data (bytes): The contents of a segmented file.
+
+    Returns:
+        iterator: memoryviews of the serialized DataFrames, in the order they were appended.
+    """
+    view = memoryview(data)
+    offset = len(SEGMENT_MAGIC)
+    while offset + SEGMENT_HEADER.size <= len(view):
+        length = SEGMENT_HEADER.unpack_from(view, offset)[0]
+        offset += SEGMENT_HEADER.size
+        if offset + length > len(view):
+            break
+        yield view[offset:offset+length]
+        offset += length
+
+
+def scan_segments(file_path):
+    """
+    Count the segments of a file by reading only their headers.
+
+    Args:
+        file_path (str): The path of the file.
+
+    Returns:
+        tuple: The number of complete segments and the offset just past the last one.  Files that
+            aren't segmented have no segments.
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        if not is_segmented(f.read(len(SEGMENT_MAGIC))):
+            return 0, 0
+        count = 0
+        offset = len(SEGMENT_MAGIC)
+        while offset + SEGMENT_HEADER.size <= size:
+            f.seek(offset)
+            length = SEGMENT_HEADER.unpack(f.read(SEGMENT_HEADER.size))[0]
+            if offset + SEGMENT_HEADER.size + length > size:
+                break
+            offset += SEGMENT_HEADER.size + length
+            count += 1
+    return count, offset
+
+
+def merge_frames(frames):
+    """
+    Merge DataFrames into one sorted by index.  Where frames share index values, the row from the
+    earliest frame is kept.
+
+    Args:
+        frames (list): The DataFrames, oldest first.
+
+    Returns:
+        DataFrame: The merged DataFrame.
+    """
+    df = pd.concat(frames) if len(frames) > 1 else frames[0]
+    # appends usually extend the index, in which case there's nothing to sort or drop
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index(kind='mergesort')
+    if df.index.has_duplicates:
+        df = df[~df.index.duplicated(keep='first')]
+    return df
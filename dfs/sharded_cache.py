@@ -0,0 +1,143 @@
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .df_cache import PandasDataFrameCache
+from .file_cache import FileCache, MemoryBudget
+
+
+class ShardedFileCache:
+    """
+    Spreads keys across independent FileCache shards so that operations on different keys
+    don't contend on a single lock.  Each shard has its own lock and LRU, and all shards claim
+    memory from one shared MemoryBudget, so a single large key can use all of max_memory.
+    A shard that runs out of budget unloads its own least recently used files first.
+
+    Args:
+        max_memory (int): The maximum amount of memory that all shards together should use.
+        root_path (str): The root directory for where the cache files should be stored.
+        num_shards (int): The number of shards to split keys across.
+        cache_class (type): The FileCache subclass used for each shard.
+        executor (Executor): The executor the shards share to load and write files.
+        kwargs: Additional arguments passed to each shard's constructor, e.g. a cpu_executor they share.
+            Limits such as max_pending_loads apply to each shard.
+    """
+    def __init__(self, max_memory=None, root_path=None, num_shards=None, cache_class=None, executor=None, **kwargs):
+        self.max_memory = max_memory or 2**20
+        self.root_path = root_path or os.getcwd()
+        num_shards = num_shards or os.cpu_count() or 1
+        cache_class = cache_class or FileCache
+        # shards share one executor so the sharded cache doesn't spawn num_shards thread pools
+        self.executor = executor or ThreadPoolExecutor()
+        self.budget = MemoryBudget(self.max_memory)
+        self.shards = [cache_class(max_memory=self.max_memory, root_path=self.root_path, executor=self.executor, budget=self.budget, **kwargs) for _ in range(num_shards)]
+
+    def shard_for(self, file_name):
+        """
+        Returns the shard responsible for the specified file.
+
+        Args:
+            file_name (str): The name of the file.
+
+        Returns:
+            FileCache: The shard that owns the file.
+        """
+        return self.shards[zlib.crc32(file_name.encode()) % len(self.shards)]
+
+    @property
+    def current_memory_usage(self):
+        return sum(shard.current_memory_usage for shard in self.shards)
+
+    @property
+    def file_futures(self):
+        file_futures = {}
+        for shard in self.shards:
+            with shard.file_futures_lock:
+                file_futures.update(shard.file_futures)
+        return file_futures
+
+    def get_file(self, file_name):
+        return self.shard_for(file_name).get_file(file_name)
+
+    def load_file(self, file_name):
+        return self.shard_for(file_name).load_file(file_name)
+
+    def update_file(self, file_name, new_file_contents, use_fsync=False, append=False, processed=None):
+        return self.shard_for(file_name).update_file(file_name, new_file_contents, use_fsync=use_fsync, append=append, processed=processed)
+
+    def unload_file(self, file_name):
+        return self.shard_for(file_name).unload_file(file_name)
+
+    def warm_file(self, file_name):
+        return self.shard_for(file_name).warm_file(file_name)
+
+    def hot_set(self):
+        files = [f for shard in self.shards for f in shard.hot_set()]
+        files.sort(key=lambda f: (f['accesses'], f['last_access']), reverse=True)
+        return files
+
+    def tier_stats(self):
+        stats = {}
+        for shard in self.shards:
+            for tier, tier_stats in shard.tier_stats().items():
+                totals = stats.setdefault(tier, {})
+                for k, v in tier_stats.items():
+                    totals[k] = totals.get(k, 0) + v
+        return stats
+
+    def read_range(self, file_name, offset=0, length=None):
+        return self.shard_for(file_name).read_range(file_name, offset, length)
+
+    def iter_range(self, file_name, offset=0, length=None, chunk_size=None):
+        return self.shard_for(file_name).iter_range(file_name, offset, length, chunk_size)
+
+
+class ShardedPandasDataFrameCache(ShardedFileCache):
+    """
+    A ShardedFileCache of PandasDataFrameCache shards.
+
+    Args:
+        max_memory (int): The maximum amount of memory that all shards together should use.
+        root_path (str): The root directory for where the cache files should be stored.
+        num_shards (int): The number of shards to split keys across.
+        codec (str or StorageCodec): The codec used when writing DataFrames (default: 'pickle.gzip').
+        max_segments (int): The number of segments a file may grow to before it's compacted (default: 16).
+        sizer (str or DataFrameSizer): How DataFrames' memory usage is measured (default: 'sampled').
+        compressed_memory (int): The memory for the compressed tier, split evenly across the shards (default: 0).
+        result_memory (int): The memory for cached replies, split evenly across the shards (default: 0).
+        eviction_policy (str or type): The EvictionPolicy each shard uses to choose which DataFrames to unload (default: 'lru').
+        kwargs: Additional arguments passed to ShardedFileCache, e.g. executor or cpu_executor.
+    """
+    def __init__(self, max_memory=None, root_path=None, num_shards=None, codec=None, max_segments=None, sizer=None, compressed_memory=None, eviction_policy=None, result_memory=None, **kwargs):
+        num_shards = num_shards or os.cpu_count() or 1
+        super().__init__(max_memory=max_memory, root_path=root_path, num_shards=num_shards, cache_class=PandasDataFrameCache, codec=codec, max_segments=max_segments, sizer=sizer,
+                         compressed_memory=(compressed_memory or 0) // num_shards, eviction_policy=eviction_policy, result_memory=(result_memory or 0) // num_shards, **kwargs)
+
+    def get_dataframe(self, file_name, range_start=None, range_end=None, range_type="timestamp", columns=None):
+        return self.shard_for(file_name).get_dataframe(file_name, range_start, range_end, range_type, columns=columns)
+
+    def get_dataframes(self, file_names, range_start=None, range_end=None, range_type="timestamp", columns=None):
+        # loads are started on every shard before any is waited on
+        futures = [self.shard_for(file_name)._start_load(file_name) for file_name in file_names]
+        return [self.shard_for(file_name)._loaded_dataframe(file_name, future, range_start, range_end, range_type, columns) for file_name, future in zip(file_names, futures)]
+
+    def get_result(self, file_name, params):
+        return self.shard_for(file_name).get_result(file_name, params)
+
+    def put_result(self, file_name, params, version, data):
+        return self.shard_for(file_name).put_result(file_name, params, version, data)
+
+    def create_index(self, file_name, column, kind=None):
+        return self.shard_for(file_name).create_index(file_name, column, kind=kind)
+
+    def lookup(self, file_name, column, values=None, start=None, end=None, columns=None):
+        return self.shard_for(file_name).lookup(file_name, column, values=values, start=start, end=end, columns=columns)
+
+    def update(self, file_name, new_df, use_fsync=False):
+        return self.shard_for(file_name).update(file_name, new_df, use_fsync=use_fsync)
+
+    def migrate(self, file_name):
+        return self.shard_for(file_name).migrate(file_name)
+
+    def compact(self, file_name):
+        return self.shard_for(file_name).compact(file_name)
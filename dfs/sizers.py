@@ -0,0 +1,69 @@
+class DataFrameSizer:
+    """
+    Measures the memory a DataFrame uses, which is what a PandasDataFrameCache accounts against
+    its memory budget.
+    """
+    name = None
+
+    def size(self, df):
+        """
+        Returns the memory usage of a DataFrame, in bytes.
+
+        Args:
+            df (DataFrame): The DataFrame to measure.
+
+        Returns:
+            int: The memory usage.
+        """
+        raise NotImplementedError()
+
+
+class DeepSizer(DataFrameSizer):
+    """
+    Measures every object in object columns.  Exact, but it walks every row of object columns.
+    """
+    name = 'deep'
+
+    def size(self, df):
+        return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class SampledSizer(DataFrameSizer):
+    """
+    Measures numeric columns exactly, which is cheap, and estimates the objects in object columns
+    from an evenly spaced sample of rows.
+
+    Args:
+        sample_rows (int): The number of rows sampled (default: 1000).  Smaller frames are measured exactly.
+    """
+    name = 'sampled'
+
+    def __init__(self, sample_rows=None):
+        self.sample_rows = sample_rows or 1000
+
+    def size(self, df):
+        if len(df) <= self.sample_rows:
+            return int(df.memory_usage(index=True, deep=True).sum())
+        sample = df.iloc[::len(df) // self.sample_rows]
+        # only objects take more memory than their shallow size, so extrapolate the difference
+        extra = (sample.memory_usage(index=True, deep=True) - sample.memory_usage(index=True, deep=False)).sum()
+        return int(df.memory_usage(index=True, deep=False).sum() + extra * len(df) / len(sample))
+
+
+sizers = {sizer.name: sizer for sizer in [DeepSizer(), SampledSizer()]}
+
+
+def get_sizer(name):
+    """
+    Returns the sizer registered under the specified name.
+
+    Args:
+        name (str): The sizer name, e.g. 'deep' or 'sampled'.
+
+    Returns:
+        DataFrameSizer: The sizer.
+    """
+    sizer = sizers.get(name)
+    if sizer is None:
+        raise ValueError(f"unknown sizer: {name} (available: {list(sizers.keys())})")
+    return sizer
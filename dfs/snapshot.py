@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+import time
+
+import simdjson as json
+
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(cache, path):
+    """
+    Write a cache's hot set to a file.  The file is replaced atomically, so a crash while saving
+    leaves the previous snapshot.
+
+    Args:
+        cache (FileCache): The cache, or a ShardedFileCache.
+        path (str): The snapshot file.
+
+    Returns:
+        list: The hot set that was saved.
+    """
+    files = cache.hot_set()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(json.dumps({'version': SNAPSHOT_VERSION, 'saved': time.time_ns(), 'files': files}))
+    os.replace(tmp_path, path)
+    return files
+
+
+def read_snapshot(path):
+    """
+    Read a hot set saved by save_snapshot.
+
+    Args:
+        path (str): The snapshot file.
+
+    Returns:
+        list: The files of the hot set, most valuable first, or an empty list if there's no usable snapshot.
+    """
+    try:
+        with open(path) as f:
+            snapshot = json.loads(f.read())
+    except FileNotFoundError:
+        return []
+    except ValueError as e:
+        logging.warning(f"ignoring unreadable snapshot: {path} {e}")
+        return []
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        logging.warning(f"ignoring snapshot with unknown version: {path} {snapshot.get('version')}")
+        return []
+    return [dict(f) for f in snapshot['files']]
+
+
+def warm_up(cache, file_names, max_bytes_per_second=None, stop_event=None):
+    """
+    Load files one at a time, in order, until the cache's memory is full.  Files that are already
+    loaded or no longer exist are skipped, and no files are unloaded to make room, so warming up
+    alongside live requests never evicts what they loaded.
+
+    Args:
+        cache (FileCache): The cache, or a ShardedFileCache.
+        file_names (list): The files to load, most valuable first.
+        max_bytes_per_second (int): The maximum rate at which files are read (default: unlimited).
+        stop_event (threading.Event): Stops the warm up when set.
+
+    Returns:
+        int: The number of files loaded.
+    """
+    start = time.monotonic()
+    read = 0
+    loaded = 0
+    for file_name in file_names:
+        if stop_event is not None and stop_event.is_set():
+            break
+        try:
+            future = cache.warm_file(file_name)
+        except MemoryError:
+            break
+        if future is None:
+            continue
+        try:
+            future.result()
+        except Exception as e:
+            logging.warning(f"unable to warm file: {file_name} {e}")
+            continue
+        loaded += 1
+        if max_bytes_per_second:
+            read += os.path.getsize(os.path.join(cache.root_path, file_name))
+            # wait until the bytes read so far are within the rate
+            delay = start + read / max_bytes_per_second - time.monotonic()
+            if delay > 0:
+                if stop_event is not None:
+                    stop_event.wait(delay)
+                else:
+                    time.sleep(delay)
+    return loaded
+
+
+class HotSetSnapshotter:
+    """
+    Keeps a snapshot of a cache's hot set on disk, so a restarted server can warm up with the files
+    it was serving.  When started, it warms up the cache from the existing snapshot in the background
+    while the server serves requests, then saves the hot set periodically.  It saves once more when
+    stopped.
+
+    Args:
+        cache (FileCache): The cache, or a ShardedFileCache.
+        path (str): The snapshot file.
+        interval (float): The seconds between saves (default: 300).
+        max_bytes_per_second (int): The maximum rate at which files are read while warming up (default: unlimited).
+    """
+    def __init__(self, cache, path, interval=None, max_bytes_per_second=None):
+        self.cache = cache
+        self.path = path
+        self.interval = interval or 300
+        self.max_bytes_per_second = max_bytes_per_second
+        self.stop_event = threading.Event()
+        self.warm_up_thread = None
+        self.save_thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        files = read_snapshot(self.path)
+        # loads run on the cache's executor; these threads only pace them and wait
+        self.warm_up_thread = threading.Thread(target=self._warm_up, args=([f['name'] for f in files],), name='dfs-warm-up', daemon=True)
+        self.warm_up_thread.start()
+        self.save_thread = threading.Thread(target=self._save_periodically, name='dfs-snapshot', daemon=True)
+        self.save_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in (self.warm_up_thread, self.save_thread):
+            if thread is not None:
+                thread.join()
+        self.save()
+
+    def save(self):
+        try:
+            save_snapshot(self.cache, self.path)
+        except OSError as e:
+            logging.warning(f"unable to save snapshot: {self.path} {e}")
+
+    def _warm_up(self, file_names):
+        start = time.monotonic()
+        loaded = warm_up(self.cache, file_names, max_bytes_per_second=self.max_bytes_per_second, stop_event=self.stop_event)
+        logging.info(f"warmed up {loaded} of {len(file_names)} files in {time.monotonic() - start:.1f}s")
+
+    def _save_periodically(self):
+        while not self.stop_event.wait(self.interval):
+            self.save()
@@ -20,6 +20,11 @@ setup(
         "License :: OSI Approved :: MIT License"
     ],
     install_requires=['pandas~=1.5.1', 'pysimdjson~=5.0.2', 'colorama'],
+    extras_require={
+        'arrow': ['pyarrow'],
+        'lz4': ['lz4'],
+        'zstd': ['zstandard'],
+    },
     python_requires='>=3.8',
     include_package_data=True,
     test_suite='tests',
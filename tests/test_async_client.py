@@ -0,0 +1,108 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+
+import pandas as pd
+
+from dfs.async_client import AsyncDataFrameConnectionPool
+from dfs.df_cache import PandasDataFrameCache
+from dfs.df_server import DataFrameServer
+
+
+class AsyncDataFrameClientTests(unittest.TestCase):
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        self.cache = PandasDataFrameCache(max_memory=2**30, root_path=self.root_path)
+        self.server = DataFrameServer(self.cache, ('127.0.0.1', 0))
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+        index = pd.date_range("2022-01-01", periods=100, freq="min")
+        self.df = pd.DataFrame({'A': range(100), 'B': range(100, 200)}, index=index)
+
+    def run_with_pool(self, func, **kwargs):
+        async def run():
+            async with AsyncDataFrameConnectionPool(*self.server.server_address, **kwargs) as pool:
+                return await func(pool)
+        return asyncio.run(run())
+
+    def test_update_and_filter(self):
+        async def func(pool):
+            async with pool.get_connection() as c:
+                await c.update(self.df, "prices", "abc")
+                return await c.filter("prices", "abc", columns=['B'])
+        pd.testing.assert_frame_equal(self.run_with_pool(func, max_connections=2), self.df[['B']], check_freq=False)
+
+    def test_fan_out(self):
+        async def filter_key(pool, i):
+            async with pool.get_connection() as c:
+                return await c.filter("prices", str(i))
+
+        async def func(pool):
+            async with pool.get_connection() as c:
+                for i in range(10):
+                    await c.update(self.df.iloc[i:], "prices", str(i))
+            return await asyncio.gather(*[filter_key(pool, i % 10) for i in range(100)])
+
+        results = self.run_with_pool(func, max_connections=4, codecs=['pickle.lz4'])
+        for i, df in enumerate(results):
+            pd.testing.assert_frame_equal(df, self.df.iloc[i % 10:], check_freq=False)
+
+    def test_filter_iter(self):
+        async def func(pool):
+            async with pool.get_connection() as c:
+                await c.update(self.df, "prices", "abc")
+                dfs = [df async for df in c.filter_iter("prices", "abc", batch_rows=30)]
+                stream = c.filter_iter("prices", "abc", batch_rows=10)
+                await stream.__anext__()
+                await stream.aclose()
+                return dfs, await c.filter("prices", "abc")
+        dfs, df = self.run_with_pool(func)
+        self.assertEqual([len(df) for df in dfs], [30, 30, 30, 10])
+        pd.testing.assert_frame_equal(pd.concat(dfs), self.df, check_freq=False)
+        pd.testing.assert_frame_equal(df, self.df, check_freq=False)
+
+    def test_mfilter(self):
+        async def func(pool):
+            async with pool.get_connection() as c:
+                await c.update(self.df, "prices", "abc")
+                await c.update(self.df, "prices", "def")
+                return await c.mfilter([("prices", "abc"), ("prices", "def")]), await c.mfilter([("prices", "abc"), ("prices", "def")], key_column='key')
+        dfs, df = self.run_with_pool(func)
+        self.assertEqual(len(dfs), 2)
+        pd.testing.assert_frame_equal(dfs[1], self.df, check_freq=False)
+        self.assertEqual(len(df), 2 * len(self.df))
+        self.assertEqual(set(df['key']), {"prices/abc", "prices/def"})
+
+    def test_query(self):
+        async def func(pool):
+            async with pool.get_connection() as c:
+                await c.update(self.df, "prices", "abc")
+                return await c.query({'downsample': 10}, "prices", "abc")
+        df = self.run_with_pool(func)
+        pd.testing.assert_frame_equal(df, self.df.iloc[::10], check_freq=False)
+
+    def test_lookup(self):
+        async def func(pool):
+            async with pool.get_connection() as c:
+                await c.update(self.df, "prices", "abc")
+                await c.create_index("A", "prices", "abc", kind='hash')
+                return await c.lookup("A", "prices", "abc", values=[3, 7])
+        df = self.run_with_pool(func)
+        pd.testing.assert_frame_equal(df, self.df[self.df.A.isin([3, 7])])
+
+    def test_stats(self):
+        async def func(pool):
+            async with pool.get_connection() as c:
+                return await c.get_stats()
+        self.assertEqual(self.run_with_pool(func)['config']['root_path'], self.root_path)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+        for path, _, files in os.walk(self.root_path, topdown=False):
+            for f in files:
+                os.unlink(os.path.join(path, f))
+            os.rmdir(path)
@@ -0,0 +1,127 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import pandas as pd
+
+from dfs.cluster import ClusterConnectionPool, HashRing
+from dfs.df_cache import PandasDataFrameCache
+from dfs.df_server import DataFrameServer
+
+
+class HashRingTests(unittest.TestCase):
+    def setUp(self):
+        self.keys = [f"prices/key_{i}" for i in range(2000)]
+
+    def test_balance(self):
+        ring = HashRing([f"node_{i}" for i in range(4)])
+        counts = {}
+        for key in self.keys:
+            node = ring.node_for(key)
+            counts[node] = counts.get(node, 0) + 1
+        self.assertEqual(len(counts), 4)
+        for count in counts.values():
+            self.assertGreater(count, len(self.keys) / 4 * 0.7)
+            self.assertLess(count, len(self.keys) / 4 * 1.3)
+
+    def test_add_node(self):
+        ring = HashRing([f"node_{i}" for i in range(3)])
+        before = {key: ring.node_for(key) for key in self.keys}
+        ring.add_node("node_3")
+        ring.add_node("node_3")
+        self.assertEqual(len(ring), 4)
+        moved = [key for key in self.keys if ring.node_for(key) != before[key]]
+        # only the new node takes keys, about a quarter of them
+        self.assertTrue(all(ring.node_for(key) == "node_3" for key in moved))
+        self.assertLess(len(moved), len(self.keys) * 0.35)
+
+    def test_remove_node(self):
+        ring = HashRing([f"node_{i}" for i in range(4)])
+        before = {key: ring.node_for(key) for key in self.keys}
+        ring.remove_node("node_1")
+        ring.remove_node("missing")
+        # only the removed node's keys move
+        for key in self.keys:
+            if before[key] != "node_1":
+                self.assertEqual(ring.node_for(key), before[key])
+            else:
+                self.assertNotEqual(ring.node_for(key), "node_1")
+
+    def test_empty(self):
+        with self.assertRaises(ValueError):
+            HashRing().node_for("key")
+
+
+class ClusterConnectionPoolTests(unittest.TestCase):
+    num_nodes = 3
+
+    def setUp(self):
+        self.servers = []
+        self.threads = []
+        for _ in range(self.num_nodes):
+            cache = PandasDataFrameCache(max_memory=2**30, root_path=tempfile.mkdtemp())
+            server = DataFrameServer(cache, ('127.0.0.1', 0))
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            self.servers.append(server)
+            self.threads.append(thread)
+        self.pool = ClusterConnectionPool([s.server_address for s in self.servers], max_connections=4)
+        index = pd.date_range("2022-01-01", periods=100, freq="min")
+        self.df = pd.DataFrame({'A': range(100), 'B': range(100, 200)}, index=index)
+        self.key_paths = [("prices", f"sym_{i}") for i in range(20)]
+        for i, key_path in enumerate(self.key_paths):
+            self.pool.update(self.df + i, *key_path)
+
+    def tearDown(self):
+        self.pool._shutdown()
+        for server, thread in zip(self.servers, self.threads):
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            for path, _, files in os.walk(server.cache.root_path, topdown=False):
+                for f in files:
+                    os.unlink(os.path.join(path, f))
+                os.rmdir(path)
+
+    def test_routing(self):
+        stats = self.pool.get_stats(level=2)
+        self.assertEqual(set(stats.keys()), set(self.pool.nodes))
+        for node, node_stats in stats.items():
+            for key_path in node_stats['all_keys']:
+                self.assertEqual(self.pool.node_for(*key_path), node)
+        # every node holds some of the keys, and none is held twice
+        self.assertTrue(all(len(s['all_keys']) > 0 for s in stats.values()))
+        self.assertEqual(sum(len(s['all_keys']) for s in stats.values()), len(self.key_paths))
+        pd.testing.assert_frame_equal(self.pool.filter("prices", "sym_3"), self.df + 3, check_freq=False)
+        with self.pool.get_connection("prices", "sym_4") as c:
+            pd.testing.assert_frame_equal(c.filter("prices", "sym_4"), self.df + 4, check_freq=False)
+
+    def test_mfilter(self):
+        key_paths = self.key_paths[::-1] + [("prices", "missing")]
+        dfs = self.pool.mfilter(key_paths, columns=['B'])
+        self.assertEqual(len(dfs), len(key_paths))
+        for (_, sym), df in zip(key_paths[:-1], dfs):
+            pd.testing.assert_frame_equal(df, (self.df + int(sym.split('_')[1]))[['B']], check_freq=False)
+        self.assertTrue(dfs[-1].empty)
+        df = self.pool.mfilter(self.key_paths[:3], range_end=str(self.df.index[1]), key_column='key')
+        self.assertEqual(list(df['key']), ["prices/sym_0", "prices/sym_0", "prices/sym_1", "prices/sym_1", "prices/sym_2", "prices/sym_2"])
+        self.assertEqual(list(df['A']), [0, 1, 1, 2, 2, 3])
+
+    def test_filter_many(self):
+        dfs = self.pool.filter_many(self.key_paths)
+        for i, df in enumerate(dfs):
+            pd.testing.assert_frame_equal(df, self.df + i, check_freq=False)
+
+    def test_remove_node(self):
+        node = self.pool.node_for(*self.key_paths[0])
+        kept = [k for k in self.key_paths if self.pool.node_for(*k) != node]
+        host, port = node.rsplit(':', 1)
+        self.pool.remove_node(host, int(port))
+        self.assertEqual(len(self.pool.nodes), self.num_nodes - 1)
+        # the removed node's keys are routed to another node, which doesn't have them
+        self.assertNotEqual(self.pool.node_for(*self.key_paths[0]), node)
+        self.assertTrue(self.pool.filter(*self.key_paths[0]).empty)
+        # the other nodes' keys stay where they are
+        for key_path, df in zip(kept, self.pool.mfilter(kept)):
+            pd.testing.assert_frame_equal(df, self.df + self.key_paths.index(key_path), check_freq=False)
@@ -0,0 +1,123 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from dfs.codecs import codecs, get_codec, get_wire_codec, sniff_codec, wire_codecs
+from dfs.df_cache import PandasDataFrameCache
+from dfs.helpers import serialize_df
+
+
+class CodecTests(unittest.TestCase):
+    def setUp(self):
+        index = pd.date_range("2022-01-01", periods=100, freq="min")
+        self.df = pd.DataFrame({'A': range(100), 'B': [float(i) for i in range(100)], 'C': [str(i) for i in range(100)]}, index=index)
+
+    def test_round_trip(self):
+        for name, codec in codecs.items():
+            with self.subTest(codec=name):
+                data = codec.serialize(self.df)
+                self.assertEqual(sniff_codec(data).magic, codec.magic)
+                pd.testing.assert_frame_equal(codec.deserialize(data), self.df, check_freq=False)
+
+    def test_deserialize_columns(self):
+        for name, codec in codecs.items():
+            with self.subTest(codec=name):
+                df = codec.deserialize(codec.serialize(self.df), columns=['C', 'A'])
+                pd.testing.assert_frame_equal(df, self.df[['C', 'A']], check_freq=False)
+
+    def test_read_file_columns(self):
+        for name, codec in codecs.items():
+            with self.subTest(codec=name):
+                with tempfile.NamedTemporaryFile() as f:
+                    f.write(codec.serialize(self.df))
+                    f.flush()
+                    df = codec.read_file(f.name, columns=['B', 'missing'])
+                expected = self.df[['B']].assign(missing=float('nan'))
+                pd.testing.assert_frame_equal(df, expected, check_freq=False)
+
+    def test_non_string_column_labels(self):
+        df = pd.DataFrame({1: [1.0, 2.0], 2: [3.0, 4.0]}, index=pd.date_range("2022-01-01", periods=2))
+        for name, codec in codecs.items():
+            with self.subTest(codec=name):
+                result = codec.deserialize(codec.serialize(df), columns=[2, 3])
+                pd.testing.assert_frame_equal(result, df.reindex(columns=[2, 3]), check_freq=False)
+
+    def test_wire_round_trip(self):
+        for name, codec in wire_codecs.items():
+            with self.subTest(codec=name):
+                data = bytearray(b''.join(codec.encode(self.df)))
+                pd.testing.assert_frame_equal(codec.decode(data), self.df, check_freq=False)
+        self.assertEqual(get_wire_codec(None).name, 'pickle.gzip')
+
+    def test_sniff_legacy_gzip_pickle(self):
+        data = serialize_df(self.df)
+        self.assertEqual(sniff_codec(data).name, 'pickle.gzip')
+        pd.testing.assert_frame_equal(sniff_codec(data).deserialize(data), self.df)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            get_codec('unknown')
+        with self.assertRaises(ValueError):
+            sniff_codec(b'garbage')
+
+
+class PandasDataFrameCacheCodecTests(unittest.TestCase):
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        self.df = pd.DataFrame({'A': [1, 2, 3], 'B': [4, 5, 6]}, index=[1, 2, 3])
+
+    def test_update_with_codec(self):
+        cache = PandasDataFrameCache(max_memory=2**20, root_path=self.root_path, codec='arrow.zstd')
+        cache.update("key", self.df)
+        with open(os.path.join(self.root_path, "key"), "rb") as f:
+            self.assertEqual(sniff_codec(f.read()).name, 'arrow')
+        cache.unload_file("key")
+        pd.testing.assert_frame_equal(cache.get_dataframe("key"), self.df)
+
+    def test_get_dataframe_columns(self):
+        df = pd.DataFrame({'A': [1, 2, 3], 'B': [4, 5, 6], 'C': [7, 8, 9]}, index=[1, 2, 3])
+        for codec in ['pickle.gzip', 'arrow.lz4', 'parquet.zstd']:
+            with self.subTest(codec=codec):
+                cache = PandasDataFrameCache(max_memory=2**20, root_path=self.root_path, codec=codec)
+                cache.update(codec, df)
+                cache.unload_file(codec)
+                result = cache.get_dataframe(codec, 2, 3, columns=['C'])
+                pd.testing.assert_frame_equal(result, df.loc[2:3, ['C']])
+                # columnar files are read from disk while the whole file loads in the background
+                self.assertIn(codec, cache.file_futures)
+                pd.testing.assert_frame_equal(cache.get_file(codec), df)
+                self.assertGreater(cache.current_memory_usage, 0)
+                result = cache.get_dataframe(codec, 2, 3, columns=['C', 'A'])
+                pd.testing.assert_frame_equal(result, df.loc[2:3, ['C', 'A']])
+
+    def test_migrate(self):
+        with open(os.path.join(self.root_path, "key"), "wb") as f:
+            f.write(serialize_df(self.df))
+        cache = PandasDataFrameCache(max_memory=2**20, root_path=self.root_path, codec='pickle.zstd')
+        self.assertTrue(cache.migrate("key"))
+        self.assertFalse(cache.migrate("key"))
+        with open(os.path.join(self.root_path, "key"), "rb") as f:
+            self.assertEqual(sniff_codec(f.read()).name, 'pickle.zstd')
+        pd.testing.assert_frame_equal(cache.get_dataframe("key"), self.df)
+
+    def test_migrate_compression(self):
+        for source, target in [('arrow.lz4', 'arrow.zstd'), ('parquet.snappy', 'parquet.zstd'), ('arrow.zstd', 'arrow')]:
+            with self.subTest(source=source, target=target):
+                with open(os.path.join(self.root_path, "key"), "wb") as f:
+                    f.write(get_codec(source).serialize(self.df))
+                cache = PandasDataFrameCache(max_memory=2**20, root_path=self.root_path, codec=target)
+                self.assertTrue(cache.migrate("key"))
+                self.assertFalse(cache.migrate("key"))
+                self.assertTrue(get_codec(target).wrote_file(os.path.join(self.root_path, "key")))
+                self.assertFalse(get_codec(source).wrote_file(os.path.join(self.root_path, "key")))
+
+    def test_migrate_missing_key(self):
+        cache = PandasDataFrameCache(max_memory=2**20, root_path=self.root_path, codec='pickle.zstd')
+        self.assertFalse(cache.migrate("missing"))
+
+    def tearDown(self):
+        for f in os.listdir(self.root_path):
+            os.unlink(os.path.join(self.root_path, f))
+        os.rmdir(self.root_path)
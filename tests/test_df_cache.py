@@ -2,7 +2,10 @@ import unittest
 import pandas as pd
 import os
 import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from dfs.df_cache import PandasDataFrameCache
+from dfs.segments import scan_segments
 import tempfile
 import platform
 
@@ -26,6 +29,23 @@ class TestPandasDataFrameCache(unittest.TestCase):
         expected = self.df.loc[start:end]
         pd.testing.assert_frame_equal(result, expected)
 
+    def test_get_dataframe_open_ranges(self):
+        pd.testing.assert_frame_equal(self.cache.get_dataframe(self.test_file_1.name, 2, None), self.df.loc[2:])
+        pd.testing.assert_frame_equal(self.cache.get_dataframe(self.test_file_1.name, None, 2), self.df.loc[:2])
+        pd.testing.assert_frame_equal(self.cache.get_dataframe(self.test_file_1.name, 1.5, 2.5), self.df.loc[2:2])
+        self.assertEqual(len(self.cache.get_dataframe(self.test_file_1.name, 4, 5)), 0)
+
+    def test_get_dataframe_unsorted_index(self):
+        df = pd.DataFrame({'A': [1, 2, 3]}, index=[3, 1, 2])
+        result = self.cache._slice(df, 2, 3, "timestamp")
+        pd.testing.assert_frame_equal(result, df[(df.index >= 2) & (df.index <= 3)])
+
+    def test_get_dataframe_timestamp_index(self):
+        index = pd.date_range("2022-01-01", periods=10, freq="D")
+        df = pd.DataFrame({'A': range(10)}, index=index)
+        result = self.cache._slice(df, "2022-01-03", "2022-01-05", "timestamp")
+        pd.testing.assert_frame_equal(result, df[(df.index >= "2022-01-03") & (df.index <= "2022-01-05")])
+
     def test_append(self):
         new_df = pd.DataFrame({'A': [4, 5, 6], 'B': [7, 8, 9]}, index=[4, 5, 6])
         result = self.cache.update(self.test_file_1.name, new_df)
@@ -36,6 +56,24 @@ class TestPandasDataFrameCache(unittest.TestCase):
         with self.assertRaises(FileNotFoundError):
             self.cache.get_file('not_found.pickle')
 
+    def test_memory_accounting(self):
+        self.cache.unload_file(self.test_file_1.name)
+        self.assertEqual(self.cache.current_memory_usage, 0)
+        df = self.cache.get_file(self.test_file_1.name)
+        # accounted at its decoded size, not the size of the compressed file
+        self.assertEqual(self.cache.current_memory_usage, self.cache.sizer.size(df))
+        self.assertEqual(self.cache.current_memory_usage, self.cache.budget.used)
+
+    def test_process_pool(self):
+        with ProcessPoolExecutor(max_workers=1) as cpu_executor:
+            cache = PandasDataFrameCache(max_memory=2**20, cpu_executor=cpu_executor)
+            pd.testing.assert_frame_equal(cache.get_dataframe(self.test_file_1.name), self.df)
+            new_df = pd.DataFrame({'A': [4], 'B': [7]}, index=[4])
+            cache.update(self.test_file_1.name, new_df)
+            cache.unload_file(self.test_file_1.name)
+            # segmented files are merged in the worker process too
+            pd.testing.assert_frame_equal(cache.get_dataframe(self.test_file_1.name), pd.concat([self.df, new_df]))
+
     def test_memory_error(self):
         with self.assertRaises(MemoryError):
             self.cache = PandasDataFrameCache(max_memory=1)
@@ -45,6 +83,132 @@ class TestPandasDataFrameCache(unittest.TestCase):
         os.unlink(self.test_file_1.name)
 
 
+class TestSegmentedPandasDataFrameCache(unittest.TestCase):
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp(dir=tmp_dir)
+        self.cache = PandasDataFrameCache(max_memory=2**20, root_path=self.root_path, max_segments=4)
+        self.df = pd.DataFrame({'A': range(100)}, index=range(100))
+
+    def reload(self, key):
+        self.cache.unload_file(key)
+        return self.cache.get_file(key)
+
+    def test_updates_append_segments(self):
+        self.cache.update("key", self.df.iloc[:50])
+        self.assertEqual(scan_segments(os.path.join(self.root_path, "key"))[0], 0)
+        self.cache.update("key", self.df.iloc[50:80])
+        # rows already stored win over updates with the same index
+        result = self.cache.update("key", pd.DataFrame({'A': [-1, -2]}, index=[79, 80]))
+        self.assertEqual(scan_segments(os.path.join(self.root_path, "key"))[0], 3)
+        expected = pd.concat([self.df.iloc[:80], pd.DataFrame({'A': [-2]}, index=[80])])
+        pd.testing.assert_frame_equal(result, expected)
+        pd.testing.assert_frame_equal(self.reload("key"), expected)
+
+    def test_out_of_order_updates(self):
+        self.cache.update("key", self.df.iloc[50:])
+        self.cache.update("key", self.df.iloc[:50])
+        pd.testing.assert_frame_equal(self.reload("key"), self.df)
+
+    def test_compaction(self):
+        for i in range(10):
+            self.cache.update("key", self.df.iloc[i*10:(i+1)*10])
+        self.cache.compaction_executor.submit(lambda: None).result()
+        self.assertLessEqual(scan_segments(os.path.join(self.root_path, "key"))[0], self.cache.max_segments)
+        pd.testing.assert_frame_equal(self.reload("key"), self.df)
+        self.cache.update("key", self.df.iloc[:1])
+        self.assertTrue(self.cache.compact("key"))
+        self.assertEqual(scan_segments(os.path.join(self.root_path, "key"))[0], 0)
+        self.assertFalse(self.cache.compact("key"))
+        pd.testing.assert_frame_equal(self.reload("key"), self.df)
+
+    def test_group_commit(self):
+        self.cache.update("key", self.df.iloc[:10])
+        threads = [threading.Thread(target=self.cache.update, args=("key", self.df.iloc[i:i+1])) for i in range(10, 30)]
+        # hold the key's lock as if a write were in flight while the updates queue up
+        with self.cache._append_lock("key"):
+            for thread in threads:
+                thread.start()
+            while len(self.cache.update_queues.get("key", [])) < len(threads):
+                time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+        # all of the queued updates were written as one segment
+        self.assertEqual(scan_segments(os.path.join(self.root_path, "key"))[0], 2)
+        pd.testing.assert_frame_equal(self.reload("key"), self.df.iloc[:30])
+
+    def test_partial_segment(self):
+        self.cache.update("key", self.df.iloc[:50])
+        self.cache.update("key", self.df.iloc[50:60])
+        with open(os.path.join(self.root_path, "key"), "ab") as f:
+            f.write(b"\x00\x00\x00\x00\x00\x01\x00\x00partial")
+        pd.testing.assert_frame_equal(self.reload("key"), self.df.iloc[:60])
+        self.cache.update("key", self.df.iloc[60:])
+        pd.testing.assert_frame_equal(self.reload("key"), self.df)
+
+    def tearDown(self):
+        for path, _, files in os.walk(self.root_path, topdown=False):
+            for f in files:
+                os.unlink(os.path.join(path, f))
+            os.rmdir(path)
+
+
+class TestCompressedTierPandasDataFrameCache(unittest.TestCase):
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        self.cache = PandasDataFrameCache(max_memory=2**20, root_path=self.root_path, compressed_memory=2**20)
+        self.df = pd.DataFrame({'A': range(100), 'B': [str(i) for i in range(100)]})
+        self.cache.update("key", self.df)
+
+    def evict(self, file_name):
+        with self.cache.file_futures_lock:
+            self.cache._unload_file(file_name)
+
+    def test_promotion_skips_disk(self):
+        self.evict("key")
+        pd.testing.assert_frame_equal(self.cache.get_file("key"), self.df)
+        self.evict("key")
+        reads = []
+        read_file = self.cache._read_file
+        self.cache._read_file = lambda path: reads.append(path) or read_file(path)
+        pd.testing.assert_frame_equal(self.cache.get_file("key"), self.df)
+        self.assertEqual(reads, [])
+        stats = self.cache.tier_stats()
+        self.assertEqual(stats['memory']['misses'], 2)
+        self.assertEqual((stats['compressed']['hits'], stats['compressed']['misses']), (1, 1))
+        self.assertEqual(stats['compressed']['used'], os.path.getsize(os.path.join(self.root_path, "key")))
+
+    def test_update_invalidates(self):
+        self.evict("key")
+        self.cache.get_file("key")
+        new_df = pd.DataFrame({'A': [100], 'B': ['100']}, index=[100])
+        self.cache.update("key", new_df)
+        self.assertEqual(self.cache.compressed_memory_usage, 0)
+        self.evict("key")
+        pd.testing.assert_frame_equal(self.cache.get_file("key"), pd.concat([self.df, new_df]))
+
+    def test_unload_invalidates(self):
+        self.evict("key")
+        self.cache.get_file("key")
+        self.cache.unload_file("key")
+        self.assertEqual(len(self.cache.compressed), 0)
+        self.assertEqual(self.cache.compressed_memory_usage, 0)
+
+    def test_compressed_budget(self):
+        size = os.path.getsize(os.path.join(self.root_path, "key"))
+        self.cache.compressed_max_memory = size + 1
+        self.cache.update("other", self.df)
+        for name in ["key", "other", "key"]:
+            self.evict(name)
+            self.cache.get_file(name)
+            self.assertLessEqual(self.cache.compressed_memory_usage, size + 1)
+        self.assertEqual(list(self.cache.compressed), ["key"])
+
+    def tearDown(self):
+        for f in os.listdir(self.root_path):
+            os.unlink(os.path.join(self.root_path, f))
+        os.rmdir(self.root_path)
+
+
 class TestMultithreadedPandasDataFrameCache(unittest.TestCase):
     def setUp(self):
         self.test_file_1 = tempfile.NamedTemporaryFile(delete=False, dir=tmp_dir)
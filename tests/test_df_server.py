@@ -0,0 +1,345 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import pandas as pd
+
+from dfs.async_server import AsyncDataFrameServer, AsyncFileServer
+from dfs.df_cache import PandasDataFrameCache
+from dfs.df_client import DataFrameConnectionPool, FileClient
+from dfs.df_server import DataFrameServer, FileServer
+from dfs.file_cache import FileCache
+from dfs.helpers import recv_df, recv_json, recv_status, send_cmd, send_df
+
+
+class DataFrameServerTests(unittest.TestCase):
+    result_memory = None
+
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        self.cache = PandasDataFrameCache(max_memory=2**30, root_path=self.root_path, result_memory=self.result_memory)
+        self.server = self.create_server(self.cache)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+        self.wait_for_server()
+        self.pool = DataFrameConnectionPool(*self.server.server_address, max_connections=4)
+        index = pd.date_range("2022-01-01", periods=100, freq="min")
+        self.df = pd.DataFrame({'A': range(100), 'B': range(100, 200), 'C': range(200, 300)}, index=index)
+        with self.pool.get_connection() as c:
+            c.update(self.df, "prices", "abc")
+
+    def create_server(self, cache):
+        return DataFrameServer(cache, ('127.0.0.1', 0))
+
+    def wait_for_server(self):
+        pass
+
+    def test_filter(self):
+        with self.pool.get_connection() as c:
+            df = c.filter("prices", "abc")
+        pd.testing.assert_frame_equal(df, self.df, check_freq=False)
+
+    def test_filter_columns(self):
+        with self.pool.get_connection() as c:
+            df = c.filter("prices", "abc", range_start=str(self.df.index[10]), range_end=str(self.df.index[19]), columns=['C', 'A'])
+        pd.testing.assert_frame_equal(df, self.df.iloc[10:20][['C', 'A']], check_freq=False)
+
+    def test_wire_codecs(self):
+        for codec in ['pickle5', 'pickle', 'pickle.lz4', 'pickle.zstd', 'pickle.gzip', 'arrow', 'arrow.zstd']:
+            with self.subTest(codec=codec):
+                with self.pool.get_connection() as c:
+                    c.update(self.df, "prices", codec, codec=codec)
+                    df = c.filter("prices", codec, codec=codec)
+                pd.testing.assert_frame_equal(df, self.df, check_freq=False)
+
+    def test_negotiate(self):
+        with DataFrameConnectionPool(*self.server.server_address, max_connections=1, codecs=['unknown', 'pickle.lz4']) as pool:
+            with pool.get_connection() as c:
+                self.assertEqual(c.codec, 'pickle.lz4')
+                pd.testing.assert_frame_equal(c.filter("prices", "abc"), self.df, check_freq=False)
+
+    def test_stats(self):
+        with self.pool.get_connection() as c:
+            c.filter("prices", "abc")
+            stats = c.get_stats()
+        self.assertGreater(int(stats['tiers']['memory']['hits']), 0)
+
+    def test_migrate_missing_key(self):
+        with self.pool.get_connection() as c:
+            self.assertFalse(c.migrate("prices", "missing"))
+            pd.testing.assert_frame_equal(c.filter("prices", "abc"), self.df, check_freq=False)
+
+    def test_legacy_client(self):
+        with socket.create_connection(self.server.server_address) as conn:
+            send_cmd(conn, 'df:filter', key_path=["prices", "abc"])
+            pd.testing.assert_frame_equal(recv_df(conn), self.df, check_freq=False)
+
+    def test_filter_many(self):
+        with self.pool.get_connection() as c:
+            self.assertTrue(c.pipelining)
+            for i in range(20):
+                c.update(self.df.iloc[i:], "prices", str(i))
+            dfs = c.filter_many([("prices", str(i)) for i in range(20)], range_end=str(self.df.index[49]), columns=['A'], window=8)
+            for i, df in enumerate(dfs):
+                pd.testing.assert_frame_equal(df, self.df.iloc[i:50][['A']], check_freq=False)
+            # the connection is still in sync afterwards
+            pd.testing.assert_frame_equal(c.filter("prices", "abc"), self.df, check_freq=False)
+
+    def test_filter_iter(self):
+        with self.pool.get_connection() as c:
+            dfs = list(c.filter_iter("prices", "abc", range_end=str(self.df.index[49]), columns=['B'], batch_rows=16))
+            self.assertEqual([len(df) for df in dfs], [16, 16, 16, 2])
+            pd.testing.assert_frame_equal(pd.concat(dfs), self.df.iloc[:50][['B']], check_freq=False)
+            dfs = list(c.filter_iter("prices", "abc", range_start=str(pd.Timestamp("2023-01-01"))))
+            self.assertEqual(len(dfs), 1)
+            self.assertEqual(list(dfs[0].columns), ['A', 'B', 'C'])
+            self.assertTrue(all(df.empty for df in c.filter_iter("prices", "missing")))
+            # an abandoned stream doesn't leave the connection out of sync
+            stream = c.filter_iter("prices", "abc", batch_rows=10)
+            next(stream)
+            stream.close()
+            pd.testing.assert_frame_equal(c.filter("prices", "abc"), self.df, check_freq=False)
+
+    def test_mfilter(self):
+        other = self.df * 2
+        with self.pool.get_connection() as c:
+            c.update(other, "prices", "def")
+            dfs = c.mfilter([("prices", "abc"), ("prices", "missing"), ("prices", "def")], range_end=str(self.df.index[9]), columns=['A'])
+            self.assertEqual(len(dfs), 3)
+            pd.testing.assert_frame_equal(dfs[0], self.df.iloc[:10][['A']], check_freq=False)
+            self.assertTrue(dfs[1].empty)
+            pd.testing.assert_frame_equal(dfs[2], other.iloc[:10][['A']], check_freq=False)
+            df = c.mfilter([("prices", "abc"), ("prices", "missing"), ("prices", "def")], range_end=str(self.df.index[1]), key_column='key')
+            self.assertEqual(list(df.columns), ['key', 'A', 'B', 'C'])
+            self.assertEqual(df['key'].tolist(), ["prices/abc", "prices/abc", "prices/def", "prices/def"])
+            self.assertEqual(df['A'].tolist(), [0, 1, 0, 2])
+            df = c.mfilter([("prices", "missing")], key_column='key')
+            self.assertTrue(df.empty)
+            # the connection is still in sync afterwards
+            pd.testing.assert_frame_equal(c.filter("prices", "abc"), self.df, check_freq=False)
+
+    def test_query(self):
+        with self.pool.get_connection() as c:
+            df = c.query({'where': [['A', '>=', 10]], 'resample': {'rule': '30min', 'agg': 'ohlc'}}, "prices", "abc", range_end=str(self.df.index[69]), columns=['A'])
+            expected = self.df.iloc[10:70][['A']].resample('30min').ohlc()
+            pd.testing.assert_frame_equal(df, expected, check_freq=False)
+            with self.assertRaises(RuntimeError):
+                c.query({'agg': '__import__'}, "prices", "abc")
+            # a rejected query leaves the connection usable
+            df = c.query({'agg': 'max'}, "prices", "abc")
+            self.assertEqual(df.to_dict('records'), [{'A': 99, 'B': 199, 'C': 299}])
+            self.assertTrue(c.query({'head': 1}, "prices", "missing").empty)
+
+    def test_lookup(self):
+        with self.pool.get_connection() as c:
+            c.create_index("B", "prices", "abc")
+            df = c.lookup("B", "prices", "abc", values=[105, 150], columns=['A'])
+            pd.testing.assert_frame_equal(df, self.df.iloc[[5, 50]][['A']])
+            df = c.lookup("C", "prices", "abc", start=290)
+            pd.testing.assert_frame_equal(df, self.df.iloc[90:], check_freq=False)
+            with self.assertRaises(RuntimeError):
+                c.create_index("B", "prices", "abc", kind='btree')
+            with self.assertRaises(RuntimeError):
+                c.lookup("D", "prices", "abc", values=1)
+            # a rejected lookup leaves the connection usable
+            self.assertTrue(c.lookup("B", "prices", "missing", values=1).empty)
+
+    def test_pipelined_requests(self):
+        with socket.create_connection(self.server.server_address) as conn:
+            send_cmd(conn, 'df:update', request_id=0, key_path=["prices", "new"])
+            send_df(conn, self.df)
+            send_cmd(conn, 'df:filter', request_id=1, key_path=["prices", "new"])
+            send_cmd(conn, 'unknown', request_id=2)
+            send_cmd(conn, 'df:filter', request_id=3, key_path=["prices", "abc"], columns=['B'])
+            replies = {}
+            for _ in range(4):
+                reply = recv_json(conn)
+                if reply['request_id'] == 0:
+                    replies[0] = recv_status(conn)
+                elif reply['request_id'] == 2:
+                    replies[2] = reply['err']
+                else:
+                    replies[reply['request_id']] = recv_df(conn)
+            self.assertTrue(replies[0])
+            self.assertIn('unknown', replies[2])
+            pd.testing.assert_frame_equal(replies[1], self.df, check_freq=False)
+            pd.testing.assert_frame_equal(replies[3], self.df[['B']], check_freq=False)
+            # commands without a request_id are still answered in order
+            send_cmd(conn, 'df:filter', key_path=["prices", "abc"])
+            pd.testing.assert_frame_equal(recv_df(conn), self.df, check_freq=False)
+
+    def shutdown_server(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def tearDown(self):
+        self.pool._shutdown()
+        self.shutdown_server()
+        self.server_thread.join()
+        for path, _, files in os.walk(self.root_path, topdown=False):
+            for f in files:
+                os.unlink(os.path.join(path, f))
+            os.rmdir(path)
+
+
+class AsyncDataFrameServerTests(DataFrameServerTests):
+    def create_server(self, cache):
+        return AsyncDataFrameServer(cache, ('127.0.0.1', 0), max_workers=4)
+
+    def wait_for_server(self):
+        self.server.started.wait()
+
+    def shutdown_server(self):
+        self.server.shutdown()
+
+    def wait_for_connections(self, count):
+        deadline = time.monotonic() + 10
+        while len(self.server.connections) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertGreaterEqual(len(self.server.connections), count)
+
+    def test_idle_connections(self):
+        threads = threading.active_count()
+        existing = len(self.server.connections)
+        conns = [socket.create_connection(self.server.server_address) for _ in range(200)]
+        try:
+            self.wait_for_connections(existing + 200)
+            # accepted connections are served by the event loop without a thread each
+            self.assertLessEqual(threading.active_count(), threads)
+            with self.pool.get_connection() as c:
+                pd.testing.assert_frame_equal(c.filter("prices", "abc"), self.df, check_freq=False)
+        finally:
+            for conn in conns:
+                conn.close()
+
+    def test_slow_payloads_dont_block_workers(self):
+        # more clients than workers send an update command and never send its payload
+        conns = [socket.create_connection(self.server.server_address) for _ in range(8)]
+        try:
+            for conn in conns:
+                send_cmd(conn, 'df:update', key_path=["prices", "slow"])
+            with self.pool.get_connection() as c:
+                pd.testing.assert_frame_equal(c.filter("prices", "abc"), self.df, check_freq=False)
+        finally:
+            for conn in conns:
+                conn.close()
+
+
+class ResultCacheDataFrameServerTests(DataFrameServerTests):
+    result_memory = 2**20
+
+    def test_result_cache(self):
+        with self.pool.get_connection() as c:
+            for codec in ['pickle5', 'pickle.gzip']:
+                for _ in range(3):
+                    df = c.filter("prices", "abc", range_end=str(self.df.index[9]), codec=codec)
+                    pd.testing.assert_frame_equal(df, self.df.iloc[:10], check_freq=False)
+            stats = self.cache.tier_stats()['results']
+            self.assertEqual((stats['hits'], stats['misses']), (4, 2))
+            # an update drops the cached replies
+            new_df = pd.DataFrame({'A': [-1], 'B': [-1], 'C': [-1]}, index=[self.df.index[0] - pd.Timedelta(minutes=1)])
+            c.update(new_df, "prices", "abc")
+            self.assertEqual(len(c.filter("prices", "abc", range_end=str(self.df.index[9]), codec='pickle5')), 11)
+            c.filter("prices", "abc", range_end=str(self.df.index[9]), codec='pickle5')
+            c.unload("prices", "abc")
+            self.assertEqual(len(c.filter("prices", "abc", range_end=str(self.df.index[9]), codec='pickle5')), 11)
+            stats = self.cache.tier_stats()['results']
+            self.assertEqual((stats['hits'], stats['misses']), (5, 4))
+            self.assertEqual(stats['used'], self.cache.results.memory_usage)
+
+
+class FileServerTests(unittest.TestCase):
+    use_mmap = False
+
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        self.cache = FileCache(max_memory=2**22, root_path=self.root_path, use_mmap=self.use_mmap)
+        self.server = self.create_server(self.cache)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+        self.wait_for_server()
+        self.pool = DataFrameConnectionPool(*self.server.server_address, max_connections=4, client_class=FileClient)
+        self.contents = os.urandom(2**20 + 3)
+        with self.pool.get_connection() as c:
+            c.set(self.contents, "blobs", "abc")
+
+    def create_server(self, cache):
+        return FileServer(cache, ('127.0.0.1', 0))
+
+    def wait_for_server(self):
+        pass
+
+    def test_get(self):
+        with self.pool.get_connection() as c:
+            self.assertEqual(c.get("blobs", "abc"), self.contents)
+            c.set(b"", "blobs", "empty")
+            self.assertEqual(c.get("blobs", "empty"), b"")
+
+    def test_set(self):
+        with self.pool.get_connection() as c:
+            c.set(b"updated", "blobs", "abc")
+            self.assertEqual(c.get("blobs", "abc"), b"updated")
+
+    def test_get_range(self):
+        with self.pool.get_connection() as c:
+            self.assertEqual(c.get("blobs", "abc", offset=10, length=100), self.contents[10:110])
+            self.assertEqual(c.get("blobs", "abc", length=4), self.contents[:4])
+            self.assertEqual(c.get("blobs", "abc", offset=len(self.contents) - 3), self.contents[-3:])
+            self.cache.unload_file(os.path.join("blobs", "abc"))
+            self.assertEqual(c.get("blobs", "abc", offset=10, length=100), self.contents[10:110])
+            self.assertNotIn(os.path.join("blobs", "abc"), self.cache.file_futures)
+
+    def test_get_stream(self):
+        # larger than the cache can hold
+        contents = os.urandom(5*2**20 + 1)
+        with open(os.path.join(self.root_path, "blobs", "large"), "wb") as f:
+            f.write(contents)
+        with self.pool.get_connection() as c:
+            chunks = list(c.get_stream("blobs", "large", chunk_size=2**20))
+            self.assertEqual(len(chunks), 6)
+            self.assertEqual(b"".join(chunks), contents)
+            self.assertEqual(b"".join(c.get_stream("blobs", "large", offset=2**20, length=2**21 + 5)), contents[2**20:2**20 + 2**21 + 5])
+            self.assertEqual(c.get("blobs", "large", offset=5*2**20), contents[5*2**20:])
+            # an abandoned stream doesn't leave the connection out of sync
+            stream = c.get_stream("blobs", "large", chunk_size=2**20)
+            next(stream)
+            stream.close()
+            self.assertEqual(c.get("blobs", "abc"), self.contents)
+
+    def test_pipelined_stream(self):
+        with socket.create_connection(self.server.server_address) as conn:
+            send_cmd(conn, 'get:stream', request_id=0, key_path=["blobs", "abc"])
+            self.assertIn('pipelined', recv_json(conn)['err'])
+
+    def shutdown_server(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def tearDown(self):
+        self.pool._shutdown()
+        self.shutdown_server()
+        self.server_thread.join()
+        for path, _, files in os.walk(self.root_path, topdown=False):
+            for f in files:
+                os.unlink(os.path.join(path, f))
+            os.rmdir(path)
+
+
+class MmapFileServerTests(FileServerTests):
+    use_mmap = True
+
+
+class AsyncMmapFileServerTests(FileServerTests):
+    use_mmap = True
+
+    def create_server(self, cache):
+        return AsyncFileServer(cache, ('127.0.0.1', 0), max_workers=4)
+
+    def wait_for_server(self):
+        self.server.started.wait()
+
+    def shutdown_server(self):
+        self.server.shutdown()
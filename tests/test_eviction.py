@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+
+from dfs.eviction import LRUPolicy, TinyLFUPolicy, eviction_policies, get_eviction_policy
+from dfs.file_cache import FileCache
+
+
+def request(policy, resident, key, size, max_memory):
+    """
+    Request a key the way FileCache does, returning True on a hit.
+    """
+    policy.access(key)
+    if key in resident:
+        return True
+    if sum(resident.values()) + size > max_memory and not policy.admit(key, size):
+        return False
+    while sum(resident.values()) + size > max_memory:
+        victim = policy.victim()
+        policy.remove(victim)
+        del resident[victim]
+    policy.insert(key, size)
+    resident[key] = size
+    return False
+
+
+class EvictionPolicyTests(unittest.TestCase):
+    def test_lru(self):
+        policy = LRUPolicy(100)
+        for key in "abc":
+            policy.insert(key, 10)
+        policy.access("a")
+        self.assertEqual(policy.victim(), "b")
+        policy.remove("b")
+        self.assertEqual(policy.victim(), "c")
+
+    def test_tinylfu_resists_scans(self):
+        max_memory = 1000
+        policy = TinyLFUPolicy(max_memory)
+        resident = {}
+        hot = [f"hot_{i}" for i in range(8)]
+        for _ in range(5):
+            for key in hot:
+                request(policy, resident, key, 100, max_memory)
+        for i in range(100):
+            request(policy, resident, f"scan_{i}", 100, max_memory)
+        self.assertTrue(all(key in resident for key in hot))
+        # the same scan flushes an LRU cache
+        policy = LRUPolicy(max_memory)
+        resident = {}
+        for _ in range(5):
+            for key in hot:
+                request(policy, resident, key, 100, max_memory)
+        for i in range(100):
+            request(policy, resident, f"scan_{i}", 100, max_memory)
+        self.assertFalse(any(key in resident for key in hot))
+
+    def test_tinylfu_is_size_aware(self):
+        max_memory = 1000
+        policy = TinyLFUPolicy(max_memory)
+        resident = {}
+        small = [f"small_{i}" for i in range(90)]
+        for _ in range(2):
+            for key in small:
+                request(policy, resident, key, 10, max_memory)
+        # requested more often than any one small file, but less than the files it would displace
+        for _ in range(4):
+            request(policy, resident, "large", 500, max_memory)
+        self.assertTrue(all(key in resident for key in small))
+        self.assertNotIn("large", resident)
+
+    def test_tinylfu_admits_frequent_files(self):
+        max_memory = 1000
+        policy = TinyLFUPolicy(max_memory)
+        resident = {}
+        for i in range(10):
+            request(policy, resident, f"old_{i}", 100, max_memory)
+        for _ in range(5):
+            request(policy, resident, "new", 100, max_memory)
+            request(policy, resident, "other", 100, max_memory)
+        self.assertIn("new", resident)
+
+    def test_get_eviction_policy(self):
+        for name, policy in eviction_policies.items():
+            self.assertIs(get_eviction_policy(name), policy)
+        with self.assertRaises(ValueError):
+            get_eviction_policy('unknown')
+
+
+class FileCacheEvictionPolicyTests(unittest.TestCase):
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        for i in range(50):
+            with open(os.path.join(self.root_path, f"key_{i}"), "wb") as f:
+                f.write(bytes([i]) * 100)
+
+    def test_scan_keeps_hot_files(self):
+        file_cache = FileCache(max_memory=1000, root_path=self.root_path, eviction_policy='tinylfu')
+        hot = [f"key_{i}" for i in range(5)]
+        for _ in range(5):
+            for name in hot:
+                file_cache.get_file(name)
+        for i in range(5, 50):
+            self.assertEqual(file_cache.get_file(f"key_{i}"), bytes([i]) * 100)
+            self.assertLessEqual(file_cache.current_memory_usage, 1000)
+        self.assertTrue(all(name in file_cache.file_futures for name in hot))
+        self.assertEqual(file_cache.current_memory_usage, file_cache.budget.used)
+
+    def tearDown(self):
+        for f in os.listdir(self.root_path):
+            os.unlink(os.path.join(self.root_path, f))
+        os.rmdir(self.root_path)
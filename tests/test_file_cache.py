@@ -1,3 +1,4 @@
+import mmap
 import os
 import platform
 import random
@@ -5,9 +6,10 @@ import tempfile
 import threading
 import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing.pool import ThreadPool
 
-from dfs.file_cache import FileCache
+from dfs.file_cache import CacheBusyError, FileCache, TMP_SUFFIX
 
 # TODO: add MacOS RAM disk
 # hdiutil attach -nomount ram://$((2 * 1024 * 100))
@@ -39,21 +41,30 @@ class FileCacheTests(unittest.TestCase):
         self.assertEqual(self.file_cache.file_futures[info[0].name][1], info[2])
         self.assertEqual(contents, info[1])
         self.assertEqual(len(self.file_cache.file_access_times), 1)
-        self.assertEqual(info[0].name, self.file_cache.file_access_times[0][1])
+        self.assertEqual(info[0].name, next(iter(self.file_cache.file_access_times)))
 
     def test_get_file_with_eviction(self):
         for i in range(2):
             for info in self.file_contents.values():
                 expected_memory_usage = self.file_cache.current_memory_usage + info[2]
                 if expected_memory_usage > self.file_cache.max_memory:
-                    oldest_size = self.file_cache.file_futures[self.file_cache.file_access_times[0][1]][1]
+                    oldest_size = self.file_cache.file_futures[next(iter(self.file_cache.file_access_times))][1]
                     expected_memory_usage -= oldest_size
                 contents = self.file_cache.get_file(info[0].name)
                 self.assertEqual(self.file_cache.current_memory_usage, expected_memory_usage)
                 self.assertTrue(info[0].name in self.file_cache.file_futures)
                 self.assertEqual(self.file_cache.file_futures[info[0].name][1], info[2])
                 self.assertEqual(contents, info[1])
-                self.assertEqual(info[0].name, self.file_cache.file_access_times[-1][1])
+                self.assertEqual(info[0].name, next(reversed(self.file_cache.file_access_times)))
+
+    def test_get_file_hit_updates_recency(self):
+        names = [info[0].name for info in list(self.file_contents.values())[:3]]
+        for name in names:
+            self.file_cache.get_file(name)
+        self.assertEqual(names[0], next(iter(self.file_cache.file_access_times)))
+        self.file_cache.get_file(names[0])
+        self.assertEqual(names[1], next(iter(self.file_cache.file_access_times)))
+        self.assertEqual(names[0], next(reversed(self.file_cache.file_access_times)))
 
     def test_get_file_multithreaded(self):
         def get_file_thread(file, data, size):
@@ -91,10 +102,11 @@ class FileCacheTests(unittest.TestCase):
         new_contents = gen_data()
         updated = self.file_cache.update_file(info[0].name, new_contents)
         self.assertTrue(updated)
+        self.assertFalse(os.path.exists(info[0].name + TMP_SUFFIX))
         self.assertTrue(info[0].name in self.file_cache.file_futures)
         self.assertEqual(self.file_cache.current_memory_usage, len(new_contents))
         self.assertEqual(len(self.file_cache.file_access_times), 1)
-        self.assertEqual(info[0].name, self.file_cache.file_access_times[0][1])
+        self.assertEqual(info[0].name, next(iter(self.file_cache.file_access_times)))
 
         # Check that the updated file is returned
         content = self.file_cache.get_file(info[0].name)
@@ -181,5 +193,198 @@ class FileCacheTests(unittest.TestCase):
         for v in self.file_contents.values():
             os.unlink(v[0].name)
 
+class FileCacheAccountingTests(unittest.TestCase):
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.file_cache = FileCache(max_memory=2**20, root_path=self.root_path, executor=self.executor)
+        with open(os.path.join(self.root_path, "key"), "wb") as f:
+            f.write(b"contents")
+
+    def block_executor(self):
+        event = threading.Event()
+        self.executor.submit(event.wait)
+        return event
+
+    def test_memory_reserved_while_loading(self):
+        event = self.block_executor()
+        future = self.file_cache.load_file("key")
+        self.assertEqual(self.file_cache.current_memory_usage, len(b"contents"))
+        event.set()
+        self.assertEqual(future.result(), b"contents")
+        self.assertEqual(self.file_cache.current_memory_usage, len(b"contents"))
+
+    def test_unload_while_loading(self):
+        event = self.block_executor()
+        future = self.file_cache.load_file("key")
+        self.file_cache.unload_file("key")
+        self.assertEqual(self.file_cache.current_memory_usage, 0)
+        event.set()
+        self.assertEqual(future.result(), b"contents")
+        self.assertNotIn("key", self.file_cache.file_futures)
+        self.assertEqual(self.file_cache.current_memory_usage, 0)
+        self.assertEqual(self.file_cache.budget.used, 0)
+
+    def test_update_while_loading(self):
+        event = self.block_executor()
+        future = self.file_cache.load_file("key")
+        thread = threading.Thread(target=self.file_cache.update_file, args=("key", b"updated contents"))
+        thread.start()
+        event.set()
+        thread.join()
+        future.result()
+        self.assertEqual(self.file_cache.get_file("key"), b"updated contents")
+        self.assertEqual(self.file_cache.current_memory_usage, len(b"updated contents"))
+        self.assertEqual(self.file_cache.budget.used, len(b"updated contents"))
+
+    def test_reservation_reconciled(self):
+        class DoublingFileCache(FileCache):
+            def process_contents(self, contents):
+                return contents, 2 * len(contents)
+        file_cache = DoublingFileCache(max_memory=2**20, root_path=self.root_path)
+        file_cache.get_file("key")
+        self.assertEqual(file_cache.current_memory_usage, 2 * len(b"contents"))
+        self.assertGreater(file_cache.size_ratio, 1)
+        self.assertGreater(file_cache.estimate_memory(100), 100)
+        file_cache.unload_file("key")
+        self.assertEqual(file_cache.budget.used, 0)
+
+    def test_failed_load_is_retried(self):
+        class FailingFileCache(FileCache):
+            failures = 1
+            def process_contents(self, contents):
+                if self.failures > 0:
+                    self.failures -= 1
+                    raise ValueError("corrupt")
+                return super().process_contents(contents)
+        file_cache = FailingFileCache(max_memory=2**20, root_path=self.root_path)
+        with self.assertRaises(ValueError):
+            file_cache.get_file("key")
+        self.assertNotIn("key", file_cache.file_futures)
+        self.assertEqual(file_cache.current_memory_usage, 0)
+        self.assertEqual(file_cache.get_file("key"), b"contents")
+
+    def tearDown(self):
+        self.executor.shutdown()
+        for f in os.listdir(self.root_path):
+            os.unlink(os.path.join(self.root_path, f))
+        os.rmdir(self.root_path)
+
+
+class FileCacheLoadingTests(unittest.TestCase):
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        for name in ["a", "b"]:
+            with open(os.path.join(self.root_path, name), "wb") as f:
+                f.write(name.encode() * 10)
+
+    def block_executor(self):
+        event = threading.Event()
+        self.executor.submit(event.wait)
+        return event
+
+    def test_fail_fast(self):
+        file_cache = FileCache(max_memory=2**20, root_path=self.root_path, executor=self.executor, max_pending_loads=1, admission_timeout=0)
+        event = self.block_executor()
+        future = file_cache.load_file("a")
+        with self.assertRaises(CacheBusyError):
+            file_cache.load_file("b")
+        # requests for a file that's already loading don't wait
+        self.assertIs(file_cache.load_file("a"), future)
+        self.assertEqual(file_cache.tier_stats()['memory']['rejected_loads'], 1)
+        event.set()
+        self.assertEqual(future.result(), b"a" * 10)
+        self.assertEqual(file_cache.get_file("b"), b"b" * 10)
+        self.assertEqual(file_cache.pending_loads, 0)
+
+    def test_backpressure(self):
+        file_cache = FileCache(max_memory=2**20, root_path=self.root_path, executor=self.executor, max_pending_loads=1)
+        event = self.block_executor()
+        future = file_cache.load_file("a")
+        results = []
+        thread = threading.Thread(target=lambda: results.append(file_cache.get_file("b")))
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        self.assertNotIn("b", file_cache.file_futures)
+        event.set()
+        thread.join()
+        self.assertEqual(results, [b"b" * 10])
+        self.assertEqual(future.result(), b"a" * 10)
+
+    def test_failed_load_frees_slot(self):
+        file_cache = FileCache(max_memory=2**20, root_path=self.root_path, executor=self.executor, max_pending_loads=1, admission_timeout=1)
+        os.unlink(os.path.join(self.root_path, "a"))
+        with self.assertRaises(FileNotFoundError):
+            file_cache.get_file("a")
+        self.assertEqual(file_cache.pending_loads, 0)
+        self.assertEqual(file_cache.get_file("b"), b"b" * 10)
+
+    def test_cpu_executor(self):
+        threads = []
+        class RecordingFileCache(FileCache):
+            def process_contents(self, contents):
+                threads.append(threading.current_thread().name)
+                return super().process_contents(contents)
+        cpu_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cpu")
+        file_cache = RecordingFileCache(max_memory=2**20, root_path=self.root_path, executor=self.executor, cpu_executor=cpu_executor)
+        self.assertEqual(file_cache.get_file("a"), b"a" * 10)
+        file_cache.update_file("b", b"updated")
+        self.assertEqual(file_cache.get_file("b"), b"updated")
+        self.assertTrue(len(threads) == 2 and all(name.startswith("cpu") for name in threads))
+        cpu_executor.shutdown()
+
+    def tearDown(self):
+        self.executor.shutdown()
+        for f in os.listdir(self.root_path):
+            os.unlink(os.path.join(self.root_path, f))
+        os.rmdir(self.root_path)
+
+class MmapFileCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        self.file_cache = FileCache(max_memory=2**20, root_path=self.root_path, use_mmap=True)
+        self.file_cache.update_file("key", b"original")
+        self.file_cache.unload_file("key")
+
+    def test_get_file(self):
+        contents = self.file_cache.get_file("key")
+        self.assertIsInstance(contents, mmap.mmap)
+        self.assertEqual(contents[:], b"original")
+        self.assertEqual(self.file_cache.current_memory_usage, len(b"original"))
+
+    def test_update_file(self):
+        old_contents = self.file_cache.get_file("key")
+        self.assertTrue(self.file_cache.update_file("key", b"updated"))
+        # the old map still sees the contents it was created with
+        self.assertEqual(old_contents[:], b"original")
+        contents = self.file_cache.get_file("key")
+        self.assertIsInstance(contents, mmap.mmap)
+        self.assertEqual(contents[:], b"updated")
+        self.assertEqual(self.file_cache.current_memory_usage, len(b"updated"))
+
+    def test_read_range(self):
+        # from disk, without loading the file
+        self.assertEqual(self.file_cache.read_range("key", 2, 3), b"igi")
+        self.assertNotIn("key", self.file_cache.file_futures)
+        self.file_cache.get_file("key")
+        self.assertEqual(self.file_cache.read_range("key", 2, 3), b"igi")
+        self.assertEqual(self.file_cache.read_range("key", 6), b"al")
+        self.assertEqual(self.file_cache.read_range("key", 20, 5), b"")
+        self.assertEqual([bytes(c) for c in self.file_cache.iter_range("key", 1, 5, chunk_size=2)], [b"ri", b"gi", b"n"])
+        with self.assertRaises(ValueError):
+            self.file_cache.read_range("key", -1)
+
+    def test_empty_file(self):
+        self.file_cache.update_file("empty", b"")
+        self.file_cache.unload_file("empty")
+        self.assertEqual(self.file_cache.get_file("empty"), b"")
+
+    def tearDown(self):
+        for f in os.listdir(self.root_path):
+            os.unlink(os.path.join(self.root_path, f))
+        os.rmdir(self.root_path)
+
 if __name__ == '__main__':
   unittest.main()
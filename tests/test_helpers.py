@@ -0,0 +1,40 @@
+import os
+import socket
+import threading
+import unittest
+
+from dfs.helpers import recv_msg, send_msg
+
+
+class FramingTests(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+
+    def send_in_thread(self, msg):
+        thread = threading.Thread(target=send_msg, args=(self.a, msg))
+        thread.start()
+        return thread
+
+    def test_round_trip(self):
+        thread = self.send_in_thread(b"hello")
+        self.assertEqual(recv_msg(self.b), b"hello")
+        thread.join()
+
+    def test_empty_message(self):
+        thread = self.send_in_thread(b"")
+        self.assertEqual(recv_msg(self.b), b"")
+        thread.join()
+
+    def test_large_scatter_gather_message(self):
+        parts = [os.urandom(2**20), b"", bytearray(os.urandom(3*2**20 + 7)), memoryview(os.urandom(11))]
+        thread = self.send_in_thread(parts)
+        self.assertEqual(recv_msg(self.b), b"".join(parts))
+        thread.join()
+
+    def test_closed_connection(self):
+        self.a.close()
+        self.assertIsNone(recv_msg(self.b))
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
@@ -0,0 +1,117 @@
+import gc
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from dfs.df_cache import PandasDataFrameCache
+from dfs.indexes import HashIndex, SortedIndex, get_index_kind
+from dfs.sharded_cache import ShardedPandasDataFrameCache
+
+
+class IndexTests(unittest.TestCase):
+    def test_sorted_index(self):
+        index = SortedIndex(pd.Series([5, 3, 9, 3, 7]))
+        self.assertEqual(sorted(index.lookup([3])), [1, 3])
+        self.assertEqual(sorted(index.lookup([9, 4, 5])), [0, 2])
+        self.assertEqual(sorted(index.range(4, 7)), [0, 4])
+        self.assertEqual(sorted(index.range(start=7)), [2, 4])
+        self.assertEqual(sorted(index.range(end=3)), [1, 3])
+        self.assertEqual(len(index.range(8, 4)), 0)
+        self.assertGreater(index.nbytes, 0)
+
+    def test_sorted_index_timestamps(self):
+        index = SortedIndex(pd.Series(pd.to_datetime(["2022-01-03", "2022-01-01", "2022-01-02"])))
+        # values are converted to the column's type, so timestamps can be given as strings
+        self.assertEqual(list(index.lookup(["2022-01-02"])), [2])
+        self.assertEqual(sorted(index.range("2022-01-02", None)), [0, 2])
+
+    def test_hash_index(self):
+        index = HashIndex(pd.Series(["b", "a", None, "c", "a", "b"]))
+        self.assertEqual(sorted(index.lookup(["a", "b"])), [0, 1, 4, 5])
+        self.assertEqual(len(index.lookup(["z"])), 0)
+        with self.assertRaises(ValueError):
+            index.range("a", "b")
+
+    def test_get_index_kind(self):
+        self.assertIs(get_index_kind('sorted'), SortedIndex)
+        self.assertIs(get_index_kind('hash'), HashIndex)
+        with self.assertRaises(ValueError):
+            get_index_kind('btree')
+
+
+class DataFrameIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        index = pd.date_range("2022-01-01", periods=100, freq="min")
+        self.df = pd.DataFrame({'order_id': np.arange(100)[::-1], 'sym': ['abc', 'def', 'ghi', 'jkl'] * 25, 'price': np.arange(100) * 0.5}, index=index)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+
+    def test_lookup(self):
+        df_cache = PandasDataFrameCache(max_memory=2**20, root_path=self.root_path)
+        df_cache.update("df", self.df)
+        df_cache.create_index("df", "order_id")
+        df_cache.create_index("df", "sym", kind='hash')
+        pd.testing.assert_frame_equal(df_cache.lookup("df", "order_id", 42), self.df[self.df.order_id == 42])
+        pd.testing.assert_frame_equal(df_cache.lookup("df", "order_id", start=10, end=19), self.df[self.df.order_id.between(10, 19)])
+        pd.testing.assert_frame_equal(df_cache.lookup("df", "sym", ['def', 'jkl'], columns=['price']), self.df[self.df.sym.isin(['def', 'jkl'])][['price']])
+        # columns without an index are scanned
+        pd.testing.assert_frame_equal(df_cache.lookup("df", "price", start=49.0), self.df[self.df.price >= 49.0])
+        self.assertEqual(set(df_cache.indexes["df"][1].keys()), {"order_id", "sym"})
+        with self.assertRaises(ValueError):
+            df_cache.lookup("df", "sym", start='abc')
+        with self.assertRaises(ValueError):
+            df_cache.lookup("df", "unknown", 1)
+        with self.assertRaises(ValueError):
+            df_cache.create_index("df", "sym", kind='btree')
+        self.assertTrue(df_cache.lookup("missing", "sym", 'abc').empty)
+
+    def test_index_memory(self):
+        df_cache = PandasDataFrameCache(max_memory=2**20, root_path=self.root_path)
+        df_cache.update("df", self.df)
+        memory_usage = df_cache.current_memory_usage
+        df_cache.create_index("df", "order_id")
+        df_cache.lookup("df", "order_id", 1)
+        index_memory = df_cache.indexes["df"][1]["order_id"].nbytes
+        self.assertEqual(df_cache.current_memory_usage, memory_usage + index_memory)
+        self.assertEqual(df_cache.file_futures["df"][1], memory_usage + index_memory)
+        # built once per DataFrame
+        df_cache.lookup("df", "order_id", 2)
+        self.assertEqual(df_cache.current_memory_usage, memory_usage + index_memory)
+        df_cache.unload_file("df")
+        self.assertNotIn("df", df_cache.indexes)
+        self.assertEqual(df_cache.current_memory_usage, 0)
+
+    def test_update(self):
+        df_cache = PandasDataFrameCache(max_memory=2**20, root_path=self.root_path)
+        df_cache.create_index("df", "order_id")
+        df_cache.update("df", self.df.iloc[:50])
+        # indexes are rebuilt with the updated DataFrame
+        first = df_cache.indexes["df"][1]["order_id"]
+        df_cache.update("df", self.df.iloc[50:])
+        self.assertIsNot(df_cache.indexes["df"][1]["order_id"], first)
+        pd.testing.assert_frame_equal(df_cache.lookup("df", "order_id", [0, 99]), self.df.iloc[[0, 99]], check_freq=False)
+
+    def test_evicted(self):
+        df_cache = PandasDataFrameCache(max_memory=2**20, root_path=self.root_path)
+        # a copy, since the DataFrame passed to update is the one cached
+        df_cache.update("df", self.df.copy())
+        df_cache.create_index("df", "order_id")
+        df_cache.lookup("df", "order_id", 1)
+        with df_cache.file_futures_lock:
+            df_cache._unload_file("df")
+        gc.collect()
+        # dropped with the evicted DataFrame, and built again after it's loaded
+        self.assertNotIn("df", df_cache.indexes)
+        pd.testing.assert_frame_equal(df_cache.lookup("df", "order_id", 1), self.df[self.df.order_id == 1])
+        self.assertIn("df", df_cache.indexes)
+
+    def test_sharded(self):
+        df_cache = ShardedPandasDataFrameCache(max_memory=2**20, root_path=self.root_path, num_shards=4)
+        df_cache.update("df", self.df)
+        df_cache.create_index("df", "sym", kind='hash')
+        pd.testing.assert_frame_equal(df_cache.lookup("df", "sym", 'ghi'), self.df[self.df.sym == 'ghi'])
@@ -0,0 +1,64 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from dfs.query import QueryError, apply_query
+
+
+class QueryTests(unittest.TestCase):
+    def setUp(self):
+        index = pd.date_range("2022-01-01", periods=120, freq="min", name="ts")
+        self.df = pd.DataFrame({'sym': ['a', 'b', 'c'] * 40, 'price': np.arange(120.0), 'volume': np.arange(120)}, index=index)
+
+    def test_where(self):
+        df = apply_query(self.df, {'where': [['sym', 'in', ['a', 'b']], ['price', 'between', [10, 20]], ['ts', '<', '2022-01-01 00:15']]})
+        expected = self.df[self.df.sym.isin(['a', 'b']) & (self.df.price >= 10) & (self.df.price <= 20) & (self.df.index < '2022-01-01 00:15')]
+        pd.testing.assert_frame_equal(df, expected)
+        self.assertEqual(len(apply_query(self.df, {'where': [['sym', 'notnull'], ['sym', 'contains', 'b']]})), 40)
+
+    def test_groupby(self):
+        df = apply_query(self.df, {'groupby': 'sym', 'agg': {'price': 'mean', 'volume': ['sum', 'max']}})
+        pd.testing.assert_frame_equal(df, self.df.groupby('sym').agg({'price': 'mean', 'volume': ['sum', 'max']}))
+        df = apply_query(self.df, {'groupby': ['sym'], 'agg': 'size'})
+        self.assertEqual(df['size'].tolist(), [40, 40, 40])
+
+    def test_agg(self):
+        df = apply_query(self.df, {'agg': {'price': 'max', 'volume': 'sum'}})
+        self.assertEqual(df.to_dict('records'), [{'price': 119.0, 'volume': 7140}])
+
+    def test_resample(self):
+        df = apply_query(self.df, {'resample': {'rule': '30min', 'agg': 'ohlc'}})
+        pd.testing.assert_frame_equal(df, self.df[['price', 'volume']].resample('30min').ohlc())
+        df = apply_query(self.df, {'resample': {'rule': '1h', 'agg': {'price': 'ohlc', 'volume': 'sum'}}})
+        self.assertEqual(df[('volume', 'volume')].tolist(), [1770, 5370])
+        df = apply_query(self.df, {'resample': {'rule': '1h', 'agg': 'mean'}})
+        self.assertEqual(list(df.columns), ['price', 'volume'])
+        with self.assertRaises(QueryError):
+            apply_query(self.df.reset_index(), {'resample': {'rule': '1h'}})
+
+    def test_downsample_head_tail(self):
+        df = apply_query(self.df, {'downsample': 7})
+        self.assertLessEqual(len(df), 7)
+        pd.testing.assert_frame_equal(df, self.df.iloc[::18])
+        pd.testing.assert_frame_equal(apply_query(self.df, {'head': 5}), self.df.head(5))
+        pd.testing.assert_frame_equal(apply_query(self.df, {'where': [['sym', '==', 'c']], 'tail': 2}), self.df[self.df.sym == 'c'].tail(2))
+
+    def test_invalid(self):
+        for query in [
+                'price > 1',
+                {'eval': 'price > 1'},
+                {'where': [['missing', '==', 1]]},
+                {'where': [['price', 'matches', 1]]},
+                {'where': [['price', 'between', 1]]},
+                {'agg': '__import__'},
+                {'groupby': 'missing', 'agg': 'sum'},
+                {'groupby': 'sym', 'resample': {'rule': '1h'}},
+                {'resample': {'rule': 'bad'}},
+                {'downsample': 0}]:
+            with self.subTest(query=query):
+                with self.assertRaises(QueryError):
+                    apply_query(self.df, query)
+
+    def test_empty(self):
+        self.assertTrue(apply_query(pd.DataFrame(), {'resample': {'rule': '1h', 'agg': 'ohlc'}}).empty)
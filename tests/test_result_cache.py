@@ -0,0 +1,47 @@
+import unittest
+
+from dfs.result_cache import ResultCache
+
+
+class ResultCacheTests(unittest.TestCase):
+    def test_get_and_put(self):
+        results = ResultCache(max_memory=100)
+        data, version = results.get("key", (1, 2))
+        self.assertIsNone(data)
+        results.put("key", (1, 2), version, b"x" * 10)
+        self.assertEqual(results.get("key", (1, 2)), (b"x" * 10, version))
+        self.assertIsNone(results.get("key", (1, 3))[0])
+        self.assertEqual(results.stats(), {'hits': 1, 'misses': 2, 'used': 10, 'max': 100})
+
+    def test_lru(self):
+        results = ResultCache(max_memory=100)
+        for i in range(3):
+            results.put("key", i, 0, b"x" * 40)
+        self.assertIsNone(results.get("key", 0)[0])
+        self.assertIsNotNone(results.get("key", 1)[0])
+        results.put("key", 3, 0, b"x" * 40)
+        self.assertIsNone(results.get("key", 2)[0])
+        self.assertIsNotNone(results.get("key", 1)[0])
+        self.assertEqual(results.memory_usage, 80)
+        # replies larger than the cache aren't cached
+        results.put("key", 4, 0, b"x" * 101)
+        self.assertIsNone(results.get("key", 4)[0])
+
+    def test_invalidate(self):
+        results = ResultCache(max_memory=100)
+        _, version = results.get("key", 0)
+        results.put("key", 0, version, b"x")
+        results.put("other", 0, version, b"y")
+        results.invalidate("key")
+        self.assertIsNone(results.get("key", 0)[0])
+        self.assertIsNotNone(results.get("other", 0)[0])
+        self.assertEqual(results.memory_usage, 1)
+        # a reply computed before the invalidation isn't cached
+        results.put("key", 0, version, b"x")
+        self.assertIsNone(results.get("key", 0)[0])
+
+    def test_disabled(self):
+        results = ResultCache()
+        self.assertEqual(results.get("key", 0), (None, None))
+        results.put("key", 0, None, b"x")
+        self.assertEqual(results.memory_usage, 0)
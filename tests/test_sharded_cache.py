@@ -0,0 +1,131 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import pandas as pd
+
+from dfs.sharded_cache import ShardedFileCache, ShardedPandasDataFrameCache
+from tests.test_file_cache import gen_file
+
+
+class ShardedFileCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.file_contents = {i:gen_file() for i in range(20)}
+        self.file_cache = ShardedFileCache(max_memory=2**20, num_shards=4)
+
+    def test_shared_budget(self):
+        self.assertEqual(len(self.file_cache.shards), 4)
+        for shard in self.file_cache.shards:
+            self.assertIs(shard.budget, self.file_cache.budget)
+
+    def test_large_file_uses_global_budget(self):
+        file_cache = ShardedFileCache(max_memory=1000, num_shards=4)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b"x" * 600)
+            f.flush()
+            self.assertEqual(len(file_cache.get_file(f.name)), 600)
+            self.assertEqual(file_cache.current_memory_usage, 600)
+
+    def test_evicts_from_other_shards(self):
+        file_cache = ShardedFileCache(max_memory=1000, num_shards=4)
+        files = []
+        try:
+            for i in range(8):
+                f = tempfile.NamedTemporaryFile(delete=False)
+                f.write(bytes([i]) * 300)
+                f.close()
+                files.append(f.name)
+                file_cache.get_file(f.name)
+                self.assertLessEqual(file_cache.current_memory_usage, 1000)
+                self.assertEqual(file_cache.current_memory_usage, file_cache.budget.used)
+                # the most recently loaded file is always resident, wherever the older ones were
+                self.assertIn(f.name, file_cache.file_futures)
+            self.assertEqual(file_cache.current_memory_usage, 900)
+        finally:
+            for name in files:
+                os.unlink(name)
+
+    def test_shard_for_is_stable(self):
+        for info in self.file_contents.values():
+            self.assertIs(self.file_cache.shard_for(info[0].name), self.file_cache.shard_for(info[0].name))
+
+    def test_get_and_unload_file(self):
+        for info in self.file_contents.values():
+            self.assertEqual(self.file_cache.get_file(info[0].name), info[1])
+        self.assertEqual(self.file_cache.current_memory_usage, sum(x[2] for x in self.file_contents.values()))
+        self.assertEqual(set(self.file_cache.file_futures.keys()), {x[0].name for x in self.file_contents.values()})
+        for info in self.file_contents.values():
+            self.file_cache.unload_file(info[0].name)
+        self.assertEqual(self.file_cache.current_memory_usage, 0)
+
+    def test_update_file(self):
+        info = self.file_contents[0]
+        self.assertTrue(self.file_cache.update_file(info[0].name, b"updated"))
+        self.assertEqual(self.file_cache.get_file(info[0].name), b"updated")
+
+    def test_memory_budget(self):
+        file_cache = ShardedFileCache(max_memory=200, num_shards=2)
+        for info in self.file_contents.values():
+            file_cache.get_file(info[0].name)
+            self.assertLessEqual(file_cache.current_memory_usage, file_cache.max_memory)
+
+    def tearDown(self):
+        for v in self.file_contents.values():
+            os.unlink(v[0].name)
+
+
+class ShardedPandasDataFrameCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        self.cache = ShardedPandasDataFrameCache(max_memory=2**30, root_path=self.root_path, num_shards=4)
+
+    def test_update_concurrently(self):
+        def run_append(key, start_i):
+            values = list(range(start_i, start_i+100))
+            self.cache.update(key, pd.DataFrame({'A': values}, index=values))
+
+        threads = [threading.Thread(target=run_append, args=(f"key_{i % 5}", i*100)) for i in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for i in range(5):
+            self.assertEqual(len(self.cache.get_dataframe(f"key_{i}")), 1000)
+        df = self.cache.get_dataframe("key_0", 100, 199)
+        self.assertEqual(len(df), 0)
+        df = self.cache.get_dataframe("key_0", 0, 99)
+        self.assertEqual(len(df), 100)
+
+    def test_get_dataframes(self):
+        names = [f"key_{i}" for i in range(8)]
+        for i, name in enumerate(names):
+            self.cache.update(name, pd.DataFrame({'A': range(i, i + 10)}))
+            self.cache.unload_file(name)
+        dfs = self.cache.get_dataframes(names + ["missing"], 0, 4, range_type="index", columns=['A'])
+        self.assertEqual([df['A'].tolist() for df in dfs[:-1]], [list(range(i, i + 4)) for i in range(8)])
+        self.assertTrue(dfs[-1].empty)
+        stats = self.cache.tier_stats()
+        self.assertEqual((stats['memory']['hits'], stats['memory']['misses']), (0, 8))
+
+    def test_compressed_tier(self):
+        cache = ShardedPandasDataFrameCache(max_memory=2**20, root_path=self.root_path, num_shards=4, compressed_memory=2**20)
+        self.assertTrue(all(shard.compressed_max_memory == 2**18 for shard in cache.shards))
+        df = pd.DataFrame({'A': range(10)})
+        for i in range(8):
+            cache.update(f"key_{i}", df)
+            # evict the DataFrame, leaving its file in the compressed tier
+            shard = cache.shard_for(f"key_{i}")
+            with shard.file_futures_lock:
+                shard._unload_file(f"key_{i}")
+            cache.get_file(f"key_{i}")
+        stats = cache.tier_stats()
+        self.assertEqual(stats['memory']['misses'], 8)
+        self.assertEqual(stats['compressed']['misses'], 8)
+        self.assertEqual(stats['compressed']['max'], 2**20)
+
+    def tearDown(self):
+        for f in os.listdir(self.root_path):
+            os.unlink(os.path.join(self.root_path, f))
+        os.rmdir(self.root_path)
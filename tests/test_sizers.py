@@ -0,0 +1,35 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from dfs.sizers import DeepSizer, SampledSizer, get_sizer, sizers
+
+
+class SizerTests(unittest.TestCase):
+    def setUp(self):
+        n = 100000
+        rng = np.random.default_rng(0)
+        self.df = pd.DataFrame({
+            'A': np.arange(n),
+            'B': rng.random(n),
+            'C': ['x' * int(i) for i in rng.integers(0, 50, n)],
+        }, index=pd.date_range("2022-01-01", periods=n, freq="s"))
+
+    def test_sampled_estimate(self):
+        exact = DeepSizer().size(self.df)
+        estimate = SampledSizer().size(self.df)
+        self.assertAlmostEqual(estimate / exact, 1, delta=0.05)
+        # numeric frames are measured exactly
+        self.assertEqual(SampledSizer().size(self.df[['A', 'B']]), DeepSizer().size(self.df[['A', 'B']]))
+
+    def test_small_frames_are_exact(self):
+        df = self.df.iloc[:100]
+        self.assertEqual(SampledSizer().size(df), DeepSizer().size(df))
+        self.assertEqual(SampledSizer().size(pd.DataFrame()), DeepSizer().size(pd.DataFrame()))
+
+    def test_get_sizer(self):
+        for name, sizer in sizers.items():
+            self.assertIs(get_sizer(name), sizer)
+        with self.assertRaises(ValueError):
+            get_sizer('unknown')
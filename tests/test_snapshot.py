@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import pandas as pd
+
+from dfs.df_cache import PandasDataFrameCache
+from dfs.file_cache import FileCache
+from dfs.sharded_cache import ShardedFileCache
+from dfs.snapshot import HotSetSnapshotter, read_snapshot, save_snapshot, warm_up
+
+
+class SnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.root_path = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(tempfile.mkdtemp(), 'hot_set.json')
+        for i in range(10):
+            with open(os.path.join(self.root_path, f"file_{i}"), 'wb') as f:
+                f.write(os.urandom(100))
+
+    def tearDown(self):
+        shutil.rmtree(self.root_path)
+        shutil.rmtree(os.path.dirname(self.snapshot_path))
+
+    def test_hot_set(self):
+        file_cache = FileCache(max_memory=1000, root_path=self.root_path)
+        for name in ["file_0", "file_1", "file_2"]:
+            file_cache.get_file(name)
+        for _ in range(3):
+            file_cache.get_file("file_2")
+        file_cache.get_file("file_0")
+        hot_set = file_cache.hot_set()
+        # the most frequently used file first, then by recency
+        self.assertEqual([f['name'] for f in hot_set], ["file_2", "file_0", "file_1"])
+        self.assertEqual(hot_set[0]['accesses'], 4)
+        self.assertEqual(hot_set[0]['memory'], 100)
+        file_cache.unload_file("file_2")
+        self.assertEqual([f['name'] for f in file_cache.hot_set()], ["file_0", "file_1"])
+
+    def test_save_and_read(self):
+        file_cache = FileCache(max_memory=1000, root_path=self.root_path)
+        self.assertEqual(read_snapshot(self.snapshot_path), [])
+        for name in ["file_0", "file_1", "file_1"]:
+            file_cache.get_file(name)
+        saved = save_snapshot(file_cache, self.snapshot_path)
+        self.assertEqual(read_snapshot(self.snapshot_path), saved)
+        self.assertEqual([f['name'] for f in saved], ["file_1", "file_0"])
+        with open(self.snapshot_path, 'w') as f:
+            f.write("{not json")
+        self.assertEqual(read_snapshot(self.snapshot_path), [])
+
+    def test_warm_up(self):
+        file_cache = FileCache(max_memory=550, root_path=self.root_path)
+        file_cache.get_file("file_9")
+        names = ["missing"] + [f"file_{i}" for i in range(10)]
+        self.assertEqual(warm_up(file_cache, names), 4)
+        # warming up stops when memory is full, without evicting what was loaded by requests
+        self.assertEqual(set(file_cache.file_futures.keys()), {"file_9", "file_0", "file_1", "file_2", "file_3"})
+        self.assertEqual(file_cache.current_memory_usage, 500)
+        self.assertEqual((file_cache.hits, file_cache.misses), (0, 1))
+        self.assertEqual(file_cache.get_file("file_0"), open(os.path.join(self.root_path, "file_0"), 'rb').read())
+        self.assertEqual(file_cache.hits, 1)
+
+    def test_warm_up_rate(self):
+        file_cache = FileCache(max_memory=1000, root_path=self.root_path)
+        start = time.monotonic()
+        self.assertEqual(warm_up(file_cache, ["file_0", "file_1", "file_2"], max_bytes_per_second=1000), 3)
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        # a stopped warm up loads nothing more
+        stop_event = threading.Event()
+        stop_event.set()
+        self.assertEqual(warm_up(file_cache, ["file_3"], stop_event=stop_event), 0)
+
+    def test_sharded(self):
+        file_cache = ShardedFileCache(max_memory=1000, root_path=self.root_path, num_shards=4)
+        for name in ["file_0", "file_1", "file_1"]:
+            file_cache.get_file(name)
+        self.assertEqual([f['name'] for f in file_cache.hot_set()], ["file_1", "file_0"])
+        save_snapshot(file_cache, self.snapshot_path)
+        restarted = ShardedFileCache(max_memory=1000, root_path=self.root_path, num_shards=4)
+        self.assertEqual(warm_up(restarted, [f['name'] for f in read_snapshot(self.snapshot_path)]), 2)
+        self.assertEqual(set(restarted.file_futures.keys()), {"file_0", "file_1"})
+
+    def test_snapshotter(self):
+        file_cache = FileCache(max_memory=1000, root_path=self.root_path)
+        with HotSetSnapshotter(file_cache, self.snapshot_path, interval=0.05):
+            file_cache.get_file("file_0")
+            time.sleep(0.2)
+            self.assertEqual([f['name'] for f in read_snapshot(self.snapshot_path)], ["file_0"])
+            file_cache.get_file("file_1")
+        # saved again when stopped
+        self.assertEqual({f['name'] for f in read_snapshot(self.snapshot_path)}, {"file_0", "file_1"})
+        restarted = FileCache(max_memory=1000, root_path=self.root_path)
+        snapshotter = HotSetSnapshotter(restarted, self.snapshot_path)
+        snapshotter.start()
+        snapshotter.warm_up_thread.join()
+        self.assertEqual(set(restarted.file_futures.keys()), {"file_0", "file_1"})
+        snapshotter.stop()
+
+    def test_dataframes(self):
+        df_cache = PandasDataFrameCache(max_memory=2**20, root_path=self.root_path)
+        df = pd.DataFrame({'a': range(100)})
+        df_cache.update("df", df)
+        df_cache.get_dataframe("df")
+        save_snapshot(df_cache, self.snapshot_path)
+        restarted = PandasDataFrameCache(max_memory=2**20, root_path=self.root_path)
+        self.assertEqual(warm_up(restarted, [f['name'] for f in read_snapshot(self.snapshot_path)]), 1)
+        pd.testing.assert_frame_equal(restarted.get_dataframe("df"), df)